@@ -0,0 +1,124 @@
+"""
+So sánh gửi email kiểu cũ (mỗi thư một kết nối SMTP, tuần tự) với mail_delivery.deliver
+(kết nối dùng lại theo lô, thread pool, giới hạn tốc độ) trên máy chủ SMTP giả lập.
+
+Máy chủ là aiosmtpd chạy cục bộ (pip install aiosmtpd, chỉ cần cho script này),
+có thể giả lập độ trễ bắt tay (EHLO, thay cho TLS + đăng nhập) và độ trễ mỗi thư.
+Không cần database: thư được dựng sẵn như trong tasks/email_reminders.py.
+
+Chạy: python bench_mail_delivery.py [--messages 500] [--workers 4] [--batch 50]
+                                    [--rate 0] [--handshake-ms 50] [--latency-ms 5]
+"""
+import argparse
+import asyncio
+import socket
+import sys
+import threading
+import time
+
+
+class StandInHandler:
+    """Handler aiosmtpd đếm thư nhận được, có độ trễ giả lập"""
+
+    def __init__(self, handshake, latency):
+        self.handshake = handshake
+        self.latency = latency
+        self.received = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        with self._lock:
+            self.connections += 1
+        await asyncio.sleep(self.handshake)
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(self.latency)
+        with self._lock:
+            self.received += 1
+        return '250 OK'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def build_messages(count):
+    from flask_mail import Message
+    return [(i, Message(subject=f'Nhắc nhở: Sách "Sách {i}" sắp đến hạn trả',
+                        recipients=[f'reader{i}@example.com'],
+                        body=f'Xin chào Reader {i},\n\nHạn trả sách: 01/01/2030\n'))
+            for i in range(count)]
+
+
+def send_one_by_one(messages):
+    """Cách cũ: mail.send() mở một kết nối mới cho từng thư, tuần tự"""
+    from src.extensions import mail
+    started = time.monotonic()
+    for _, message in messages:
+        mail.send(message)
+    return time.monotonic() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--batch', type=int, default=50)
+    parser.add_argument('--rate', type=float, default=0, help='thư/giây, 0 = không giới hạn')
+    parser.add_argument('--handshake-ms', type=float, default=50)
+    parser.add_argument('--latency-ms', type=float, default=5)
+    parser.add_argument('--skip-baseline', action='store_true')
+    args = parser.parse_args()
+
+    try:
+        from aiosmtpd.controller import Controller
+    except ImportError:
+        print('Cần aiosmtpd: pip install aiosmtpd')
+        sys.exit(2)
+
+    from flask import Flask
+    from src.extensions import mail
+    from src.services.mail_delivery import deliver
+
+    handler = StandInHandler(args.handshake_ms / 1000, args.latency_ms / 1000)
+    port = free_port()
+    controller = Controller(handler, hostname='127.0.0.1', port=port)
+    controller.start()
+    try:
+        app = Flask(__name__)
+        app.config.update(
+            MAIL_SERVER='127.0.0.1', MAIL_PORT=port,
+            MAIL_USE_TLS=False, MAIL_DEFAULT_SENDER='library@example.com',
+            MAIL_WORKERS=args.workers, MAIL_BATCH_SIZE=args.batch, MAIL_RATE_LIMIT=args.rate,
+        )
+        mail.init_app(app)
+
+        with app.app_context():
+            if not args.skip_baseline:
+                seconds = send_one_by_one(build_messages(args.messages))
+                print(f'Mỗi thư một kết nối : {args.messages} thư  {seconds:7.2f}s  '
+                      f'{args.messages / seconds:7.1f} email/s  {handler.connections} kết nối')
+                baseline = seconds
+            before = handler.received
+            handler.connections = 0
+            stats = deliver(build_messages(args.messages), 'email thử')
+            print(f'deliver()            : {stats.sent} thư  {stats.seconds:7.2f}s  '
+                  f'{stats.rate:7.1f} email/s  {handler.connections} kết nối, {stats.failed} lỗi')
+            if not args.skip_baseline:
+                print(f'Nhanh hơn {baseline / stats.seconds:.1f} lần')
+    finally:
+        controller.stop()
+
+    if stats.failed or handler.received - before != args.messages:
+        print(f'❌ Máy chủ nhận {handler.received - before}/{args.messages} thư')
+        sys.exit(1)
+    print('✅ Máy chủ nhận đủ thư')
+
+
+if __name__ == '__main__':
+    main()
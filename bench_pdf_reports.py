@@ -0,0 +1,53 @@
+"""
+Đo thời gian dựng bảng lớn của báo cáo PDF (build_table_pdf) từ 1.000 đến 100.000 dòng.
+
+Dòng giả lập có dạng giống báo cáo mượn/trả, không cần database. Script in thời
+gian và thời gian mỗi 1.000 dòng cho từng cỡ, rồi báo lỗi nếu thời gian mỗi
+dòng ở cỡ lớn nhất vượt quá `--tolerance` lần cỡ nhỏ nhất (không còn tuyến tính).
+
+Chạy: python bench_pdf_reports.py [--rows 1000 10000 100000] [--tolerance 1.5]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+
+def fake_rows(count):
+    for i in range(count):
+        yield [str(i + 1), f'Độc giả {i % 997}', f'Sách số {i % 4999}', '01/03/2025',
+               '15/03/2025', '-' if i % 3 else '14/03/2025', '-', 'Đang mượn']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 50000, 100000])
+    parser.add_argument('--tolerance', type=float, default=1.5)
+    args = parser.parse_args()
+
+    from src.services.pdf_reports import build_table_pdf, BORROW_HEADER, BORROW_COL_WIDTHS
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'bench.pdf')
+        for count in sorted(args.rows):
+            started = time.perf_counter()
+            build_table_pdf(path, 'BENCHMARK', [f'{count} dòng'],
+                            BORROW_HEADER, BORROW_COL_WIDTHS, fake_rows(count), size=500)
+            elapsed = time.perf_counter() - started
+            per_thousand = elapsed / count * 1000
+            results.append(per_thousand)
+            print(f'{count:>8} dòng  {elapsed:8.2f}s  {per_thousand * 1000:7.1f} ms/1000 dòng'
+                  f'  {os.path.getsize(path) / 1024 / 1024:6.1f} MB')
+
+    ratio = results[-1] / results[0]
+    print(f'\nTỉ lệ thời gian mỗi dòng (lớn nhất / nhỏ nhất): {ratio:.2f}')
+    if ratio > args.tolerance:
+        print(f'❌ Thời gian dựng không còn tuyến tính (>{args.tolerance})')
+        sys.exit(1)
+    print('✅ Thời gian dựng tăng tuyến tính theo số dòng')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+Kiểm tra kế hoạch truy vấn (EXPLAIN QUERY PLAN) của các truy vấn nóng trên SQLite.
+
+Script chạy các trang/API/tác vụ trong loans.py, reservations.py, dashboard.py và
+tasks/email_reminders.py trên một database SQLite tạm, ghi lại mọi câu SELECT,
+rồi báo lỗi nếu bảng borrow_records hoặc reservations bị quét toàn bộ (full scan).
+
+Chạy: python check_query_plans.py [-v]   (mã thoát 1 nếu có truy vấn bị full scan)
+"""
+import os
+import re
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+CHECKED_TABLES = ('borrow_records', 'reservations')
+
+# Truy vấn theo thiết kế cần đọc toàn bộ lịch sử (regex trên câu SQL)
+FULL_HISTORY_ALLOWED = []
+
+
+def seed(db, User, Book, BorrowRecord, Reservation):
+    users = [User(email=f'reader{i}@example.com', name=f'Reader {i}', password_hash='-')
+             for i in range(20)]
+    admin = User(email='admin@example.com', name='Admin', password_hash='-', is_admin=True)
+    books = [Book(title=f'Book {i}', author=f'Author {i % 7}', category=f'Cat {i % 5}',
+                  isbn=f'isbn-{i}', total_copies=3, available_copies=1 if i % 4 else 0)
+             for i in range(50)]
+    db.session.add_all(users + books + [admin])
+    db.session.flush()
+    today = date.today()
+    for i in range(400):
+        returned = datetime.utcnow() - timedelta(days=i % 30) if i % 3 == 0 else None
+        db.session.add(BorrowRecord(
+            user_id=users[i % 20].id, book_id=books[i % 50].id,
+            borrowed_at=datetime.utcnow() - timedelta(days=i),
+            due_date=today + timedelta(days=(i % 40) - 20),
+            returned_at=returned, status='returned' if returned else 'borrowed'))
+    for i in range(100):
+        db.session.add(Reservation(user_id=users[i % 20].id, book_id=books[i % 50].id,
+                                   fulfilled=i % 5 == 0))
+    db.session.commit()
+    return admin, users, books
+
+
+def exercise(app, admin_id, reader_id, book_id, borrow_id):
+    """Gọi các đường dẫn nóng để ghi lại câu SQL thực tế mà chúng sinh ra"""
+    from src.tasks.email_reminders import send_due_reminders, send_overdue_notifications
+    from src.services.holds import expire_holds
+
+    def client_for(user_id):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        return client
+
+    admin_client = client_for(admin_id)
+    reader_client = client_for(reader_id)
+    month_ago = (date.today() - timedelta(days=30)).isoformat()
+
+    steps = [
+        (reader_client, 'post', f'/loans/api/borrow/{book_id}'),
+        (reader_client, 'get', '/loans/my-loans'),
+        (reader_client, 'post', f'/loans/api/return/{borrow_id}'),
+        (admin_client, 'get', '/loans/all?status=all'),
+        (admin_client, 'get', '/loans/all?status=active'),
+        (admin_client, 'get', '/loans/all?status=overdue&sort=due_asc'),
+        (admin_client, 'get', '/loans/all?status=returned'),
+        (admin_client, 'get', f'/loans/all?patron={reader_id}&date_from={month_ago}'),
+        (reader_client, 'post', f'/reservations/api/reserve/{book_id}'),
+        (reader_client, 'get', '/reservations/my-reservations'),
+        (admin_client, 'get', '/reservations/all?fulfilled=false'),
+        (admin_client, 'get', '/reservations/all?fulfilled=true'),
+        (admin_client, 'get', '/dashboard/'),
+        (admin_client, 'get', '/dashboard/api/stats'),
+        (reader_client, 'get', '/dashboard/'),
+    ]
+    for client, method, url in steps:
+        response = getattr(client, method)(url)
+        if response.status_code >= 500:
+            raise RuntimeError(f'{method.upper()} {url} -> {response.status_code}')
+
+    with app.app_context():
+        send_due_reminders()
+        send_overdue_notifications()
+        expire_holds(now=datetime.utcnow() + timedelta(days=30))
+
+
+def full_scans(connection, statement, parameters):
+    """Trả về các dòng kế hoạch quét toàn bộ bảng cần kiểm tra"""
+    plan = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+    details = [row[-1] for row in plan]
+    bad = [d for d in details
+           if re.match(r'SCAN (%s)\b' % '|'.join(CHECKED_TABLES), d) and 'USING' not in d]
+    return bad, details
+
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmpdir, 'plans.db')}"
+
+    from sqlalchemy import event
+    from src.config import Config
+    Config.MAIL_SUPPRESS_SEND = True
+    Config.MAIL_DEFAULT_SENDER = 'library@example.com'
+
+    from src.app import create_app
+    from src.extensions import db
+    from src.models import User, Book, BorrowRecord, Reservation
+    from src.services.counters import reconcile
+
+    app = create_app()
+    app.config['TESTING'] = True
+    verbose = '-v' in sys.argv[1:]
+
+    with app.app_context():
+        db.create_all()
+        admin, users, books = seed(db, User, Book, BorrowRecord, Reservation)
+        reconcile()  # bộ đếm tổng như init_database.py
+        reader = users[1]
+        # Sách chưa có ai mượn, còn bản, để mượn/đặt trước thành công
+        book = Book(title='Probe', total_copies=1, available_copies=1)
+        db.session.add(book)
+        db.session.commit()
+        borrow_id = BorrowRecord.query.filter_by(user_id=reader.id, returned_at=None).first().id
+        admin_id, reader_id, book_id = admin.id, reader.id, book.id
+        engine = db.engine
+
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and not executemany:
+            captured.append((statement, parameters))
+
+    # Chạy ngoài app context: mỗi request có app context (và flask_login user) riêng
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        exercise(app, admin_id, reader_id, book_id, borrow_id)
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+
+    failures = []
+    checked = 0
+    seen = set()
+    with engine.connect() as connection:
+        for statement, parameters in captured:
+            if statement in seen or not any(t in statement for t in CHECKED_TABLES):
+                continue
+            seen.add(statement)
+            checked += 1
+            bad, details = full_scans(connection, statement, parameters)
+            if verbose:
+                print('\n' + ' '.join(statement.split()))
+                for detail in details:
+                    print('   -> ' + detail)
+            if bad and not any(p.search(statement) for p in FULL_HISTORY_ALLOWED):
+                failures.append((statement, details))
+
+    print(f'Đã kiểm tra {checked} truy vấn trên {", ".join(CHECKED_TABLES)}')
+    if failures:
+        for statement, details in failures:
+            print('\n❌ FULL SCAN:')
+            print('   ' + ' '.join(statement.split()))
+            for detail in details:
+                print('   -> ' + detail)
+        sys.exit(1)
+    print('✅ Không có truy vấn nóng nào bị full scan')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Kiểm tra số câu SQL của báo cáo, file xuất và email nhắc nhở không phụ thuộc số dòng.
+
+Script dựng một database SQLite tạm, chạy các đường dẫn (báo cáo PDF phiếu
+mượn/sách, xuất CSV/XLSX, các tác vụ email) và đếm số câu SQL mỗi đường dẫn gửi
+xuống database, rồi thêm dòng và đếm lại. Hai lần đếm khác nhau là dấu hiệu N+1
+(lazy load `record.user` / `record.book` cho từng dòng).
+
+Chạy: python check_statement_counts.py [-v]   (mã thoát 1 nếu số câu SQL thay đổi)
+"""
+import io
+import os
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+SIZES = (20, 300)  # số phiếu mượn lần đếm đầu / lần đếm sau
+
+# Lô yield_per cố định, lớn hơn số dòng nhiều nhất: số câu SQL không đổi theo lô
+CHUNK_ROWS = 1000
+
+
+def seed(db, User, Book, BorrowRecord, rows, start=0):
+    users = [User(email=f'reader{start + i}@example.com', name=f'Reader {start + i}', password_hash='-')
+             for i in range(max(rows // 10, 2))]
+    books = [Book(title=f'Book {start + i}', author=f'Author {i % 7}', category=f'Cat {i % 5}',
+                  isbn=f'isbn-{start + i}', total_copies=3, available_copies=1)
+             for i in range(max(rows // 5, 2))]
+    db.session.add_all(users + books)
+    db.session.flush()
+    today = date.today()
+    reminder_day = today + timedelta(days=3)
+    for i in range(rows):
+        # Một phần ba đến hạn sau 3 ngày, một phần ba quá hạn, còn lại đã trả
+        kind = i % 3
+        returned = datetime.utcnow() - timedelta(days=1) if kind == 2 else None
+        db.session.add(BorrowRecord(
+            user_id=users[i % len(users)].id, book_id=books[i % len(books)].id,
+            borrowed_at=datetime.utcnow() - timedelta(days=20),
+            due_date=reminder_day if kind == 0 else today - timedelta(days=5),
+            returned_at=returned, status='returned' if returned else 'borrowed'))
+    db.session.commit()
+
+
+def exercise(app):
+    """Tên đường dẫn -> hàm chạy đường dẫn đó (trong app context)"""
+    from src.services import exports
+    from src.services.pdf_reports import write_borrows_report, write_books_report
+    from src.tasks.email_reminders import send_due_reminders, send_overdue_notifications, enqueue_digests
+
+    def drain(chunks):
+        for _ in chunks:
+            pass
+
+    return {
+        'pdf borrows': lambda: write_borrows_report(io.BytesIO(), 'all'),
+        'pdf borrows overdue': lambda: write_borrows_report(io.BytesIO(), 'overdue'),
+        'pdf books': lambda: write_books_report(io.BytesIO()),
+        'csv borrows': lambda: drain(exports.iter_export('csv', *exports.borrow_export_rows('all'))),
+        'xlsx books': lambda: drain(exports.iter_export('xlsx', *exports.book_export_rows())),
+        'email due': send_due_reminders,
+        'email overdue': send_overdue_notifications,
+        'email digest': lambda: enqueue_digests(date.today()),
+    }
+
+
+def count_statements(app, engine):
+    """Số câu SQL (danh sách câu) của từng đường dẫn trên dữ liệu hiện tại"""
+    from sqlalchemy import event
+    from src.extensions import db
+
+    counts = {}
+    for name, run in exercise(app).items():
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        db.session.remove()
+        event.listen(engine, 'before_cursor_execute', capture)
+        try:
+            run()
+        finally:
+            event.remove(engine, 'before_cursor_execute', capture)
+        counts[name] = statements
+    return counts
+
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmpdir, 'counts.db')}"
+
+    from src.config import Config
+    Config.MAIL_SUPPRESS_SEND = True
+    Config.MAIL_DEFAULT_SENDER = 'library@example.com'
+    Config.REPORT_DIR = os.path.join(tmpdir, 'reports')
+    verbose = '-v' in sys.argv[1:]
+
+    from src.app import create_app
+    from src.extensions import db
+    from src.models import User, Book, BorrowRecord
+    from src.services.counters import reconcile
+
+    app = create_app()
+    app.config.update(TESTING=True, REPORT_CHUNK_ROWS=CHUNK_ROWS)
+    with app.app_context():
+        db.create_all()
+        # Đếm trên database nhỏ, thêm dòng rồi đếm lại trên chính database đó
+        seed(db, User, Book, BorrowRecord, SIZES[0])
+        reconcile()  # bộ đếm tổng như init_database.py
+        small = count_statements(app, db.engine)
+        seed(db, User, Book, BorrowRecord, SIZES[1] - SIZES[0], start=SIZES[0])
+        large = count_statements(app, db.engine)
+
+    failures = []
+    for name, statements in small.items():
+        print(f'{name:<22} {len(statements):>3} câu SQL ({SIZES[0]} dòng)'
+              f'  {len(large[name]):>3} câu SQL ({SIZES[1]} dòng)')
+        if verbose:
+            for statement in large[name]:
+                print('   ' + ' '.join(statement.split())[:160])
+        if len(statements) != len(large[name]):
+            failures.append(name)
+
+    if failures:
+        print(f'\n❌ Số câu SQL tăng theo số dòng: {", ".join(failures)}')
+        sys.exit(1)
+    print('\n✅ Số câu SQL không phụ thuộc số dòng')
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ Sử dụng: python create_admin.py
 """
 from src.app import create_app
 from src.models import User, db
+from src.services import counters
 
 app = create_app()
 
@@ -25,6 +26,7 @@ with app.app_context():
         admin = User(email=email, name=name, is_admin=True)
         admin.set_password(password)
         db.session.add(admin)
+        counters.bump(total_users=1)
         db.session.commit()
         print("Đã tạo tài khoản admin thành công!")
 
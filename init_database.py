@@ -34,6 +34,30 @@ def init_database():
             print("  - books")
             print("  - borrow_records")
             print("  - reservations")
+            print("  - daily_circulation_stats")
+            print("  - counters")
+            print("  - email_outbox")
+            
+            # create_all() không thêm chỉ mục mới vào bảng đã tồn tại
+            for table in db.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(db.engine, checkfirst=True)
+            
+            # Chỉ mục tìm kiếm toàn văn (FTS5 / tsvector) cho database đã có sẵn
+            from src.services.search import ensure_search_index
+            if ensure_search_index():
+                print("✅ Đã tạo chỉ mục tìm kiếm sách")
+            
+            # Bảng tổng hợp lưu thông mới tạo trên database đã có lịch sử mượn/trả
+            from src.models import DailyCirculationStat
+            from src.services.circulation_stats import backfill_stats
+            if DailyCirculationStat.query.first() is None and BorrowRecord.query.first() is not None:
+                print(f"✅ Đã dựng bảng tổng hợp lưu thông: {backfill_stats()} dòng")
+            
+            # Đồng bộ bộ đếm tổng cho dashboard
+            from src.services.counters import reconcile
+            reconcile()
+            print("✅ Đã đồng bộ bộ đếm thống kê")
             
             # Kiểm tra xem đã có admin chưa
             admin_count = User.query.filter_by(is_admin=True).count()
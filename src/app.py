@@ -1,4 +1,5 @@
 from flask import Flask, render_template
+import multiprocessing
 import os
 from .config import Config
 from .extensions import db, migrate, login_manager, mail, scheduler
@@ -23,38 +24,18 @@ def create_app():
     mail.init_app(app)
     scheduler.init_app(app)
     
-    # Chỉ start scheduler nếu chưa chạy (tránh lỗi khi reload)
-    if not scheduler.running:
-        scheduler.start()
-        
-        # Thiết lập scheduler jobs
-        from .tasks.email_reminders import send_due_reminders, send_overdue_notifications
-        
-        # Gửi email nhắc nhở hàng ngày lúc 9:00 AM
-        try:
-            scheduler.add_job(
-                id='send_due_reminders',
-                func=send_due_reminders,
-                trigger='cron',
-                hour=9,
-                minute=0,
-                replace_existing=True
-            )
-        except Exception:
-            pass  # Job đã tồn tại
-        
-        # Gửi email cảnh báo quá hạn hàng ngày lúc 9:30 AM
-        try:
-            scheduler.add_job(
-                id='send_overdue_notifications',
-                func=send_overdue_notifications,
-                trigger='cron',
-                hour=9,
-                minute=30,
-                replace_existing=True
-            )
-        except Exception:
-            pass  # Job đã tồn tại
+    # Tăng số phiên bản dữ liệu trong mỗi transaction ghi (tem cho cache báo cáo)
+    from .services.data_versions import track_data_versions
+    track_data_versions()
+    
+    # Scheduler: SCHEDULER_MODE = 'embedded' -> mọi tiến trình web tham gia bầu
+    # leader, chỉ leader chạy job; 'external' -> chỉ tiến trình `flask scheduler`.
+    # Không start trong tiến trình con của process pool dựng báo cáo (spawn
+    # import lại run.py)
+    if (app.config.get('SCHEDULER_MODE', 'embedded') == 'embedded'
+            and not scheduler.running and multiprocessing.parent_process() is None):
+        from .tasks import start_scheduler
+        start_scheduler(app)
 
     # register blueprints
     from .routes.auth import auth_bp
@@ -71,6 +52,10 @@ def create_app():
     app.register_blueprint(dashboard_bp)
     app.register_blueprint(reports_bp)
 
+    # register CLI commands
+    from .commands import register_commands
+    register_commands(app)
+
     @app.route('/')
     def index():
         return render_template('index.html')
@@ -0,0 +1,138 @@
+"""
+Các lệnh CLI của ứng dụng
+Chạy: flask <tên-lệnh> (ví dụ: flask rebuild-search-index)
+"""
+import click
+
+
+def register_commands(app):
+    """Đăng ký các lệnh CLI vào app"""
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index_command():
+        """Dựng lại chỉ mục tìm kiếm toàn văn cho sách"""
+        from .services.search import rebuild_search_index
+        rebuild_search_index()
+        click.echo('✅ Đã dựng lại chỉ mục tìm kiếm sách')
+
+    @app.cli.command('import-books')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default=None,
+                  help='Định dạng file (mặc định đoán theo phần mở rộng)')
+    @click.option('--chunk-size', type=int, default=None, help='Số dòng mỗi lô INSERT')
+    def import_books_command(path, fmt, chunk_size):
+        """Nhập sách hàng loạt từ file CSV/NDJSON"""
+        from .services.book_import import import_books, detect_format
+        from .services.facets import invalidate_facets
+        from .services.stats_cache import invalidate_stats
+
+        fmt = fmt or detect_format(path)
+        if not fmt:
+            raise click.UsageError('Không đoán được định dạng, hãy dùng --format')
+        chunk_size = chunk_size or app.config.get('BOOK_IMPORT_CHUNK_SIZE', 1000)
+
+        def show_progress(result):
+            click.echo(f'  {result.processed} dòng | {result.inserted} đã thêm | '
+                       f'{result.error_count} lỗi | {result.rows_per_second:.0f} dòng/giây')
+
+        with open(path, 'rb') as f:
+            result = import_books(f, fmt, chunk_size=max(1, chunk_size), progress=show_progress)
+        invalidate_facets()
+        invalidate_stats()
+
+        for error in result.errors:
+            click.echo(f'  Dòng {error["row"]}: {error["error"]}', err=True)
+        if result.error_count > len(result.errors):
+            click.echo(f'  ... và {result.error_count - len(result.errors)} lỗi khác', err=True)
+        click.echo(f'✅ Đã thêm {result.inserted}/{result.processed} sách '
+                   f'trong {result.elapsed:.1f} giây')
+
+    @app.cli.command('expire-holds')
+    def expire_holds_command():
+        """Hủy các lượt giữ sách quá hạn nhận và giữ tiếp cho người kế tiếp"""
+        from .services.holds import expire_holds
+        expired, allocated = expire_holds()
+        click.echo(f'✅ Đã hủy {expired} lượt giữ quá hạn, giữ sách cho {allocated} người kế tiếp')
+
+    @app.cli.command('mark-overdue')
+    def mark_overdue_command():
+        """Đánh dấu phiếu mượn quá hạn và cập nhật phí trễ hạn"""
+        from .services.circulation import mark_overdue
+        updated = mark_overdue()
+        click.echo(f'✅ Đã cập nhật {updated} phiếu mượn quá hạn')
+
+    @app.cli.command('backfill-circulation-stats')
+    def backfill_circulation_stats_command():
+        """Dựng lại bảng tổng hợp lưu thông theo ngày từ lịch sử mượn/trả"""
+        from .services.circulation_stats import backfill_stats
+        rows = backfill_stats()
+        click.echo(f'✅ Đã dựng lại daily_circulation_stats: {rows} dòng (ngày, thể loại)')
+
+    @app.cli.command('reconcile-counters')
+    def reconcile_counters_command():
+        """Tính lại bảng bộ đếm tổng (counters) từ dữ liệu gốc"""
+        from .services.counters import reconcile
+        for name, (old, new) in reconcile().items():
+            mark = '' if old == new else f'  (trước đó: {old})'
+            click.echo(f'  {name}: {new}{mark}')
+        click.echo('✅ Đã đồng bộ bộ đếm')
+
+    @app.cli.command('rebuild-borrow-counts')
+    def rebuild_borrow_counts_command():
+        """Tính lại số lượt mượn của sách và độc giả từ lịch sử mượn"""
+        from .services.popularity import rebuild_borrow_counts
+        from .services.stats_cache import invalidate_stats
+        updated = rebuild_borrow_counts()
+        invalidate_stats()
+        click.echo(f'✅ Đã tính lại số lượt mượn ({updated} sách/độc giả có lượt mượn trong 365 ngày)')
+
+    @app.cli.command('purge-reports')
+    def purge_reports_command():
+        """Xóa các báo cáo PDF đã quá thời gian lưu (REPORT_RETENTION_HOURS)"""
+        from .services.report_jobs import purge_reports
+        removed = purge_reports()
+        click.echo(f'✅ Đã xóa {removed} báo cáo quá hạn lưu')
+
+    @app.cli.command('drain-outbox')
+    @click.option('--loop', is_flag=True, help='Chạy liên tục như một worker riêng')
+    @click.option('--interval', type=int, default=None,
+                  help='Số giây nghỉ giữa hai lần khi chạy --loop')
+    def drain_outbox_command(loop, interval):
+        """Gửi các email đến lượt trong hàng đợi email_outbox"""
+        import time
+        from .extensions import db
+        from .services.email_outbox import drain_outbox, purge_outbox
+        interval = interval or app.config.get('OUTBOX_DRAIN_INTERVAL_SECONDS', 60)
+        while True:
+            result = drain_outbox()
+            purge_outbox()
+            db.session.remove()
+            if result.batches or not loop:
+                click.echo(f'✅ Đã gửi {result.sent} email, {result.retried} thư sẽ thử lại, '
+                           f'{result.failed} thư bỏ cuộc')
+            if not loop:
+                break
+            time.sleep(interval)
+
+    @app.cli.command('scheduler')
+    def scheduler_command():
+        """Chạy scheduler như một tiến trình riêng (dùng với SCHEDULER_MODE=external)"""
+        import time
+        from . import tasks
+        from .extensions import scheduler
+
+        if not scheduler.running:
+            tasks.start_scheduler(app)
+        if tasks.elector is None:
+            raise click.ClickException('Không start được scheduler')
+        click.echo(f'✅ Scheduler đang chạy ({"leader" if tasks.elector.is_leader else "dự phòng"}), '
+                   f'Ctrl+C để dừng')
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            tasks.elector.stop()
+            scheduler.shutdown()
+            click.echo('Đã dừng scheduler')
@@ -22,16 +22,82 @@ class Config:
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER', MAIL_USERNAME)
+    # Gửi email hàng loạt: số luồng gửi song song, số thư mỗi kết nối SMTP và
+    # tốc độ tối đa (thư/giây, 0 = không giới hạn)
+    MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS', 4))
+    MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE', 50))
+    MAIL_RATE_LIMIT = float(os.environ.get('MAIL_RATE_LIMIT', 10))
+    # Hàng đợi email (email_outbox): số thư mỗi lô worker nhận, chu kỳ gửi (giây),
+    # số lần thử tối đa, thời gian chờ lần thử lại đầu (giây, gấp đôi mỗi lần),
+    # thời gian giữ thư của worker chết trước khi trả lại hàng đợi (giây) và số
+    # ngày giữ thư đã gửi
+    OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 200))
+    OUTBOX_DRAIN_INTERVAL_SECONDS = int(os.environ.get('OUTBOX_DRAIN_INTERVAL_SECONDS', 60))
+    OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 6))
+    OUTBOX_RETRY_BASE_SECONDS = int(os.environ.get('OUTBOX_RETRY_BASE_SECONDS', 60))
+    OUTBOX_CLAIM_TIMEOUT = int(os.environ.get('OUTBOX_CLAIM_TIMEOUT', 900))
+    OUTBOX_RETENTION_DAYS = int(os.environ.get('OUTBOX_RETENTION_DAYS', 30))
 
     # APScheduler
     SCHEDULER_API_ENABLED = True
+    # 'embedded': mọi tiến trình web tham gia bầu leader, chỉ leader chạy job;
+    # 'external': tiến trình web không chạy job, chạy riêng `flask scheduler`
+    SCHEDULER_MODE = os.environ.get('SCHEDULER_MODE', 'embedded')
+    # Chu kỳ thử giành/kiểm tra khóa leader (giây) và file khóa khi không dùng PostgreSQL
+    SCHEDULER_LEADER_POLL_SECONDS = int(os.environ.get('SCHEDULER_LEADER_POLL_SECONDS', 15))
+    SCHEDULER_LOCK_FILE = os.environ.get(
+        'SCHEDULER_LOCK_FILE', os.path.join(basedir, '..', 'instance', 'scheduler.lock')
+    )
+    # Leader mới lên thay vẫn chạy job vừa lỡ (trong 5 phút), gộp các lần lỡ thành một
+    SCHEDULER_JOB_DEFAULTS = {'coalesce': True, 'misfire_grace_time': 300, 'max_instances': 1}
 
     # Application specific
     BORROW_DAYS_DEFAULT = int(os.environ.get('BORROW_DAYS_DEFAULT', 14))
     REMINDER_DAYS_BEFORE = int(os.environ.get('REMINDER_DAYS_BEFORE', 3))
+    # Email nhắc nhở/quá hạn: 'per_loan' = một thư mỗi phiếu mượn,
+    # 'digest' = một thư tổng hợp mỗi độc giả mỗi ngày (sắp đến hạn + quá hạn)
+    REMINDER_MODE = os.environ.get('REMINDER_MODE', 'per_loan')
+    # Số phiếu mượn mỗi lô khi tác vụ nhắc nhở đọc (yield_per) và ghi vào hàng đợi
+    REMINDER_CHUNK_ROWS = int(os.environ.get('REMINDER_CHUNK_ROWS', 500))
     PER_PAGE = int(os.environ.get('PER_PAGE', 20))
+    API_MAX_LIMIT = int(os.environ.get('API_MAX_LIMIT', 500))  # Số dòng tối đa mỗi trang của API
     FINE_PER_DAY = float(os.environ.get('FINE_PER_DAY', 0.5))  # Phí trễ hạn mỗi ngày (VNĐ)
     
+    # Cache facet (thể loại/tác giả) của danh mục sách
+    FACET_CACHE_TTL = int(os.environ.get('FACET_CACHE_TTL', 300))  # giây
+    FACET_CACHE_SIZE = int(os.environ.get('FACET_CACHE_SIZE', 256))  # số từ khóa được cache
+    
+    # Nhập sách hàng loạt: số dòng mỗi lô INSERT
+    BOOK_IMPORT_CHUNK_SIZE = int(os.environ.get('BOOK_IMPORT_CHUNK_SIZE', 1000))
+    
+    # Mượn/trả theo lô tại quầy: số sách tối đa mỗi yêu cầu
+    CIRCULATION_BATCH_MAX = int(os.environ.get('CIRCULATION_BATCH_MAX', 200))
+    
+    # Hàng đợi đặt trước: số ngày giữ sách chờ nhận, chu kỳ quét lượt giữ quá hạn
+    HOLD_PICKUP_DAYS = int(os.environ.get('HOLD_PICKUP_DAYS', 3))
+    HOLD_EXPIRY_INTERVAL_MINUTES = int(os.environ.get('HOLD_EXPIRY_INTERVAL_MINUTES', 60))
+    
+    # Cache số liệu dashboard/thống kê: thời gian còn hạn và thời gian tối đa
+    # được trả giá trị cũ trong lúc một luồng nền tính lại (giây, TTL=0 để tắt)
+    STATS_CACHE_TTL = int(os.environ.get('STATS_CACHE_TTL', 30))
+    STATS_CACHE_MAX_STALE = int(os.environ.get('STATS_CACHE_MAX_STALE', 300))
+    
+    # Cửa sổ cho top sách mượn nhiều / độc giả tích cực: all, 30d hoặc 365d
+    TOP_BORROW_WINDOW = os.environ.get('TOP_BORROW_WINDOW', 'all')
+    
+    # Báo cáo PDF/file xuất: số dòng mỗi lần đọc từ database (yield_per)
+    REPORT_CHUNK_ROWS = int(os.environ.get('REPORT_CHUNK_ROWS', 500))
+    
+    # Báo cáo chạy nền: số báo cáo được dựng cùng lúc trên toàn máy, dùng chung
+    # cho mọi worker gunicorn (0 = dựng ngay trong request),
+    # thư mục cache PDF, dung lượng tối đa (MB, xóa file ít dùng nhất trước),
+    # thời gian giữ file không được dùng (giờ) và thời gian tối đa một job (giây)
+    REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', 2))
+    REPORT_DIR = os.environ.get('REPORT_DIR', os.path.join(basedir, '..', 'instance', 'reports'))
+    REPORT_CACHE_MAX_MB = int(os.environ.get('REPORT_CACHE_MAX_MB', 200))
+    REPORT_RETENTION_HOURS = int(os.environ.get('REPORT_RETENTION_HOURS', 24))
+    REPORT_JOB_TIMEOUT = int(os.environ.get('REPORT_JOB_TIMEOUT', 600))
+    
     # Upload configuration
     UPLOAD_FOLDER = os.path.join(basedir, '..', 'static', 'uploads', 'books')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
@@ -6,12 +6,22 @@ from .extensions import db
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        # Top độc giả tích cực: quét ngược chỉ mục, không GROUP BY lịch sử mượn
+        db.Index('ix_users_borrow_count', 'borrow_count', 'id'),
+        db.Index('ix_users_borrow_count_30d', 'borrow_count_30d', 'id'),
+        db.Index('ix_users_borrow_count_365d', 'borrow_count_365d', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(255), unique=True, nullable=False)
     name = db.Column(db.String(120))
     password_hash = db.Column(db.String(255), nullable=False)
     is_admin = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Số lượt mượn (toàn thời gian / 30 ngày / 365 ngày gần nhất)
+    borrow_count = db.Column(db.Integer, nullable=False, default=0)
+    borrow_count_30d = db.Column(db.Integer, nullable=False, default=0)
+    borrow_count_365d = db.Column(db.Integer, nullable=False, default=0)
 
     borrow_records = db.relationship('BorrowRecord', backref='user', lazy=True)
     reservations = db.relationship('Reservation', backref='user', lazy=True)
@@ -28,6 +38,15 @@ class User(UserMixin, db.Model):
 
 class Book(db.Model):
     __tablename__ = 'books'
+    __table_args__ = (
+        # Phân trang keyset theo (title, id) và (created_at, id)
+        db.Index('ix_books_title_id', 'title', 'id'),
+        db.Index('ix_books_created_at_id', 'created_at', 'id'),
+        # Top sách mượn nhiều nhất: quét ngược chỉ mục, không GROUP BY lịch sử mượn
+        db.Index('ix_books_borrow_count', 'borrow_count', 'id'),
+        db.Index('ix_books_borrow_count_30d', 'borrow_count_30d', 'id'),
+        db.Index('ix_books_borrow_count_365d', 'borrow_count_365d', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
     author = db.Column(db.String(255))
@@ -36,7 +55,11 @@ class Book(db.Model):
     total_copies = db.Column(db.Integer, default=1)
     available_copies = db.Column(db.Integer, default=1)
     image_path = db.Column(db.String(500), nullable=True)  # Đường dẫn hình ảnh
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Số lượt mượn (toàn thời gian / 30 ngày / 365 ngày gần nhất)
+    borrow_count = db.Column(db.Integer, nullable=False, default=0)
+    borrow_count_30d = db.Column(db.Integer, nullable=False, default=0)
+    borrow_count_365d = db.Column(db.Integer, nullable=False, default=0)
 
     borrow_records = db.relationship('BorrowRecord', backref='book', lazy=True)
     reservations = db.relationship('Reservation', backref='book', lazy=True)
@@ -47,6 +70,24 @@ class Book(db.Model):
 
 class BorrowRecord(db.Model):
     __tablename__ = 'borrow_records'
+    __table_args__ = (
+        # Kiểm tra "đã mượn sách này chưa" (user, book, chưa trả)
+        db.Index('ix_borrow_records_user_book_returned', 'user_id', 'book_id', 'returned_at'),
+        # Sách đang mượn / quá hạn: returned_at IS NULL AND due_date < ...
+        db.Index('ix_borrow_records_returned_due', 'returned_at', 'due_date'),
+        # Lịch sử mượn của một độc giả
+        db.Index('ix_borrow_records_user_borrowed', 'user_id', 'borrowed_at'),
+        # Phiếu đang mở của một đầu sách (xóa sách, hàng đợi đặt trước)
+        db.Index('ix_borrow_records_book_returned', 'book_id', 'returned_at'),
+        # Bảng quản lý & thống kê theo tháng: sắp xếp/lọc theo borrowed_at
+        db.Index('ix_borrow_records_borrowed_at_id', 'borrowed_at', 'id'),
+        # Chỉ mục một phần: chỉ các phiếu chưa trả, theo hạn trả (nhắc nhở, quá hạn)
+        db.Index('ix_borrow_records_open_due_date', 'due_date',
+                 sqlite_where=db.text('returned_at IS NULL'),
+                 postgresql_where=db.text('returned_at IS NULL')),
+        # Truy vấn theo trạng thái (overdue do tác vụ hàng đêm đánh dấu), theo hạn trả
+        db.Index('ix_borrow_records_status_due', 'status', 'due_date'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False)
@@ -76,16 +117,89 @@ class BorrowRecord(db.Model):
 
 class Reservation(db.Model):
     __tablename__ = 'reservations'
+    __table_args__ = (
+        # Hàng đợi đặt trước của một đầu sách theo thứ tự thời gian
+        db.Index('ix_reservations_book_fulfilled_reserved', 'book_id', 'fulfilled', 'reserved_at'),
+        # Đặt trước của một độc giả
+        db.Index('ix_reservations_user_fulfilled', 'user_id', 'fulfilled'),
+        # Bảng quản lý: sắp xếp theo reserved_at
+        db.Index('ix_reservations_reserved_at_id', 'reserved_at', 'id'),
+        # Tác vụ hủy giữ sách quá hạn nhận: status = 'ready' AND expires_at < now
+        db.Index('ix_reservations_status_expires', 'status', 'expires_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False)
     reserved_at = db.Column(db.DateTime, default=datetime.utcnow)
     fulfilled = db.Column(db.Boolean, default=False)
+    # waiting (đang chờ), ready (đã giữ sách, chờ nhận), collected (đã nhận), expired (quá hạn nhận)
+    status = db.Column(db.String(20), default='waiting')
+    fulfilled_at = db.Column(db.DateTime, nullable=True)  # Thời điểm được giữ sách
+    expires_at = db.Column(db.DateTime, nullable=True)  # Hạn đến nhận sách
+
+    @property
+    def is_ready(self):
+        return self.status == 'ready'
 
     def __repr__(self):
         return f"<Reservation user={self.user_id} book={self.book_id}>"
 
 
+class DailyCirculationStat(db.Model):
+    """Bảng tổng hợp lưu thông theo ngày và thể loại (cập nhật dần khi mượn/trả)"""
+    __tablename__ = 'daily_circulation_stats'
+    day = db.Column(db.Date, primary_key=True)
+    category = db.Column(db.String(120), primary_key=True, default='')  # '' = chưa phân loại
+    borrows = db.Column(db.Integer, nullable=False, default=0)
+    returns = db.Column(db.Integer, nullable=False, default=0)
+    new_overdues = db.Column(db.Integer, nullable=False, default=0)
+    fines = db.Column(db.Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f"<DailyCirculationStat {self.day} {self.category!r} borrows={self.borrows}>"
+
+
+class StatCounter(db.Model):
+    """Bộ đếm tổng (số sách, độc giả, phiếu đang mượn...) cập nhật cùng transaction nghiệp vụ"""
+    __tablename__ = 'counters'
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<StatCounter {self.name}={self.value}>"
+
+
+class EmailOutbox(db.Model):
+    """Hàng đợi email bền vững: tác vụ nhắc nhở ghi vào, worker gửi dần và thử lại khi lỗi"""
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        # Worker lấy thư đến lượt gửi: WHERE status = 'pending' AND next_attempt_at <= ?
+        db.Index('ix_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+        db.Index('ix_email_outbox_claimed_by', 'claimed_by'),
+        db.Index('ix_email_outbox_created_at', 'created_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    # Khóa chống gửi trùng, ví dụ 'overdue_notice:<borrow_id>:<ngày>'
+    dedupe_key = db.Column(db.String(120), unique=True, nullable=False)
+    kind = db.Column(db.String(30), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    borrow_id = db.Column(db.Integer, db.ForeignKey('borrow_records.id'), nullable=True)
+    recipient = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+    claimed_by = db.Column(db.String(32), nullable=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<EmailOutbox {self.dedupe_key} {self.status}>"
+
+
 # login user loader for flask-login
 try:
     from .extensions import login_manager
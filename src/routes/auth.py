@@ -2,6 +2,8 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required, current_user
 from ..models import User
 from ..extensions import db
+from ..services import counters
+from ..services.stats_cache import invalidate_stats
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
@@ -33,7 +35,9 @@ def register():
         user = User(email=email, name=name)
         user.set_password(password)
         db.session.add(user)
+        counters.bump(total_users=1)
         db.session.commit()
+        invalidate_stats()
         flash('Đăng ký thành công. Vui lòng đăng nhập.', 'success')
         return redirect(url_for('auth.login'))
     return render_template('auth/register.html')
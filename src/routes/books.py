@@ -3,6 +3,13 @@ from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 from ..models import Book
 from ..extensions import db
+from ..services.search import search_filter
+from ..services.pagination import paginate_keyset, InvalidCursor
+from ..services.facets import get_facets, invalidate_facets
+from ..services.book_import import import_books, detect_format, FORMATS as IMPORT_FORMATS
+from ..services.circulation import CirculationError, set_total_copies
+from ..services import counters
+from ..services.stats_cache import invalidate_stats
 from functools import wraps
 import os
 from pathlib import Path
@@ -49,23 +56,29 @@ def admin_required(f):
     return decorated_function
 
 
-@books_bp.route('/')
-def list_books():
-    """Danh sách sách với tìm kiếm"""
+# Khóa sắp xếp cho phân trang keyset: [(cột, giảm_dần), ...]
+SORT_KEYS = {
+    'title': lambda: [(Book.title, False), (Book.id, False)],
+    'newest': lambda: [(Book.created_at, True), (Book.id, True)],
+}
+
+
+def _wants_total():
+    return request.args.get('count', '1').lower() not in ('0', 'false', 'no')
+
+
+def catalog_page(per_page):
+    """Truy vấn danh mục sách theo tham số request (q, category, author, sort, cursor)"""
     q = request.args.get('q', '')
     category = request.args.get('category', '')
     author = request.args.get('author', '')
+    sort = request.args.get('sort', '')
     
     query = Book.query
+    rank = None
     
     if q:
-        ilike = f"%{q}%"
-        query = query.filter(
-            (Book.title.ilike(ilike)) | 
-            (Book.author.ilike(ilike)) | 
-            (Book.category.ilike(ilike)) |
-            (Book.isbn.ilike(ilike))
-        )
+        query, rank = search_filter(query, q)
     
     if category:
         query = query.filter(Book.category.ilike(f"%{category}%"))
@@ -73,17 +86,36 @@ def list_books():
     if author:
         query = query.filter(Book.author.ilike(f"%{author}%"))
     
-    page = int(request.args.get('page', 1))
+    # Có từ khóa thì mặc định sắp xếp theo độ liên quan
+    if rank is not None and sort in ('', 'relevance'):
+        keys = [(rank, False), (Book.id, False)]
+    else:
+        keys = SORT_KEYS.get(sort, SORT_KEYS['title'])()
+    
+    return paginate_keyset(query, keys,
+                           cursor=request.args.get('cursor') or None,
+                           per_page=per_page,
+                           with_total=_wants_total())
+
+
+@books_bp.route('/')
+def list_books():
+    """Danh sách sách với tìm kiếm"""
+    q = request.args.get('q', '')
+    category = request.args.get('category', '')
+    author = request.args.get('author', '')
+    sort = request.args.get('sort', '')
+    
     per_page = current_app.config.get('PER_PAGE', 20)
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    try:
+        pagination = catalog_page(per_page)
+    except InvalidCursor:
+        flash('Liên kết phân trang không hợp lệ.', 'warning')
+        return redirect(url_for('books.list_books', q=q, category=category, author=author, sort=sort))
     books = pagination.items
     
-    # Lấy danh sách thể loại và tác giả để filter
-    categories = db.session.query(Book.category).distinct().filter(Book.category.isnot(None)).all()
-    categories = [c[0] for c in categories if c[0]]
-    
-    authors = db.session.query(Book.author).distinct().filter(Book.author.isnot(None)).all()
-    authors = [a[0] for a in authors if a[0]]
+    # Facet thể loại và tác giả (kèm số lượng) để filter
+    facets = get_facets(q)
     
     return render_template('books/list.html', 
                          books=books, 
@@ -91,8 +123,9 @@ def list_books():
                          q=q,
                          category=category,
                          author=author,
-                         categories=categories,
-                         authors=authors)
+                         sort=sort,
+                         categories=facets['categories'],
+                         authors=facets['authors'])
 
 
 @books_bp.route('/<int:book_id>')
@@ -133,6 +166,7 @@ def add():
         
         db.session.add(book)
         db.session.flush()  # Lấy ID của book trước khi commit
+        counters.bump(total_books=1, total_copies=total_copies)
         
         # Xử lý upload hình ảnh
         if 'image' in request.files:
@@ -146,6 +180,8 @@ def add():
                     flash('Chỉ chấp nhận file ảnh (png, jpg, jpeg, gif, webp).', 'warning')
         
         db.session.commit()
+        invalidate_facets()
+        invalidate_stats()
         
         flash(f'Đã thêm sách "{title}" thành công.', 'success')
         return redirect(url_for('books.detail', book_id=book.id))
@@ -175,12 +211,12 @@ def edit(book_id):
         
         book.isbn = isbn
         
-        # Cập nhật số lượng
-        old_total = book.total_copies
-        book.total_copies = total_copies
-        # Điều chỉnh available_copies
-        diff = total_copies - old_total
-        book.available_copies = max(0, book.available_copies + diff)
+        # Cập nhật số lượng (available_copies cộng/trừ phần chênh lệch trong SQL)
+        try:
+            set_total_copies(book, total_copies)
+        except CirculationError as e:
+            flash(e.message, 'warning')
+            return render_template('books/form.html', book=book)
         
         # Xử lý upload hình ảnh mới
         if 'image' in request.files:
@@ -204,6 +240,8 @@ def edit(book_id):
                     flash('Chỉ chấp nhận file ảnh (png, jpg, jpeg, gif, webp).', 'warning')
         
         db.session.commit()
+        invalidate_facets()
+        invalidate_stats()
         
         flash('Đã cập nhật thông tin sách.', 'success')
         return redirect(url_for('books.detail', book_id=book.id))
@@ -229,8 +267,11 @@ def delete(book_id):
         return redirect(url_for('books.detail', book_id=book_id))
     
     title = book.title
+    counters.bump(total_books=-1, total_copies=-(book.total_copies or 0))
     db.session.delete(book)
     db.session.commit()
+    invalidate_facets()
+    invalidate_stats()
     
     flash(f'Đã xóa sách "{title}".', 'success')
     return redirect(url_for('books.list_books'))
@@ -239,29 +280,22 @@ def delete(book_id):
 # RESTful API endpoints
 @books_bp.route('/api')
 def api_list_books():
-    """API danh sách sách"""
-    q = request.args.get('q', '')
-    category = request.args.get('category', '')
-    author = request.args.get('author', '')
-    limit = int(request.args.get('limit', 100))
-    
-    query = Book.query
-    
-    if q:
-        ilike = f"%{q}%"
-        query = query.filter(
-            (Book.title.ilike(ilike)) | 
-            (Book.author.ilike(ilike)) | 
-            (Book.category.ilike(ilike))
-        )
-    
-    if category:
-        query = query.filter(Book.category.ilike(f"%{category}%"))
-    
-    if author:
-        query = query.filter(Book.author.ilike(f"%{author}%"))
-    
-    books = query.limit(limit).all()
+    """API danh sách sách.
+    
+    Phân trang bằng cursor: dùng giá trị trong header `X-Next-Cursor` /
+    `X-Prev-Cursor` (hoặc `Link`) làm tham số `cursor` cho lần gọi tiếp theo.
+    `count=0` bỏ qua việc đếm tổng số (`X-Total-Count`).
+    """
+    try:
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return jsonify({'error': 'limit phải là số nguyên'}), 400
+    limit = min(max(1, limit), current_app.config.get('API_MAX_LIMIT', 500))
+    
+    try:
+        page = catalog_page(limit)
+    except InvalidCursor:
+        return jsonify({'error': 'Cursor không hợp lệ'}), 400
     
     results = [{
         'id': b.id,
@@ -271,9 +305,65 @@ def api_list_books():
         'isbn': b.isbn,
         'total_copies': b.total_copies,
         'available_copies': b.available_copies
-    } for b in books]
+    } for b in page.items]
+    
+    response = jsonify(results)
+    args = request.args.to_dict()
+    links = []
+    for rel, cursor in (('next', page.next_cursor), ('prev', page.prev_cursor)):
+        if cursor:
+            args['cursor'] = cursor
+            links.append(f'<{url_for("books.api_list_books", _external=True, **args)}>; rel="{rel}"')
+            response.headers[f'X-{rel.capitalize()}-Cursor'] = cursor
+    if links:
+        response.headers['Link'] = ', '.join(links)
+    if page.total is not None:
+        response.headers['X-Total-Count'] = str(page.total)
+    
+    return response
+
+
+@books_bp.route('/api/import', methods=['POST'])
+@admin_required
+def api_import_books():
+    """API nhập sách hàng loạt từ CSV/NDJSON.
+    
+    Gửi file multipart (trường `file`) hoặc gửi thẳng body với Content-Type
+    `text/csv` / `application/x-ndjson`. Tham số `format` và `chunk_size` là tùy chọn.
+    """
+    upload = request.files.get('file')
+    if upload:
+        stream = upload.stream
+        fmt = request.args.get('format') or detect_format(upload.filename, upload.content_type)
+    else:
+        stream = request.stream
+        fmt = request.args.get('format') or detect_format(content_type=request.content_type)
+    
+    if fmt not in IMPORT_FORMATS:
+        return jsonify({'error': 'Định dạng phải là csv hoặc ndjson'}), 400
+    
+    try:
+        chunk_size = int(request.args.get('chunk_size') or current_app.config.get('BOOK_IMPORT_CHUNK_SIZE', 1000))
+    except ValueError:
+        return jsonify({'error': 'chunk_size phải là số nguyên'}), 400
+
+    def log_progress(result):
+        current_app.logger.info(
+            f'Nhập sách: {result.processed} dòng, {result.inserted} đã thêm, '
+            f'{result.error_count} lỗi ({result.rows_per_second:.0f} dòng/giây)'
+        )
+    
+    result = import_books(stream, fmt, chunk_size=max(1, chunk_size), progress=log_progress)
+    invalidate_facets()
+    invalidate_stats()
     
-    return jsonify(results)
+    return jsonify(result.to_dict()), 200
+
+
+@books_bp.route('/api/facets')
+def api_facets():
+    """API facet thể loại/tác giả kèm số lượng"""
+    return jsonify(get_facets(request.args.get('q', '')))
 
 
 @books_bp.route('/api/<int:book_id>')
@@ -314,7 +404,10 @@ def api_create_book():
     )
     
     db.session.add(book)
+    counters.bump(total_books=1, total_copies=book.total_copies)
     db.session.commit()
+    invalidate_facets()
+    invalidate_stats()
     
     return jsonify({
         'id': book.id,
@@ -344,12 +437,16 @@ def api_update_book(book_id):
             return jsonify({'error': 'ISBN đã tồn tại'}), 400
         book.isbn = data['isbn']
     if 'total_copies' in data:
-        old_total = book.total_copies
-        book.total_copies = data['total_copies']
-        diff = data['total_copies'] - old_total
-        book.available_copies = max(0, book.available_copies + diff)
+        try:
+            set_total_copies(book, int(data['total_copies']))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'total_copies phải là số nguyên'}), 400
+        except CirculationError as e:
+            return jsonify({'error': e.message}), e.status_code
     
     db.session.commit()
+    invalidate_facets()
+    invalidate_stats()
     
     return jsonify({
         'id': book.id,
@@ -373,8 +470,11 @@ def api_delete_book(book_id):
     if active_borrows > 0:
         return jsonify({'error': f'Có {active_borrows} bản đang được mượn'}), 400
     
+    counters.bump(total_books=-1, total_copies=-(book.total_copies or 0))
     db.session.delete(book)
     db.session.commit()
+    invalidate_facets()
+    invalidate_stats()
     
     return jsonify({'message': 'Xóa sách thành công'}), 200
 
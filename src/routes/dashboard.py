@@ -1,9 +1,12 @@
-from flask import Blueprint, render_template, jsonify, redirect, url_for
+from flask import Blueprint, render_template, jsonify, redirect, url_for, current_app
 from flask_login import login_required, current_user
-from datetime import date, timedelta, datetime
-from sqlalchemy import func, desc
-from ..models import Book, BorrowRecord, User, Reservation
-from ..extensions import db
+from datetime import date
+from sqlalchemy.orm import joinedload
+from ..models import BorrowRecord, Reservation
+from ..services.circulation_stats import monthly_borrows
+from ..services.counters import get_counters
+from ..services.popularity import top_books, top_readers
+from ..services.stats_cache import cached_stats, cache_stats
 from functools import wraps
 
 dashboard_bp = Blueprint('dashboard', __name__, url_prefix='/dashboard')
@@ -29,65 +32,53 @@ def index():
         return user_dashboard()
 
 
-def admin_dashboard():
-    """Dashboard cho admin"""
-    # Thống kê tổng quan
-    total_books = Book.query.count()
-    total_users = User.query.count()
-    total_borrows = BorrowRecord.query.filter(BorrowRecord.returned_at.is_(None)).count()
-    overdue_books = BorrowRecord.query.filter(
-        BorrowRecord.returned_at.is_(None),
-        BorrowRecord.due_date < date.today()
-    ).count()
+def _admin_dashboard_data():
+    """Số liệu dashboard admin dạng dữ liệu thuần (để cache được)"""
+    # Thống kê tổng quan (đọc từ bảng bộ đếm)
+    totals = get_counters()
     
-    # Sách mượn nhiều nhất
-    popular_books = db.session.query(
-        Book,
-        func.count(BorrowRecord.id).label('borrow_count')
-    ).join(BorrowRecord).group_by(Book.id).order_by(desc('borrow_count')).limit(10).all()
-    
-    # Độc giả tích cực
-    active_readers = db.session.query(
-        User,
-        func.count(BorrowRecord.id).label('borrow_count')
-    ).join(BorrowRecord).group_by(User.id).order_by(desc('borrow_count')).limit(10).all()
+    # Sách mượn nhiều nhất / độc giả tích cực (bộ đếm lượt mượn có chỉ mục)
+    window = current_app.config.get('TOP_BORROW_WINDOW', 'all')
+    popular_books = top_books(10, window)
+    active_readers = top_readers(10, window)
     
     # Sách quá hạn
-    overdue_records = BorrowRecord.query.filter(
-        BorrowRecord.returned_at.is_(None),
-        BorrowRecord.due_date < date.today()
+    overdue_records = BorrowRecord.query.options(
+        joinedload(BorrowRecord.user),
+        joinedload(BorrowRecord.book)
+    ).filter_by(
+        status='overdue'
     ).order_by(BorrowRecord.due_date).limit(20).all()
     
-    # Đặt trước chưa thực hiện
-    pending_reservations = Reservation.query.filter_by(fulfilled=False).count()
-    
-    # Thống kê theo tháng (7 tháng gần nhất)
-    months_stats = []
-    for i in range(6, -1, -1):
-        month_start = date.today().replace(day=1) - timedelta(days=30*i)
-        month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
-        
-        borrows_count = BorrowRecord.query.filter(
-            BorrowRecord.borrowed_at >= datetime.combine(month_start, datetime.min.time()),
-            BorrowRecord.borrowed_at <= datetime.combine(month_end, datetime.max.time())
-        ).count()
-        
-        months_stats.append({
-            'month': month_start.strftime('%m/%Y'),
-            'count': borrows_count
-        })
-    
+    return {
+        'total_books': totals['total_books'],
+        'total_users': totals['total_users'],
+        'total_borrows': totals['active_loans'],
+        'overdue_books': totals['overdue_loans'],
+        'popular_books': [({'title': book.title, 'author': book.author}, count)
+                          for book, count in popular_books],
+        'active_readers': [({'name': user.name, 'email': user.email}, count)
+                           for user, count in active_readers],
+        'overdue_records': [{
+            'user': {'name': record.user.name, 'email': record.user.email},
+            'book': {'title': record.book.title},
+            'borrowed_at': record.borrowed_at,
+            'due_date': record.due_date,
+            'fine_amount': record.fine_amount or 0.0,
+        } for record in overdue_records],
+        # Đặt trước chưa thực hiện
+        'pending_reservations': totals['pending_reservations'],
+        # Thống kê theo tháng (7 tháng gần nhất) từ bảng tổng hợp theo ngày
+        'months_stats': monthly_borrows(months=7),
+    }
+
+
+def admin_dashboard():
+    """Dashboard cho admin"""
+    data = cached_stats('admin_dashboard', _admin_dashboard_data)
     return render_template('dashboard/admin_dashboard.html',
-                         total_books=total_books,
-                         total_users=total_users,
-                         total_borrows=total_borrows,
-                         overdue_books=overdue_books,
-                         popular_books=popular_books,
-                         active_readers=active_readers,
-                         overdue_records=overdue_records,
-                         pending_reservations=pending_reservations,
-                         months_stats=months_stats,
-                         today=date.today())
+                         today=date.today(),
+                         **data)
 
 
 def user_dashboard():
@@ -120,6 +111,18 @@ def user_dashboard():
                          today=date.today())
 
 
+def _api_stats_data():
+    totals = get_counters()
+    return {
+        'total_books': totals['total_books'],
+        'total_copies': totals['total_copies'],
+        'total_users': totals['total_users'],
+        'active_borrows': totals['active_loans'],
+        'overdue_books': totals['overdue_loans'],
+        'pending_reservations': totals['pending_reservations']
+    }
+
+
 @dashboard_bp.route('/api/stats')
 @login_required
 def api_stats():
@@ -127,15 +130,17 @@ def api_stats():
     if not current_user.is_admin:
         return jsonify({'error': 'Không có quyền'}), 403
     
-    stats = {
-        'total_books': Book.query.count(),
-        'total_users': User.query.count(),
-        'active_borrows': BorrowRecord.query.filter(BorrowRecord.returned_at.is_(None)).count(),
-        'overdue_books': BorrowRecord.query.filter(
-            BorrowRecord.returned_at.is_(None),
-            BorrowRecord.due_date < date.today()
-        ).count()
-    }
+    stats = cached_stats('api_stats', _api_stats_data)
     
     return jsonify(stats)
 
+
+@dashboard_bp.route('/api/cache-stats')
+@login_required
+def api_cache_stats():
+    """API số lượt hit/miss của cache thống kê (giám sát)"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Không có quyền'}), 403
+    
+    return jsonify(cache_stats())
+
@@ -1,8 +1,12 @@
-from flask import Blueprint, request, jsonify, render_template, flash, redirect, url_for
+from flask import Blueprint, request, jsonify, render_template, flash, redirect, url_for, abort, current_app
 from flask_login import login_required, current_user
 from datetime import datetime, date, timedelta
-from ..models import BorrowRecord, Book, User, Reservation
+from sqlalchemy.orm import joinedload
+from ..models import BorrowRecord, User
 from ..extensions import db
+from ..services import circulation
+from ..services.circulation import CirculationError
+from ..services.pagination import paginate_keyset, InvalidCursor
 from functools import wraps
 
 loans_bp = Blueprint('loans', __name__, url_prefix='/loans')
@@ -23,37 +27,15 @@ def admin_required(f):
 @login_required
 def borrow_book(book_id):
     """Mượn sách"""
-    book = Book.query.get_or_404(book_id)
-    
-    if book.available_copies <= 0:
-        flash('Sách hiện không có sẵn.', 'warning')
-        return redirect(url_for('books.list_books'))
-    
-    # Kiểm tra xem user đã mượn sách này chưa
-    existing_borrow = BorrowRecord.query.filter_by(
-        user_id=current_user.id,
-        book_id=book_id,
-        returned_at=None
-    ).first()
-    
-    if existing_borrow:
-        flash('Bạn đã mượn sách này rồi.', 'warning')
+    try:
+        borrow_record, title = circulation.borrow_book(current_user.id, book_id)
+    except CirculationError as e:
+        if e.status_code == 404:
+            abort(404)
+        flash(e.message, 'warning')
         return redirect(url_for('books.list_books'))
     
-    # Tạo record mượn sách
-    due_date = date.today() + timedelta(days=14)  # Mặc định 14 ngày
-    borrow_record = BorrowRecord(
-        user_id=current_user.id,
-        book_id=book_id,
-        due_date=due_date,
-        status='borrowed'
-    )
-    
-    book.available_copies -= 1
-    db.session.add(borrow_record)
-    db.session.commit()
-    
-    flash(f'Đã mượn sách "{book.title}". Hạn trả: {due_date.strftime("%d/%m/%Y")}', 'success')
+    flash(f'Đã mượn sách "{title}". Hạn trả: {borrow_record.due_date.strftime("%d/%m/%Y")}', 'success')
     return redirect(url_for('loans.my_loans'))
 
 
@@ -72,27 +54,12 @@ def return_book(borrow_id):
         flash('Sách này đã được trả rồi.', 'warning')
         return redirect(url_for('loans.my_loans'))
     
-    # Tính phạt nếu trễ hạn
-    fine = borrow_record.calculate_fine()
-    borrow_record.fine_amount = fine
-    borrow_record.returned_at = datetime.utcnow()
-    borrow_record.status = 'returned'
-    
-    # Tăng số lượng sách có sẵn
-    book = borrow_record.book
-    book.available_copies += 1
-    
-    # Kiểm tra và xử lý đặt trước
-    reservation = Reservation.query.filter_by(
-        book_id=book.id,
-        fulfilled=False
-    ).order_by(Reservation.reserved_at).first()
-    
-    if reservation:
-        # Có thể tự động chuyển sách cho người đặt trước
-        pass
-    
-    db.session.commit()
+    # Tính phạt nếu trễ hạn, trả bản sách (giữ cho người đặt trước nếu có)
+    try:
+        fine = circulation.return_book(borrow_record)
+    except CirculationError as e:
+        flash(e.message, 'warning')
+        return redirect(url_for('loans.my_loans'))
     
     if fine > 0:
         flash(f'Đã trả sách. Phí trễ hạn: {fine:.2f} VNĐ', 'warning')
@@ -112,25 +79,85 @@ def my_loans():
     return render_template('loans/my_loans.html', borrows=borrows)
 
 
+# Sắp xếp bảng quản lý mượn/trả: [(cột, giảm_dần), ...]
+LOAN_SORT_KEYS = {
+    'borrowed_desc': lambda: [(BorrowRecord.borrowed_at, True), (BorrowRecord.id, True)],
+    'borrowed_asc': lambda: [(BorrowRecord.borrowed_at, False), (BorrowRecord.id, False)],
+    'due_asc': lambda: [(BorrowRecord.due_date, False), (BorrowRecord.id, False)],
+    'due_desc': lambda: [(BorrowRecord.due_date, True), (BorrowRecord.id, True)],
+}
+
+
+def _date_arg(name):
+    """Đọc tham số ngày dạng YYYY-MM-DD, bỏ qua nếu không hợp lệ"""
+    try:
+        return date.fromisoformat(request.args.get(name, ''))
+    except ValueError:
+        return None
+
+
 @loans_bp.route('/all')
 @admin_required
 def all_loans():
     """Danh sách tất cả mượn/trả (chỉ admin)"""
     status = request.args.get('status', 'all')
-    query = BorrowRecord.query
+    patron = request.args.get('patron', '').strip()
+    date_from = _date_arg('date_from')
+    date_to = _date_arg('date_to')
+    sort = request.args.get('sort', 'borrowed_desc')
+    if sort not in LOAN_SORT_KEYS:
+        sort = 'borrowed_desc'
+    
+    # Nạp user và book trong cùng câu truy vấn (tránh 2 lazy load mỗi dòng)
+    query = BorrowRecord.query.options(
+        joinedload(BorrowRecord.user),
+        joinedload(BorrowRecord.book)
+    )
     
     if status == 'active':
         query = query.filter(BorrowRecord.returned_at.is_(None))
     elif status == 'overdue':
-        query = query.filter(
-            BorrowRecord.returned_at.is_(None),
-            BorrowRecord.due_date < date.today()
-        )
+        query = query.filter(BorrowRecord.status == 'overdue')
     elif status == 'returned':
         query = query.filter(BorrowRecord.returned_at.isnot(None))
     
-    borrows = query.order_by(BorrowRecord.borrowed_at.desc()).all()
-    return render_template('loans/all_loans.html', borrows=borrows, status=status)
+    if patron:
+        if patron.isdigit():
+            query = query.filter(BorrowRecord.user_id == int(patron))
+        else:
+            query = query.filter(BorrowRecord.user.has(
+                User.email.ilike(f"%{patron}%") | User.name.ilike(f"%{patron}%")
+            ))
+    
+    if date_from:
+        query = query.filter(BorrowRecord.borrowed_at >= datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        query = query.filter(BorrowRecord.borrowed_at < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    
+    filters = {
+        'status': status,
+        'patron': patron,
+        'date_from': date_from.isoformat() if date_from else '',
+        'date_to': date_to.isoformat() if date_to else '',
+        'sort': sort,
+    }
+    
+    try:
+        pagination = paginate_keyset(
+            query, LOAN_SORT_KEYS[sort](),
+            cursor=request.args.get('cursor') or None,
+            per_page=current_app.config.get('PER_PAGE', 20),
+            with_total=request.args.get('count', '0') in ('1', 'true')
+        )
+    except InvalidCursor:
+        flash('Liên kết phân trang không hợp lệ.', 'warning')
+        return redirect(url_for('loans.all_loans', **filters))
+    
+    return render_template('loans/all_loans.html',
+                         borrows=pagination.items,
+                         pagination=pagination,
+                         status=status,
+                         filters=filters)
 
 
 # RESTful API endpoints
@@ -138,36 +165,15 @@ def all_loans():
 @login_required
 def api_borrow_book(book_id):
     """API mượn sách"""
-    book = Book.query.get_or_404(book_id)
-    
-    if book.available_copies <= 0:
-        return jsonify({'error': 'Sách không có sẵn'}), 400
-    
-    existing_borrow = BorrowRecord.query.filter_by(
-        user_id=current_user.id,
-        book_id=book_id,
-        returned_at=None
-    ).first()
-    
-    if existing_borrow:
-        return jsonify({'error': 'Bạn đã mượn sách này rồi'}), 400
-    
-    due_date = date.today() + timedelta(days=14)
-    borrow_record = BorrowRecord(
-        user_id=current_user.id,
-        book_id=book_id,
-        due_date=due_date,
-        status='borrowed'
-    )
-    
-    book.available_copies -= 1
-    db.session.add(borrow_record)
-    db.session.commit()
+    try:
+        borrow_record, _ = circulation.borrow_book(current_user.id, book_id)
+    except CirculationError as e:
+        return jsonify({'error': e.message}), e.status_code
     
     return jsonify({
         'message': 'Mượn sách thành công',
         'borrow_id': borrow_record.id,
-        'due_date': due_date.isoformat()
+        'due_date': borrow_record.due_date.isoformat()
     }), 201
 
 
@@ -183,17 +189,94 @@ def api_return_book(borrow_id):
     if borrow_record.returned_at:
         return jsonify({'error': 'Sách đã được trả'}), 400
     
-    fine = borrow_record.calculate_fine()
-    borrow_record.fine_amount = fine
-    borrow_record.returned_at = datetime.utcnow()
-    borrow_record.status = 'returned'
-    
-    book = borrow_record.book
-    book.available_copies += 1
-    db.session.commit()
+    try:
+        fine = circulation.return_book(borrow_record)
+    except CirculationError as e:
+        return jsonify({'error': e.message}), e.status_code
     
     return jsonify({
         'message': 'Trả sách thành công',
         'fine': fine
     }), 200
 
+
+def _batch_request():
+    """Đọc JSON của API batch: trả về (data, patron_id) hoặc raise CirculationError"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise CirculationError('Không có dữ liệu')
+    
+    # Chuỗi cũng lặp được: "12" sẽ thành hai mã 1 và 2
+    if any(not isinstance(data.get(key) or [], (list, tuple))
+           for key in ('book_ids', 'borrow_ids', 'isbns')):
+        raise CirculationError('Danh sách mã không hợp lệ')
+    
+    try:
+        for key in ('book_ids', 'borrow_ids'):
+            data[key] = [int(v) for v in data.get(key) or []]
+        data['isbns'] = [str(v).strip() for v in data.get('isbns') or [] if str(v).strip()]
+        patron_id = int(data.get('user_id') or current_user.id)
+    except (TypeError, ValueError):
+        raise CirculationError('Danh sách mã không hợp lệ')
+    
+    total = len(data['book_ids']) + len(data['borrow_ids']) + len(data['isbns'])
+    if total == 0:
+        raise CirculationError('Danh sách rỗng')
+    if total > current_app.config.get('CIRCULATION_BATCH_MAX', 200):
+        raise CirculationError('Danh sách quá dài')
+    
+    # Chỉ admin (quầy thủ thư) được thao tác cho độc giả khác
+    if patron_id != current_user.id:
+        if not current_user.is_admin:
+            raise CirculationError('Không có quyền', 403)
+        if db.session.get(User, patron_id) is None:
+            raise CirculationError('Không tìm thấy độc giả', 404)
+    return data, patron_id
+
+
+def _batch_response(patron_id, results):
+    succeeded = sum(1 for item in results if item['ok'])
+    return jsonify({
+        'user_id': patron_id,
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'results': results
+    }), 200
+
+
+@loans_bp.route('/api/batch/borrow', methods=['POST'])
+@login_required
+def api_batch_borrow():
+    """API mượn nhiều sách một lần (quầy thủ thư).
+    
+    Body: {"user_id": 5, "book_ids": [1, 2], "isbns": ["978..."]}
+    """
+    try:
+        data, patron_id = _batch_request()
+    except CirculationError as e:
+        return jsonify({'error': e.message}), e.status_code
+    
+    results = circulation.batch_borrow(patron_id, book_ids=data['book_ids'], isbns=data['isbns'])
+    return _batch_response(patron_id, results)
+
+
+@loans_bp.route('/api/batch/return', methods=['POST'])
+@login_required
+def api_batch_return():
+    """API trả nhiều sách một lần.
+    
+    Body: {"borrow_ids": [10, 11]} hoặc {"user_id": 5, "book_ids": [1], "isbns": ["978..."]}
+    """
+    try:
+        data, patron_id = _batch_request()
+        results = circulation.batch_return(
+            borrow_ids=data['borrow_ids'],
+            user_id=patron_id,
+            book_ids=data['book_ids'],
+            isbns=data['isbns'],
+            owner_id=None if current_user.is_admin else current_user.id
+        )
+    except CirculationError as e:
+        return jsonify({'error': e.message}), e.status_code
+    
+    return _batch_response(patron_id, results)
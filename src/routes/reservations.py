@@ -1,8 +1,14 @@
-from flask import Blueprint, request, jsonify, render_template, flash, redirect, url_for
+from flask import Blueprint, request, jsonify, render_template, flash, redirect, url_for, current_app
 from flask_login import login_required, current_user
-from datetime import datetime
-from ..models import Reservation, Book, BorrowRecord
+from datetime import datetime, date, timedelta
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
+from ..models import Reservation, Book, BorrowRecord, User
 from ..extensions import db
+from ..services.pagination import paginate_keyset, InvalidCursor
+from ..services.holds import cancel_hold
+from ..services import counters
+from ..services.stats_cache import invalidate_stats
 from functools import wraps
 
 reservations_bp = Blueprint('reservations', __name__, url_prefix='/reservations')
@@ -31,10 +37,10 @@ def reserve_book(book_id):
         return redirect(url_for('books.list_books'))
     
     # Kiểm tra xem user đã đặt trước chưa
-    existing_reservation = Reservation.query.filter_by(
-        user_id=current_user.id,
-        book_id=book_id,
-        fulfilled=False
+    existing_reservation = Reservation.query.filter(
+        Reservation.user_id == current_user.id,
+        Reservation.book_id == book_id,
+        or_(Reservation.fulfilled.is_(False), Reservation.status == 'ready')
     ).first()
     
     if existing_reservation:
@@ -60,7 +66,9 @@ def reserve_book(book_id):
     )
     
     db.session.add(reservation)
+    counters.bump(pending_reservations=1)
     db.session.commit()
+    invalidate_stats()
     
     flash(f'Đã đặt trước sách "{book.title}". Bạn sẽ được thông báo khi sách có sẵn.', 'success')
     return redirect(url_for('reservations.my_reservations'))
@@ -70,9 +78,10 @@ def reserve_book(book_id):
 @login_required
 def my_reservations():
     """Danh sách đặt trước của user"""
-    reservations = Reservation.query.filter_by(
-        user_id=current_user.id,
-        fulfilled=False
+    # Đang chờ và đã được giữ sách (chờ nhận)
+    reservations = Reservation.query.filter(
+        Reservation.user_id == current_user.id,
+        or_(Reservation.fulfilled.is_(False), Reservation.status == 'ready')
     ).order_by(Reservation.reserved_at.desc()).all()
     return render_template('reservations/my_reservations.html', reservations=reservations)
 
@@ -87,27 +96,89 @@ def cancel_reservation(reservation_id):
         flash('Bạn không có quyền hủy đặt trước này.', 'danger')
         return redirect(url_for('reservations.my_reservations'))
     
-    db.session.delete(reservation)
+    # Nếu sách đang được giữ, chuyển cho người kế tiếp trong hàng đợi
+    cancel_hold(reservation)
     db.session.commit()
+    invalidate_stats()
     
     flash('Đã hủy đặt trước.', 'success')
     return redirect(url_for('reservations.my_reservations'))
 
 
+# Sắp xếp bảng quản lý đặt trước: [(cột, giảm_dần), ...]
+RESERVATION_SORT_KEYS = {
+    'reserved_desc': lambda: [(Reservation.reserved_at, True), (Reservation.id, True)],
+    'reserved_asc': lambda: [(Reservation.reserved_at, False), (Reservation.id, False)],
+}
+
+
+def _date_arg(name):
+    """Đọc tham số ngày dạng YYYY-MM-DD, bỏ qua nếu không hợp lệ"""
+    try:
+        return date.fromisoformat(request.args.get(name, ''))
+    except ValueError:
+        return None
+
+
 @reservations_bp.route('/all')
 @admin_required
 def all_reservations():
     """Danh sách tất cả đặt trước (chỉ admin)"""
     fulfilled = request.args.get('fulfilled', 'false')
-    query = Reservation.query
+    patron = request.args.get('patron', '').strip()
+    date_from = _date_arg('date_from')
+    date_to = _date_arg('date_to')
+    sort = request.args.get('sort', 'reserved_desc')
+    if sort not in RESERVATION_SORT_KEYS:
+        sort = 'reserved_desc'
+    
+    # Nạp user và book trong cùng câu truy vấn
+    query = Reservation.query.options(
+        joinedload(Reservation.user),
+        joinedload(Reservation.book)
+    )
     
     if fulfilled == 'true':
         query = query.filter_by(fulfilled=True)
     else:
         query = query.filter_by(fulfilled=False)
     
-    reservations = query.order_by(Reservation.reserved_at.desc()).all()
-    return render_template('reservations/all_reservations.html', reservations=reservations)
+    if patron:
+        if patron.isdigit():
+            query = query.filter(Reservation.user_id == int(patron))
+        else:
+            query = query.filter(Reservation.user.has(
+                User.email.ilike(f"%{patron}%") | User.name.ilike(f"%{patron}%")
+            ))
+    
+    if date_from:
+        query = query.filter(Reservation.reserved_at >= datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        query = query.filter(Reservation.reserved_at < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    
+    filters = {
+        'fulfilled': 'true' if fulfilled == 'true' else 'false',
+        'patron': patron,
+        'date_from': date_from.isoformat() if date_from else '',
+        'date_to': date_to.isoformat() if date_to else '',
+        'sort': sort,
+    }
+    
+    try:
+        pagination = paginate_keyset(
+            query, RESERVATION_SORT_KEYS[sort](),
+            cursor=request.args.get('cursor') or None,
+            per_page=current_app.config.get('PER_PAGE', 20),
+            with_total=request.args.get('count', '0') in ('1', 'true')
+        )
+    except InvalidCursor:
+        flash('Liên kết phân trang không hợp lệ.', 'warning')
+        return redirect(url_for('reservations.all_reservations', **filters))
+    
+    return render_template('reservations/all_reservations.html',
+                         reservations=pagination.items,
+                         pagination=pagination,
+                         filters=filters)
 
 
 # RESTful API
@@ -120,10 +191,10 @@ def api_reserve_book(book_id):
     if book.available_copies > 0:
         return jsonify({'error': 'Sách có sẵn, không cần đặt trước'}), 400
     
-    existing_reservation = Reservation.query.filter_by(
-        user_id=current_user.id,
-        book_id=book_id,
-        fulfilled=False
+    existing_reservation = Reservation.query.filter(
+        Reservation.user_id == current_user.id,
+        Reservation.book_id == book_id,
+        or_(Reservation.fulfilled.is_(False), Reservation.status == 'ready')
     ).first()
     
     if existing_reservation:
@@ -136,7 +207,9 @@ def api_reserve_book(book_id):
     )
     
     db.session.add(reservation)
+    counters.bump(pending_reservations=1)
     db.session.commit()
+    invalidate_stats()
     
     return jsonify({
         'message': 'Đặt trước thành công',
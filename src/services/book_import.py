@@ -0,0 +1,195 @@
+"""
+Nhập sách hàng loạt từ CSV hoặc NDJSON.
+
+File được đọc tuần tự từng dòng (không nạp toàn bộ vào bộ nhớ). Mỗi lô
+`chunk_size` dòng: kiểm tra ISBN trùng bằng MỘT truy vấn `IN (...)`, chèn bằng
+MỘT câu lệnh INSERT nhiều dòng và commit. Dòng lỗi được ghi vào báo cáo.
+"""
+import csv
+import io
+import json
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from ..extensions import db
+from ..models import Book
+from . import counters
+
+FORMATS = ('csv', 'ndjson')
+MAX_REPORTED_ERRORS = 1000
+
+
+@dataclass
+class ImportResult:
+    processed: int = 0
+    inserted: int = 0
+    error_count: int = 0
+    errors: List[dict] = field(default_factory=list)
+    started: float = field(default_factory=time.monotonic)
+    elapsed: float = 0.0
+
+    def add_error(self, row_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_number, 'error': message})
+
+    @property
+    def rows_per_second(self):
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self):
+        return {
+            'processed': self.processed,
+            'inserted': self.inserted,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'errors_truncated': self.error_count > len(self.errors),
+            'elapsed_seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+        }
+
+
+def detect_format(filename=None, content_type=None):
+    """Đoán định dạng từ tên file hoặc Content-Type"""
+    name = (filename or '').lower()
+    ctype = (content_type or '').lower()
+    if name.endswith(('.ndjson', '.jsonl')) or 'ndjson' in ctype or 'jsonl' in ctype:
+        return 'ndjson'
+    if name.endswith('.csv') or 'csv' in ctype:
+        return 'csv'
+    return None
+
+
+def iter_records(stream, fmt):
+    """Sinh (số_dòng, dict) từ stream nhị phân, đọc tuần tự"""
+    if not isinstance(stream, io.BufferedIOBase) and not hasattr(stream, 'read1'):
+        stream = io.BufferedReader(stream)
+    text_stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text_stream)
+        for row_number, row in enumerate(reader, 1):
+            yield row_number, row
+    elif fmt == 'ndjson':
+        for row_number, line in enumerate(text_stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield row_number, e
+                continue
+            yield row_number, record if isinstance(record, dict) else ValueError('Dòng không phải object JSON')
+    else:
+        raise ValueError(f'Định dạng không hỗ trợ: {fmt}')
+
+
+def _clean(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def normalize_record(record, now):
+    """Chuyển một bản ghi thô thành dict cột của bảng books (raise ValueError nếu lỗi)"""
+    if isinstance(record, Exception):
+        raise ValueError(f'Không đọc được dòng: {record}')
+    title = _clean(record.get('title'))
+    if not title:
+        raise ValueError('Tên sách là bắt buộc')
+    raw_copies = _clean(record.get('total_copies'))
+    try:
+        total_copies = int(raw_copies) if raw_copies is not None else 1
+    except ValueError:
+        raise ValueError(f'total_copies không hợp lệ: {raw_copies}')
+    if total_copies < 0:
+        raise ValueError('total_copies không được âm')
+    return {
+        'title': title,
+        'author': _clean(record.get('author')),
+        'category': _clean(record.get('category')),
+        'isbn': _clean(record.get('isbn')),
+        'total_copies': total_copies,
+        'available_copies': total_copies,
+        'created_at': now,
+    }
+
+
+def _insert_chunk(rows, result):
+    """Chèn một lô; nếu vướng ràng buộc (ví dụ ISBN vừa bị thêm song song) thì chèn từng dòng"""
+    if not rows:
+        return
+    try:
+        db.session.execute(insert(Book.__table__).values([values for _, values in rows]))
+        counters.bump(total_books=len(rows),
+                      total_copies=sum(values['total_copies'] for _, values in rows))
+        db.session.commit()
+        result.inserted += len(rows)
+        return
+    except IntegrityError:
+        db.session.rollback()
+
+    for row_number, values in rows:
+        try:
+            db.session.execute(insert(Book.__table__).values(values))
+            counters.bump(total_books=1, total_copies=values['total_copies'])
+            db.session.commit()
+            result.inserted += 1
+        except IntegrityError:
+            db.session.rollback()
+            result.add_error(row_number, 'ISBN đã tồn tại')
+
+
+def _process_chunk(chunk, seen_isbns, result):
+    now = datetime.utcnow()
+    rows = []
+    for row_number, record in chunk:
+        try:
+            rows.append((row_number, normalize_record(record, now)))
+        except ValueError as e:
+            result.add_error(row_number, str(e))
+
+    # Kiểm tra ISBN trùng với database bằng một truy vấn cho cả lô
+    isbns = {values['isbn'] for _, values in rows if values['isbn']}
+    existing = set()
+    if isbns:
+        existing = {isbn for (isbn,) in db.session.query(Book.isbn).filter(Book.isbn.in_(isbns))}
+
+    accepted = []
+    for row_number, values in rows:
+        isbn = values['isbn']
+        if isbn and (isbn in existing or isbn in seen_isbns):
+            result.add_error(row_number, f'ISBN đã tồn tại: {isbn}')
+            continue
+        if isbn:
+            seen_isbns.add(isbn)
+        accepted.append((row_number, values))
+
+    _insert_chunk(accepted, result)
+
+
+def import_books(stream, fmt, chunk_size=1000, progress=None):
+    """Nhập sách từ `stream` (file nhị phân). `progress(result)` được gọi sau mỗi lô."""
+    result = ImportResult()
+    seen_isbns = set()
+    chunk = []
+    for row_number, record in iter_records(stream, fmt):
+        chunk.append((row_number, record))
+        result.processed += 1
+        if len(chunk) >= chunk_size:
+            _process_chunk(chunk, seen_isbns, result)
+            chunk = []
+            result.elapsed = time.monotonic() - result.started
+            if progress:
+                progress(result)
+    if chunk:
+        _process_chunk(chunk, seen_isbns, result)
+        result.elapsed = time.monotonic() - result.started
+        if progress:
+            progress(result)
+    result.elapsed = time.monotonic() - result.started
+    return result
@@ -0,0 +1,464 @@
+"""
+Nghiệp vụ mượn/trả sách dùng chung cho routes HTML và API.
+
+Số lượng `available_copies` chỉ được thay đổi bằng UPDATE nguyên tử trên
+database (không đọc - sửa - ghi trong Python), nên nhiều lượt mượn đồng thời
+cùng một đầu sách không thể làm số bản có sẵn bị âm.
+"""
+from datetime import date, datetime, timedelta
+from flask import current_app
+from sqlalchemy import update, case, or_, and_, func, literal
+from ..extensions import db
+from ..models import Book, BorrowRecord
+from . import circulation_stats, counters, popularity
+from .stats_cache import invalidate_stats
+
+
+class CirculationError(Exception):
+    """Lỗi nghiệp vụ mượn/trả, kèm mã HTTP gợi ý cho API"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def due_date_from_today():
+    days = current_app.config.get('BORROW_DAYS_DEFAULT', 14)
+    return date.today() + timedelta(days=days)
+
+
+def take_copy(book_id):
+    """Trừ 1 bản có sẵn nếu còn: UPDATE ... WHERE available_copies > 0.
+
+    Trả về tên sách nếu thành công, None nếu sách hết bản hoặc không tồn tại.
+    """
+    stmt = update(Book).where(
+        Book.id == book_id,
+        Book.available_copies > 0
+    ).values(
+        available_copies=Book.available_copies - 1
+    ).execution_options(synchronize_session=False)
+
+    if db.session.get_bind().dialect.update_returning:
+        row = db.session.execute(stmt.returning(Book.title)).first()
+        return row[0] if row else None
+
+    if db.session.execute(stmt).rowcount != 1:
+        return None
+    return db.session.query(Book.title).filter(Book.id == book_id).scalar()
+
+
+def take_copies(book_ids):
+    """Phiên bản theo lô của `take_copy`: một UPDATE ... WHERE id IN (...) AND available_copies > 0.
+
+    Trả về tập id sách đã được trừ.
+    """
+    if not book_ids:
+        return set()
+    if not db.session.get_bind().dialect.update_returning:
+        return {book_id for book_id in book_ids if take_copy(book_id) is not None}
+    stmt = update(Book).where(
+        Book.id.in_(book_ids),
+        Book.available_copies > 0
+    ).values(
+        available_copies=Book.available_copies - 1
+    ).returning(Book.id).execution_options(synchronize_session=False)
+    return {book_id for (book_id,) in db.session.execute(stmt)}
+
+
+def release_copy(book_id, count=1):
+    """Cộng lại bản có sẵn khi trả sách (UPDATE nguyên tử)"""
+    db.session.execute(
+        update(Book).where(Book.id == book_id).values(
+            available_copies=Book.available_copies + count
+        ).execution_options(synchronize_session=False)
+    )
+
+
+def release_copies(counts):
+    """Cộng lại nhiều đầu sách trong một UPDATE: {book_id: số bản}"""
+    if not counts:
+        return
+    db.session.execute(
+        update(Book).where(Book.id.in_(counts)).values(
+            available_copies=Book.available_copies + case(counts, value=Book.id, else_=0)
+        ).execution_options(synchronize_session=False)
+    )
+
+
+def set_total_copies(book, total_copies):
+    """Đổi tổng số bản của sách; số bản có sẵn được cộng/trừ phần chênh lệch ngay trong
+    câu UPDATE (không ghi đè lượt mượn/trả chạy song song). Trả về phần chênh lệch.
+
+    Raise CirculationError nếu giảm quá số bản đang có sẵn (phần còn lại đang được
+    mượn/giữ) hoặc sách vừa bị sửa ở nơi khác.
+    """
+    old_total = book.total_copies or 0
+    diff = total_copies - old_total
+    if diff == 0:
+        return 0
+    db.session.flush()  # ghi các thay đổi khác của sách trước
+    result = db.session.execute(
+        update(Book).where(
+            Book.id == book.id,
+            Book.total_copies == old_total,  # sửa đồng thời: một bên thắng
+            Book.available_copies + diff >= 0
+        ).values(
+            total_copies=total_copies,
+            available_copies=Book.available_copies + diff
+        ).execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        db.session.rollback()
+        current = db.session.query(Book.total_copies, Book.available_copies).filter(
+            Book.id == book.id
+        ).first()
+        if current is not None and current.total_copies == old_total:
+            raise CirculationError(
+                f'Không thể giảm {-diff} bản: chỉ còn {current.available_copies} bản có sẵn'
+            )
+        raise CirculationError('Sách vừa được cập nhật ở nơi khác, vui lòng thử lại', 409)
+    db.session.expire(book, ['total_copies', 'available_copies'])
+
+    counters.bump(total_copies=diff)
+    # Bản sách thêm vào được giữ cho người đang chờ đặt trước
+    if diff > 0:
+        from .holds import allocate_holds
+        allocate_holds([book.id])
+    return diff
+
+
+def close_loans(fines, now):
+    """Đóng các phiếu còn mở {borrow_id: phí}: UPDATE ... WHERE id IN (...) AND returned_at IS NULL.
+
+    Trả về tập id phiếu thực sự được đóng (phiếu đã được trả ở transaction
+    khác bị bỏ qua, không được cộng lại bản sách hay trừ bộ đếm lần nữa).
+    """
+    if not fines:
+        return set()
+    if not db.session.get_bind().dialect.update_returning:
+        closed = set()
+        for borrow_id, fine in fines.items():
+            result = db.session.execute(
+                update(BorrowRecord).where(
+                    BorrowRecord.id == borrow_id,
+                    BorrowRecord.returned_at.is_(None)
+                ).values(returned_at=now, fine_amount=fine, status='returned')
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 1:
+                closed.add(borrow_id)
+        return closed
+    stmt = update(BorrowRecord).where(
+        BorrowRecord.id.in_(fines),
+        BorrowRecord.returned_at.is_(None)
+    ).values(
+        returned_at=now,
+        fine_amount=case(fines, value=BorrowRecord.id, else_=BorrowRecord.fine_amount),
+        status='returned'
+    ).returning(BorrowRecord.id).execution_options(synchronize_session=False)
+    return {borrow_id for (borrow_id,) in db.session.execute(stmt)}
+
+
+def borrow_book(user_id, book_id):
+    """Mượn sách. Trả về (BorrowRecord, tên sách) hoặc raise CirculationError."""
+    existing_borrow = db.session.query(BorrowRecord.id).filter_by(
+        user_id=user_id,
+        book_id=book_id,
+        returned_at=None
+    ).first()
+    if existing_borrow:
+        raise CirculationError('Bạn đã mượn sách này rồi')
+
+    from .holds import claim_ready_holds, close_waiting
+
+    # Sách đã được giữ cho độc giả này: bản sách đã được trừ lúc giữ
+    if claim_ready_holds(user_id, [book_id]):
+        title = db.session.query(Book.title).filter(Book.id == book_id).scalar()
+    else:
+        title = take_copy(book_id)
+        if title is None:
+            db.session.rollback()
+            if db.session.get(Book, book_id) is None:
+                raise CirculationError('Không tìm thấy sách', 404)
+            raise CirculationError('Sách hiện không có sẵn')
+        close_waiting(user_id, [book_id])
+
+    # Cùng transaction với lệnh UPDATE ở trên
+    borrow_record = BorrowRecord(
+        user_id=user_id,
+        book_id=book_id,
+        due_date=due_date_from_today(),
+        status='borrowed'
+    )
+    db.session.add(borrow_record)
+    circulation_stats.record_borrows([_category_of(book_id)])
+    counters.bump(active_loans=1)
+    popularity.record_borrows(user_id, [book_id])
+    db.session.commit()
+    invalidate_stats()
+    return borrow_record, title
+
+
+def return_book(borrow_record):
+    """Trả sách. Trả về phí trễ hạn hoặc raise CirculationError nếu đã trả."""
+    fine = borrow_record.calculate_fine()
+    was_overdue = borrow_record.status == 'overdue'
+    result = db.session.execute(
+        update(BorrowRecord).where(
+            BorrowRecord.id == borrow_record.id,
+            BorrowRecord.returned_at.is_(None)
+        ).values(
+            returned_at=datetime.utcnow(),
+            fine_amount=fine,
+            status='returned'
+        )
+    )
+    if result.rowcount != 1:
+        db.session.rollback()
+        raise CirculationError('Sách này đã được trả rồi')
+
+    # Bản vừa trả được giữ cho người đầu hàng đợi đặt trước (nếu có)
+    from .holds import allocate_holds
+    release_copy(borrow_record.book_id)
+    allocate_holds([borrow_record.book_id])
+    circulation_stats.record_returns([(_category_of(borrow_record.book_id), fine)])
+    counters.bump(active_loans=-1, overdue_loans=-1 if was_overdue else 0)
+    db.session.commit()
+    invalidate_stats()
+    return fine
+
+
+def _category_of(book_id):
+    return db.session.query(Book.category).filter(Book.id == book_id).scalar()
+
+
+def _resolve_isbns(isbns):
+    if not isbns:
+        return {}
+    return dict(db.session.query(Book.isbn, Book.id).filter(Book.isbn.in_(set(isbns))))
+
+
+def _book_items(book_ids, isbns, isbn_map):
+    """Danh sách item theo đúng thứ tự nhập; item có 'error' nếu không xác định được sách"""
+    items = [{'book_id': book_id} for book_id in book_ids]
+    for isbn in isbns:
+        item = {'isbn': isbn}
+        if isbn in isbn_map:
+            item['book_id'] = isbn_map[isbn]
+        else:
+            item['error'] = 'Không tìm thấy sách'
+        items.append(item)
+    return items
+
+
+def batch_borrow(user_id, book_ids=(), isbns=()):
+    """Mượn nhiều sách cho một độc giả trong một transaction.
+
+    Kiểm tra bằng truy vấn theo tập hợp (IN), trừ số bản bằng một UPDATE,
+    thêm toàn bộ BorrowRecord rồi commit một lần. Trả về kết quả từng item.
+    """
+    items = _book_items(book_ids, isbns, _resolve_isbns(isbns))
+    ids = {item['book_id'] for item in items if 'book_id' in item}
+
+    books = {book_id: (title, category) for book_id, title, category in db.session.query(
+        Book.id, Book.title, Book.category
+    ).filter(Book.id.in_(ids))} if ids else {}
+    open_borrows = {
+        book_id for (book_id,) in db.session.query(BorrowRecord.book_id).filter(
+            BorrowRecord.user_id == user_id,
+            BorrowRecord.book_id.in_(ids),
+            BorrowRecord.returned_at.is_(None)
+        )
+    } if ids else set()
+
+    candidates = []
+    seen = set()
+    for item in items:
+        if 'error' in item:
+            continue
+        book_id = item['book_id']
+        if book_id not in books:
+            item['error'] = 'Không tìm thấy sách'
+        elif book_id in open_borrows:
+            item['error'] = 'Độc giả đã mượn sách này rồi'
+        elif book_id in seen:
+            item['error'] = 'Sách bị trùng trong danh sách'
+        else:
+            seen.add(book_id)
+            item['title'] = books[book_id][0]
+            candidates.append(item)
+
+    from .holds import claim_ready_holds, close_waiting
+
+    candidate_ids = [item['book_id'] for item in candidates]
+    held = claim_ready_holds(user_id, candidate_ids)
+    taken = take_copies([book_id for book_id in candidate_ids if book_id not in held])
+    close_waiting(user_id, taken)
+    taken |= held
+    due_date = due_date_from_today()
+    created = []
+    for item in candidates:
+        if item['book_id'] not in taken:
+            item['error'] = 'Sách hiện không có sẵn'
+            continue
+        record = BorrowRecord(user_id=user_id, book_id=item['book_id'],
+                              due_date=due_date, status='borrowed')
+        created.append((item, record))
+
+    db.session.add_all([record for _, record in created])
+    circulation_stats.record_borrows([books[record.book_id][1] for _, record in created])
+    counters.bump(active_loans=len(created))
+    popularity.record_borrows(user_id, [record.book_id for _, record in created])
+    db.session.commit()
+    invalidate_stats()
+
+    for item, record in created:
+        item['borrow_id'] = record.id
+        item['due_date'] = due_date.isoformat()
+    for item in items:
+        item['ok'] = 'error' not in item
+    return items
+
+
+def batch_return(borrow_ids=(), user_id=None, book_ids=(), isbns=(), owner_id=None):
+    """Trả nhiều sách trong một transaction.
+
+    Nhận `borrow_ids`, hoặc `book_ids`/`isbns` của độc giả `user_id`.
+    `owner_id` (nếu có) giới hạn chỉ được trả phiếu của chính người đó.
+    """
+    items = [{'borrow_id': borrow_id} for borrow_id in borrow_ids]
+    if book_ids or isbns:
+        if user_id is None:
+            raise CirculationError('Cần user_id khi trả theo mã sách/ISBN')
+        items += _book_items(book_ids, isbns, _resolve_isbns(isbns))
+
+    borrow_id_set = {item['borrow_id'] for item in items if 'borrow_id' in item}
+    book_id_set = {item['book_id'] for item in items if 'book_id' in item}
+    conditions = []
+    if borrow_id_set:
+        conditions.append(BorrowRecord.id.in_(borrow_id_set))
+    if book_id_set:
+        conditions.append(and_(
+            BorrowRecord.user_id == user_id,
+            BorrowRecord.book_id.in_(book_id_set),
+            BorrowRecord.returned_at.is_(None)
+        ))
+    records = BorrowRecord.query.filter(or_(*conditions)).all() if conditions else []
+    by_id = {record.id: record for record in records}
+    open_by_book = {record.book_id: record for record in records
+                    if record.user_id == user_id and record.returned_at is None}
+
+    now = datetime.utcnow()
+    fines = {}
+    accepted = []
+    seen = set()
+    for item in items:
+        if 'error' in item:
+            continue
+        if 'borrow_id' in item:
+            record = by_id.get(item['borrow_id'])
+        else:
+            record = open_by_book.get(item['book_id'])
+        if record is None:
+            item['error'] = 'Không tìm thấy phiếu mượn'
+        elif owner_id is not None and record.user_id != owner_id:
+            item['error'] = 'Không có quyền'
+        elif record.returned_at is not None:
+            item['error'] = 'Sách đã được trả'
+        elif record.id in seen:
+            item['error'] = 'Phiếu mượn bị trùng trong danh sách'
+        else:
+            seen.add(record.id)
+            fines[record.id] = record.calculate_fine()
+            accepted.append((item, record))
+
+    # Chỉ các phiếu mà UPDATE có điều kiện thực sự đóng mới được tính
+    closed = close_loans(fines, now)
+    released = {}
+    returned = []
+    overdue_returned = 0
+    for item, record in accepted:
+        if record.id not in closed:
+            item['error'] = 'Sách đã được trả'
+            continue
+        fine = fines[record.id]
+        item.update(borrow_id=record.id, book_id=record.book_id, fine=fine)
+        returned.append((record.book_id, fine))
+        overdue_returned += record.status == 'overdue'
+        released[record.book_id] = released.get(record.book_id, 0) + 1
+
+    if closed:
+        from .holds import allocate_holds
+        release_copies(released)
+        allocate_holds(released)
+        categories = dict(db.session.query(Book.id, Book.category).filter(Book.id.in_(released)))
+        circulation_stats.record_returns([(categories.get(book_id), fine) for book_id, fine in returned])
+        counters.bump(active_loans=-len(closed), overdue_loans=-overdue_returned)
+    db.session.commit()
+    invalidate_stats()
+
+    for item in items:
+        item['ok'] = 'error' not in item
+    return items
+
+
+def days_overdue_expr(today):
+    """Số ngày quá hạn tính trong SQL (due_date < today)"""
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return func.julianday(today.isoformat()) - func.julianday(BorrowRecord.due_date)
+    # PostgreSQL: date - date = số ngày
+    return literal(today) - BorrowRecord.due_date
+
+
+def mark_overdue(today=None):
+    """Đánh dấu quá hạn và cập nhật phí cho MỌI phiếu chưa trả đã quá hạn
+    bằng các câu UPDATE theo tập hợp.
+
+    Phí được tính lại từ số ngày quá hạn (không cộng dồn) nên chạy lại nhiều lần
+    trong ngày vẫn cho cùng kết quả. Trả về số phiếu được cập nhật.
+    """
+    today = today or date.today()
+    fine = days_overdue_expr(today) * current_app.config.get('FINE_PER_DAY', 0.5)
+
+    # Phiếu đã quá hạn từ trước: chỉ tính lại phí
+    refreshed = db.session.execute(
+        update(BorrowRecord).where(
+            BorrowRecord.returned_at.is_(None),
+            BorrowRecord.due_date < today,
+            BorrowRecord.status == 'overdue'
+        ).values(fine_amount=fine).execution_options(synchronize_session=False)
+    ).rowcount
+
+    # Phiếu vừa chuyển sang quá hạn: thống kê và bộ đếm lấy từ chính các dòng UPDATE
+    # đã đổi (RETURNING), không từ một truy vấn riêng có thể lệch nếu có lượt trả xen giữa
+    newly_overdue = update(BorrowRecord).where(
+        BorrowRecord.returned_at.is_(None),
+        BorrowRecord.due_date < today,
+        BorrowRecord.status != 'overdue'
+    ).values(status='overdue', fine_amount=fine).execution_options(synchronize_session=False)
+    if db.session.get_bind().dialect.update_returning:
+        book_ids = [book_id for (book_id,) in
+                    db.session.execute(newly_overdue.returning(BorrowRecord.book_id))]
+    else:
+        candidates = db.session.query(BorrowRecord.id, BorrowRecord.book_id).filter(
+            BorrowRecord.returned_at.is_(None),
+            BorrowRecord.due_date < today,
+            BorrowRecord.status != 'overdue'
+        ).all()
+        book_ids = [book_id for borrow_id, book_id in candidates
+                    if db.session.execute(newly_overdue.where(BorrowRecord.id == borrow_id)).rowcount == 1]
+
+    categories = dict(db.session.query(Book.id, Book.category).filter(
+        Book.id.in_(set(book_ids))
+    )) if book_ids else {}
+    by_category = {}
+    for book_id in book_ids:
+        category = categories.get(book_id)
+        by_category[category] = by_category.get(category, 0) + 1
+    circulation_stats.record_new_overdues(by_category, day=today)
+    counters.bump(overdue_loans=len(book_ids))
+    db.session.commit()
+    invalidate_stats()
+    return refreshed + len(book_ids)
@@ -0,0 +1,128 @@
+"""
+Bảng tổng hợp lưu thông theo ngày và thể loại (daily_circulation_stats).
+
+Mượn, trả và đánh dấu quá hạn cộng dồn vào dòng (ngày, thể loại) bằng
+INSERT ... ON CONFLICT DO UPDATE trong cùng transaction với nghiệp vụ, nên
+dashboard đọc số liệu theo tháng từ bảng nhỏ này thay vì đếm lại toàn bộ
+lịch sử borrow_records. `backfill_stats()` dựng lại bảng từ lịch sử.
+"""
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, or_, and_
+from ..extensions import db
+from ..models import Book, BorrowRecord, DailyCirculationStat
+
+COUNTERS = ('borrows', 'returns', 'new_overdues', 'fines')
+
+
+def stat_day():
+    """Ngày ghi nhận mượn/trả (cùng múi giờ UTC với borrowed_at/returned_at)"""
+    return datetime.utcnow().date()
+
+
+def _upsert_statement():
+    if db.session.get_bind().dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(DailyCirculationStat.__table__)
+    return stmt.on_conflict_do_update(
+        index_elements=['day', 'category'],
+        set_={name: stmt.table.c[name] + stmt.excluded[name] for name in COUNTERS}
+    )
+
+
+def record_stats(rows):
+    """Cộng dồn các dòng {'day', 'category', 'borrows', ...} vào bảng tổng hợp (không commit)"""
+    merged = {}
+    for row in rows:
+        key = (row['day'], row.get('category') or '')
+        counts = merged.setdefault(key, dict.fromkeys(COUNTERS, 0))
+        for name in COUNTERS:
+            counts[name] += row.get(name, 0) or 0
+    if not merged:
+        return
+    db.session.execute(_upsert_statement(), [
+        dict(day=day, category=category, **counts)
+        for (day, category), counts in merged.items()
+    ])
+
+
+def record_borrows(categories, day=None):
+    day = day or stat_day()
+    record_stats([{'day': day, 'category': category, 'borrows': 1} for category in categories])
+
+
+def record_returns(returns, day=None):
+    """`returns`: [(thể loại, phí trễ hạn), ...]"""
+    day = day or stat_day()
+    record_stats([{'day': day, 'category': category, 'returns': 1, 'fines': fine}
+                  for category, fine in returns])
+
+
+def record_new_overdues(counts, day=None):
+    """`counts`: {thể loại: số phiếu vừa quá hạn}"""
+    day = day or stat_day()
+    record_stats([{'day': day, 'category': category, 'new_overdues': n}
+                  for category, n in counts.items()])
+
+
+def month_key(column):
+    """Biểu thức 'YYYY-MM' theo dialect"""
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return func.strftime('%Y-%m', column)
+    return func.to_char(column, 'YYYY-MM')
+
+
+def monthly_borrows(months=7, today=None):
+    """Số lượt mượn của `months` tháng gần nhất: một truy vấn GROUP BY trên bảng tổng hợp"""
+    today = today or date.today()
+    month_starts = [today.replace(day=1)]
+    for _ in range(months - 1):
+        month_starts.insert(0, (month_starts[0] - timedelta(days=1)).replace(day=1))
+
+    key = month_key(DailyCirculationStat.day)
+    counts = dict(db.session.query(key, func.sum(DailyCirculationStat.borrows)).filter(
+        DailyCirculationStat.day >= month_starts[0]
+    ).group_by(key))
+    return [{'month': start.strftime('%m/%Y'), 'count': int(counts.get(start.strftime('%Y-%m')) or 0)}
+            for start in month_starts]
+
+
+def _as_date(value):
+    # SQLite trả func.date() về dạng chuỗi
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def backfill_stats(today=None):
+    """Dựng lại toàn bộ bảng tổng hợp từ borrow_records. Trả về số dòng tổng hợp."""
+    today = today or date.today()
+    category = func.coalesce(Book.category, '')
+    borrowed_day = func.date(BorrowRecord.borrowed_at)
+    returned_day = func.date(BorrowRecord.returned_at)
+
+    rows = []
+    for day, cat, n in db.session.query(
+        borrowed_day, category, func.count(BorrowRecord.id)
+    ).join(Book, Book.id == BorrowRecord.book_id).group_by(borrowed_day, category):
+        rows.append({'day': _as_date(day), 'category': cat, 'borrows': n})
+
+    for day, cat, n, fines in db.session.query(
+        returned_day, category, func.count(BorrowRecord.id), func.sum(BorrowRecord.fine_amount)
+    ).join(Book, Book.id == BorrowRecord.book_id).filter(
+        BorrowRecord.returned_at.isnot(None)
+    ).group_by(returned_day, category):
+        rows.append({'day': _as_date(day), 'category': cat, 'returns': n, 'fines': fines or 0.0})
+
+    # Phiếu trở thành quá hạn vào ngày sau hạn trả (đang quá hạn hoặc đã trả trễ)
+    for due_date, cat, n in db.session.query(
+        BorrowRecord.due_date, category, func.count(BorrowRecord.id)
+    ).join(Book, Book.id == BorrowRecord.book_id).filter(or_(
+        and_(BorrowRecord.returned_at.is_(None), BorrowRecord.due_date < today),
+        returned_day > BorrowRecord.due_date
+    )).group_by(BorrowRecord.due_date, category):
+        rows.append({'day': _as_date(due_date) + timedelta(days=1), 'category': cat, 'new_overdues': n})
+
+    db.session.query(DailyCirculationStat).delete()
+    record_stats(rows)
+    db.session.commit()
+    return db.session.query(func.count()).select_from(DailyCirculationStat).scalar()
@@ -0,0 +1,86 @@
+"""
+Bộ đếm tổng cho dashboard và API thống kê (bảng counters).
+
+Mỗi nghiệp vụ làm thay đổi tổng số (đăng ký, thêm/xóa sách, mượn, trả, đặt
+trước...) gọi `bump()` trước khi commit, nên bộ đếm luôn khớp với dữ liệu đã
+commit và trang thống kê chỉ đọc vài dòng thay vì COUNT toàn bảng.
+`reconcile()` tính lại toàn bộ từ dữ liệu gốc (lệnh `flask reconcile-counters`).
+Bảng counters còn chứa số phiên bản dữ liệu (`version:<bảng>:<shard>`, xem data_versions).
+"""
+from sqlalchemy import case, func, update
+from ..extensions import db
+from ..models import Book, BorrowRecord, Reservation, StatCounter, User
+
+COUNTERS = (
+    'total_books',
+    'total_copies',
+    'total_users',
+    'active_loans',
+    'overdue_loans',
+    'pending_reservations',
+)
+
+
+def bump(**deltas):
+    """Cộng/trừ bộ đếm trong transaction hiện tại bằng một câu UPDATE (không commit).
+
+    Ví dụ: bump(active_loans=1, pending_reservations=-1)
+    """
+    deltas = {name: int(delta) for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    unknown = set(deltas) - set(COUNTERS)
+    if unknown:
+        raise ValueError(f'Bộ đếm không tồn tại: {", ".join(sorted(unknown))}')
+    result = db.session.execute(
+        update(StatCounter).where(StatCounter.name.in_(deltas)).values(
+            value=StatCounter.value + case(deltas, value=StatCounter.name, else_=0)
+        ).execution_options(synchronize_session=False)
+    )
+    # Thiếu dòng thì UPDATE không làm gì và dashboard hiện số cũ: báo lỗi thay vì
+    # bỏ qua (không tự thêm dòng ở đây vì transaction đang dở cũng bị đếm vào)
+    if result.rowcount != len(deltas):
+        raise RuntimeError('Bảng counters chưa được khởi tạo - chạy: python init_database.py '
+                           'hoặc flask reconcile-counters')
+
+
+def compute_counters():
+    """Tính lại các bộ đếm từ dữ liệu gốc (COUNT toàn bảng)"""
+    books, copies = db.session.query(
+        func.count(Book.id), func.coalesce(func.sum(Book.total_copies), 0)
+    ).one()
+    return {
+        'total_books': books,
+        'total_copies': int(copies),
+        'total_users': db.session.query(func.count(User.id)).scalar(),
+        'active_loans': db.session.query(func.count(BorrowRecord.id)).filter(
+            BorrowRecord.returned_at.is_(None)
+        ).scalar(),
+        'overdue_loans': db.session.query(func.count(BorrowRecord.id)).filter(
+            BorrowRecord.status == 'overdue'
+        ).scalar(),
+        'pending_reservations': db.session.query(func.count(Reservation.id)).filter(
+            Reservation.fulfilled.is_(False)
+        ).scalar(),
+    }
+
+
+def reconcile():
+    """Dựng lại bảng counters. Trả về {tên: (giá trị cũ, giá trị mới)}."""
+    old = dict(db.session.query(StatCounter.name, StatCounter.value).filter(StatCounter.name.in_(COUNTERS)))
+    new = compute_counters()
+    for name, value in new.items():
+        db.session.merge(StatCounter(name=name, value=value))
+    db.session.commit()
+    return {name: (old.get(name), value) for name, value in new.items()}
+
+
+def get_counters():
+    """Đọc toàn bộ bộ đếm (một truy vấn trên bảng vài dòng).
+
+    Lần đầu (bảng chưa có dữ liệu) sẽ tự dựng lại từ dữ liệu gốc.
+    """
+    values = dict(db.session.query(StatCounter.name, StatCounter.value).filter(StatCounter.name.in_(COUNTERS)))
+    if any(name not in values for name in COUNTERS):
+        values = {name: value for name, (_, value) in reconcile().items()}
+    return values
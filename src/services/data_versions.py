@@ -0,0 +1,129 @@
+"""
+Số phiên bản dữ liệu theo bảng (các dòng `version:<bảng>:<shard>` trong bảng counters).
+
+Mỗi transaction ghi vào một bảng được theo dõi, dù qua ORM (flush) hay câu
+INSERT/UPDATE/DELETE chạy bằng session, tăng số phiên bản của bảng đó đúng
+một lần. Các event flush/execute chỉ ghi nhận bảng nào đã bị ghi (bỏ qua câu
+lệnh không tác động dòng nào); việc tăng chạy SAU khi transaction nghiệp vụ đã
+commit, bằng một câu UPDATE tự commit riêng, nên mượn/trả không giữ khóa nào
+trên dòng phiên bản. Câu UPDATE đó chạy trên chính kết nối của session (vừa
+commit, chưa trả về pool) nên không cần mượn thêm kết nối. Mỗi bảng có
+`VERSION_SHARDS` dòng và mỗi lần tăng chọn ngẫu nhiên một dòng, nên các lần
+tăng đồng thời hầu như không chờ nhau.
+
+Phiên bản của bảng là tổng các dòng của nó; bộ phiên bản là "tem" dữ liệu: tem
+không đổi nghĩa là dữ liệu đã commit không đổi (dùng cho cache báo cáo và cache
+thống kê). Tem chỉ tăng sau khi dữ liệu đã commit nên không có tem cũ đi kèm
+dữ liệu mới; nếu tiến trình chết đúng giữa hai bước, giá trị cache cũ được dùng
+đến lần ghi kế tiếp. Dòng phiên bản được tạo với số ngẫu nhiên nên database
+mới/tạo lại không trùng tem với database cũ.
+"""
+import random
+import secrets
+from itertools import chain
+from flask import current_app
+from sqlalchemy import event, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from ..extensions import db
+from ..models import StatCounter
+
+TRACKED_TABLES = ('books', 'users', 'borrow_records', 'reservations')
+
+# Số dòng phiên bản của mỗi bảng
+VERSION_SHARDS = 8
+
+_TOUCHED = 'data_versions_touched'
+_CONNECTION = 'data_versions_connection'
+
+
+def version_name(table, shard):
+    return f'version:{table}:{shard}'
+
+
+def _touch(session, tables):
+    tables = {table for table in tables if table in TRACKED_TABLES}
+    if tables:
+        session.info.setdefault(_TOUCHED, set()).update(tables)
+        session.info[_CONNECTION] = session.connection()
+
+
+def _after_flush(session, flush_context):
+    objects = chain(
+        session.new, session.deleted,
+        (obj for obj in session.dirty if session.is_modified(obj, include_collections=False))
+    )
+    _touch(session, {obj.__table__.name for obj in objects if hasattr(obj, '__table__')})
+
+
+def _on_execute(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update
+            or orm_execute_state.is_delete):
+        return None
+    table = getattr(getattr(orm_execute_state.statement, 'table', None), 'name', None)
+    if table not in TRACKED_TABLES:
+        return None
+    result = orm_execute_state.invoke_statement()
+    # rowcount = 0: UPDATE/DELETE không khớp dòng nào, dữ liệu không đổi
+    # (-1 = driver không biết, coi như có ghi)
+    if getattr(result, 'rowcount', -1) != 0:
+        _touch(orm_execute_state.session, {table})
+    return result
+
+
+def _after_commit(session):
+    tables = session.info.pop(_TOUCHED, None)
+    connection = session.info.pop(_CONNECTION, None)
+    if not tables or connection is None:
+        return
+    counters = StatCounter.__table__
+    names = sorted(version_name(table, random.randrange(VERSION_SHARDS)) for table in tables)
+    try:
+        # Transaction riêng, chỉ một câu UPDATE, ngoài transaction nghiệp vụ (đã commit)
+        connection.execute(
+            update(counters).where(counters.c.name.in_(names))
+            .values(value=counters.c.value + 1)
+        )
+        connection.commit()
+    except Exception as e:
+        connection.rollback()
+        current_app.logger.error(f'Lỗi tăng phiên bản dữ liệu ({", ".join(names)}): {str(e)}')
+
+
+def _after_transaction_end(session, transaction):
+    # Transaction gốc kết thúc bằng rollback: bỏ các bảng đã ghi nhận
+    if transaction.parent is None:
+        session.info.pop(_TOUCHED, None)
+        session.info.pop(_CONNECTION, None)
+
+
+def track_data_versions():
+    """Đăng ký các event của session (gọi một lần trong create_app)"""
+    for name, listener in (('after_flush', _after_flush),
+                           ('do_orm_execute', _on_execute),
+                           ('after_commit', _after_commit),
+                           ('after_transaction_end', _after_transaction_end)):
+        if not event.contains(Session, name, listener):
+            event.listen(Session, name, listener)
+
+
+def get_versions(tables):
+    """Bộ số phiên bản của các bảng (theo thứ tự `tables`); tự tạo dòng còn thiếu"""
+    names = [version_name(table, shard) for table in tables for shard in range(VERSION_SHARDS)]
+    rows = dict(db.session.query(StatCounter.name, StatCounter.value).filter(
+        StatCounter.name.in_(names)
+    ))
+    missing = [name for name in names if name not in rows]
+    if missing:
+        # Bắt đầu từ số ngẫu nhiên: tem của database mới không trùng database cũ
+        db.session.add_all([StatCounter(name=name, value=secrets.randbelow(2 ** 58))
+                            for name in missing])
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # tiến trình khác vừa tạo
+        rows.update(dict(db.session.query(StatCounter.name, StatCounter.value).filter(
+            StatCounter.name.in_(missing)
+        )))
+    return tuple(sum(rows[version_name(table, shard)] for shard in range(VERSION_SHARDS))
+                 for table in tables)
@@ -0,0 +1,198 @@
+"""
+Hàng đợi email bền vững (bảng email_outbox).
+
+Tác vụ nhắc nhở chỉ ghi thư vào hàng đợi bằng một câu INSERT ... ON CONFLICT
+DO NOTHING theo `dedupe_key`: chạy lại (hoặc hai lần chạy chồng nhau) trong
+cùng ngày không tạo thư trùng. Worker (`drain_outbox`) nhận từng lô thư đến
+lượt, gửi qua mail_delivery rồi đánh dấu đã gửi; thư lỗi được thử lại sau
+`OUTBOX_RETRY_BASE_SECONDS * 2^(số lần lỗi - 1)` giây, quá `OUTBOX_MAX_ATTEMPTS`
+lần thì chuyển sang 'failed'.
+"""
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+from flask import current_app
+from flask_mail import Message
+from sqlalchemy import update
+from ..extensions import db
+from ..models import EmailOutbox
+from .mail_delivery import deliver
+
+DrainResult = namedtuple('DrainResult', 'sent retried failed batches')
+
+# Số thư mỗi câu INSERT (giới hạn số tham số của SQLite)
+ENQUEUE_CHUNK = 500
+
+
+def outbox_key(kind, ref_id, day):
+    """Khóa chống trùng: một thư loại `kind` cho mỗi (phiếu/độc giả `ref_id`, ngày `day`)"""
+    return f'{kind}:{ref_id}:{day.isoformat()}'
+
+
+def _insert_ignore_statement():
+    if db.session.get_bind().dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(EmailOutbox.__table__).on_conflict_do_nothing(index_elements=['dedupe_key'])
+
+
+def enqueue(rows, commit=True):
+    """Ghi các thư {'dedupe_key', 'kind', 'user_id', 'borrow_id', 'recipient', 'subject',
+    'body'} vào hàng đợi, bỏ qua thư đã có khóa; trả về số thư mới.
+
+    `commit=False` khi đang đọc dở một truy vấn yield_per trên cùng session
+    (commit sẽ đóng server-side cursor).
+    """
+    now = datetime.utcnow()
+    rows = [dict(row, status='pending', attempts=0, next_attempt_at=now, created_at=now)
+            for row in rows]
+    added = 0
+    for start in range(0, len(rows), ENQUEUE_CHUNK):
+        # Một câu INSERT nhiều dòng: rowcount = số dòng thực sự được thêm
+        result = db.session.execute(
+            _insert_ignore_statement().values(rows[start:start + ENQUEUE_CHUNK])
+        )
+        added += result.rowcount
+    if commit:
+        db.session.commit()
+    return added
+
+
+class OutboxWriter:
+    """Gom thư và ghi vào hàng đợi từng lô `size` thư, để bộ nhớ không tăng theo số thư"""
+
+    def __init__(self, size=ENQUEUE_CHUNK):
+        self.size = size
+        self.rows = []
+        self.added = 0
+        self.total = 0
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.size:
+            self._flush(commit=False)
+
+    def _flush(self, commit):
+        self.added += enqueue(self.rows, commit=commit)
+        self.total += len(self.rows)
+        self.rows = []
+
+    def finish(self):
+        """Ghi lô cuối và commit; trả về số thư mới"""
+        self._flush(commit=True)
+        return self.added
+
+
+def release_stale_claims(now=None):
+    """Trả lại hàng đợi các thư bị giữ quá `OUTBOX_CLAIM_TIMEOUT` giây (worker chết giữa chừng)"""
+    now = now or datetime.utcnow()
+    timeout = current_app.config.get('OUTBOX_CLAIM_TIMEOUT', 900)
+    result = db.session.execute(
+        update(EmailOutbox).where(
+            EmailOutbox.status == 'sending',
+            EmailOutbox.claimed_at < now - timedelta(seconds=timeout)
+        ).values(status='pending', claimed_by=None, claimed_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def claim_batch(size, now=None):
+    """Nhận tối đa `size` thư đến lượt gửi cho worker này (các worker không nhận trùng)"""
+    now = now or datetime.utcnow()
+    token = uuid.uuid4().hex
+    due_ids = db.session.query(EmailOutbox.id).filter(
+        EmailOutbox.status == 'pending',
+        EmailOutbox.next_attempt_at <= now
+    ).order_by(EmailOutbox.next_attempt_at, EmailOutbox.id).limit(size).scalar_subquery()
+    # Điều kiện status = 'pending' trong UPDATE: thư worker khác vừa nhận bị bỏ qua
+    db.session.execute(
+        update(EmailOutbox).where(
+            EmailOutbox.id.in_(due_ids),
+            EmailOutbox.status == 'pending'
+        ).values(status='sending', claimed_by=token, claimed_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return db.session.query(
+        EmailOutbox.id, EmailOutbox.recipient, EmailOutbox.subject, EmailOutbox.body,
+        EmailOutbox.attempts
+    ).filter(EmailOutbox.claimed_by == token).order_by(EmailOutbox.id).all()
+
+
+def retry_delay(attempts):
+    """Thời gian chờ trước lần thử kế tiếp sau `attempts` lần lỗi (tăng gấp đôi mỗi lần)"""
+    base = current_app.config.get('OUTBOX_RETRY_BASE_SECONDS', 60)
+    return timedelta(seconds=base * 2 ** (attempts - 1))
+
+
+def _record_results(batch, failures, now):
+    errors = dict(failures)
+    max_attempts = current_app.config.get('OUTBOX_MAX_ATTEMPTS', 6)
+    sent_ids = [row.id for row in batch if row.id not in errors]
+    if sent_ids:
+        db.session.execute(
+            update(EmailOutbox).where(EmailOutbox.id.in_(sent_ids)).values(
+                status='sent', sent_at=now, claimed_by=None, last_error=None
+            ).execution_options(synchronize_session=False)
+        )
+    retried = failed = 0
+    updates = []
+    for row in batch:
+        if row.id not in errors:
+            continue
+        attempts = row.attempts + 1
+        gave_up = attempts >= max_attempts
+        retried += not gave_up
+        failed += gave_up
+        updates.append({
+            'id': row.id,
+            'status': 'failed' if gave_up else 'pending',
+            'attempts': attempts,
+            'next_attempt_at': now + retry_delay(attempts),
+            'last_error': errors[row.id][:1000],
+            'claimed_by': None,
+        })
+    if updates:
+        db.session.execute(update(EmailOutbox), updates)  # UPDATE theo khóa chính, executemany
+    db.session.commit()
+    return retried, failed
+
+
+def drain_outbox(batch_size=None, max_batches=None):
+    """Gửi các thư đến lượt theo từng lô cho đến khi hết (hoặc đủ `max_batches` lô)"""
+    batch_size = batch_size or current_app.config.get('OUTBOX_BATCH_SIZE', 200)
+    release_stale_claims()
+    sent = retried = failed = batches = 0
+    while max_batches is None or batches < max_batches:
+        batch = claim_batch(batch_size)
+        if not batch:
+            break
+        batches += 1
+        stats = deliver(
+            [(row.id, Message(subject=row.subject, recipients=[row.recipient], body=row.body))
+             for row in batch],
+            'email trong hàng đợi'
+        )
+        batch_retried, batch_failed = _record_results(batch, stats.failures, datetime.utcnow())
+        sent += stats.sent
+        retried += batch_retried
+        failed += batch_failed
+    return DrainResult(sent, retried, failed, batches)
+
+
+def purge_outbox(now=None):
+    """Xóa thư đã gửi/bỏ cuộc cũ hơn `OUTBOX_RETENTION_DAYS` ngày (khóa chống trùng theo ngày
+    nên không cần giữ lâu hơn)"""
+    now = now or datetime.utcnow()
+    days = current_app.config.get('OUTBOX_RETENTION_DAYS', 30)
+    result = db.session.execute(
+        EmailOutbox.__table__.delete().where(
+            EmailOutbox.status.in_(('sent', 'failed')),
+            EmailOutbox.created_at < now - timedelta(days=days)
+        )
+    )
+    db.session.commit()
+    return result.rowcount
@@ -0,0 +1,80 @@
+"""
+Facet (thể loại / tác giả) cho bộ lọc danh mục sách.
+
+Cả hai facet được tính trong MỘT truy vấn GROUP BY (category, author), kèm số
+đầu sách và tổng số bản có sẵn. Kết quả được cache trong tiến trình theo từ
+khóa tìm kiếm và bị xóa khi danh mục thay đổi (`invalidate_facets()`).
+TTL chỉ là lưới an toàn để các worker khác cũng hội tụ về dữ liệu mới.
+"""
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy import func
+from ..extensions import db
+from ..models import Book
+from .search import apply_search
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _normalize(q):
+    return ' '.join((q or '').lower().split())
+
+
+def _compute_facets(q):
+    query = db.session.query(
+        Book.category,
+        Book.author,
+        func.count(Book.id),
+        func.coalesce(func.sum(Book.available_copies), 0)
+    )
+    if q:
+        # Bỏ ORDER BY theo độ liên quan: không cần cho GROUP BY
+        query = apply_search(query, q).order_by(None)
+    rows = query.group_by(Book.category, Book.author).all()
+
+    categories = {}
+    authors = {}
+    for category, author, count, available in rows:
+        for bucket, value in ((categories, category), (authors, author)):
+            if not value:
+                continue
+            entry = bucket.setdefault(value, {'value': value, 'count': 0, 'available': 0})
+            entry['count'] += count
+            entry['available'] += int(available)
+
+    return {
+        'categories': sorted(categories.values(), key=lambda f: f['value'].lower()),
+        'authors': sorted(authors.values(), key=lambda f: f['value'].lower()),
+    }
+
+
+def get_facets(q=''):
+    """Facet thể loại/tác giả cho tập kết quả của từ khóa `q` (có cache)"""
+    key = _normalize(q)
+    ttl = current_app.config.get('FACET_CACHE_TTL', 300)
+    now = time.monotonic()
+
+    with _lock:
+        cached = _cache.get(key)
+        if cached and now - cached[0] < ttl:
+            _cache.move_to_end(key)
+            return cached[1]
+
+    facets = _compute_facets(key)
+
+    with _lock:
+        _cache[key] = (now, facets)
+        _cache.move_to_end(key)
+        max_size = current_app.config.get('FACET_CACHE_SIZE', 256)
+        while len(_cache) > max_size:
+            _cache.popitem(last=False)
+    return facets
+
+
+def invalidate_facets():
+    """Gọi sau khi thêm/sửa/xóa sách"""
+    with _lock:
+        _cache.clear()
@@ -0,0 +1,162 @@
+"""
+Hàng đợi giữ sách (đặt trước) theo thứ tự FIFO cho từng đầu sách.
+
+Mỗi khi có bản sách được trả hoặc `available_copies` tăng (sửa số lượng), bản
+đó được giữ cho người đứng đầu hàng đợi thay vì quay lại kệ: đặt trước được
+đánh dấu `fulfilled` với hạn đến nhận (`expires_at`). Nếu quá hạn mà chưa nhận,
+tác vụ `expire_holds` hủy giữ và chuyển bản sách cho người kế tiếp.
+
+Các hàm ở đây không commit; người gọi commit cùng transaction mượn/trả.
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import update
+from ..extensions import db
+from ..models import Reservation
+from .circulation import take_copy, release_copy, release_copies
+from . import counters
+from .stats_cache import invalidate_stats
+
+
+def pickup_deadline(now=None):
+    days = current_app.config.get('HOLD_PICKUP_DAYS', 3)
+    return (now or datetime.utcnow()) + timedelta(days=days)
+
+
+def queue_head(book_id):
+    """Đặt trước đang chờ lâu nhất của một đầu sách (một lượt tìm theo chỉ mục)"""
+    return db.session.query(Reservation.id, Reservation.user_id).filter(
+        Reservation.book_id == book_id,
+        Reservation.fulfilled.is_(False)
+    ).order_by(Reservation.reserved_at, Reservation.id).first()
+
+
+def allocate_holds(book_ids, now=None):
+    """Giữ các bản đang có sẵn cho người đứng đầu hàng đợi của từng đầu sách.
+
+    Mỗi lượt: tìm đầu hàng đợi, trừ một bản bằng UPDATE nguyên tử, rồi đánh dấu
+    đặt trước với điều kiện `fulfilled = false` (tránh hai lượt trả song song
+    cùng giữ cho một người). Trả về danh sách id đặt trước vừa được giữ sách.
+    """
+    now = now or datetime.utcnow()
+    expires_at = pickup_deadline(now)
+    allocated = []
+    for book_id in sorted(set(book_ids)):
+        while True:
+            head = queue_head(book_id)
+            if head is None or take_copy(book_id) is None:
+                break
+            claimed = db.session.execute(
+                update(Reservation).where(
+                    Reservation.id == head.id,
+                    Reservation.fulfilled.is_(False)
+                ).values(
+                    fulfilled=True,
+                    status='ready',
+                    fulfilled_at=now,
+                    expires_at=expires_at
+                ).execution_options(synchronize_session=False)
+            ).rowcount
+            if claimed != 1:
+                # Người này vừa được giữ sách ở nơi khác: trả bản lại, thử người kế tiếp
+                release_copy(book_id)
+                continue
+            allocated.append(head.id)
+    counters.bump(pending_reservations=-len(allocated))
+    return allocated
+
+
+def claim_ready_holds(user_id, book_ids):
+    """Độc giả đến nhận sách đã được giữ: chuyển 'ready' -> 'collected'.
+
+    Trả về tập id sách đã có bản giữ sẵn (không cần trừ thêm available_copies).
+    """
+    if not book_ids:
+        return set()
+    stmt = update(Reservation).where(
+        Reservation.user_id == user_id,
+        Reservation.book_id.in_(book_ids),
+        Reservation.status == 'ready'
+    ).values(status='collected').execution_options(synchronize_session=False)
+    if db.session.get_bind().dialect.update_returning:
+        return {book_id for (book_id,) in db.session.execute(stmt.returning(Reservation.book_id))}
+
+    ready = {book_id for (book_id,) in db.session.query(Reservation.book_id).filter(
+        Reservation.user_id == user_id,
+        Reservation.book_id.in_(book_ids),
+        Reservation.status == 'ready'
+    )}
+    if ready:
+        db.session.execute(stmt)
+    return ready
+
+
+def close_waiting(user_id, book_ids, now=None):
+    """Độc giả mượn được sách trực tiếp: rút khỏi hàng đợi của các sách đó"""
+    if not book_ids:
+        return
+    result = db.session.execute(
+        update(Reservation).where(
+            Reservation.user_id == user_id,
+            Reservation.book_id.in_(book_ids),
+            Reservation.fulfilled.is_(False)
+        ).values(
+            fulfilled=True,
+            status='collected',
+            fulfilled_at=now or datetime.utcnow()
+        ).execution_options(synchronize_session=False)
+    )
+    counters.bump(pending_reservations=-result.rowcount)
+
+
+def cancel_hold(reservation):
+    """Hủy đặt trước; nếu sách đang được giữ thì chuyển cho người kế tiếp"""
+    book_id = reservation.book_id
+    was_ready = reservation.status == 'ready'
+    if not reservation.fulfilled:
+        counters.bump(pending_reservations=-1)
+    db.session.delete(reservation)
+    if was_ready:
+        db.session.flush()
+        release_copy(book_id)
+        allocate_holds([book_id])
+
+
+def expire_holds(now=None):
+    """Hủy mọi lượt giữ sách quá hạn nhận bằng một câu UPDATE theo tập hợp,
+    cộng trả các bản sách rồi giữ tiếp cho người kế tiếp trong hàng đợi.
+
+    Trả về (số lượt giữ bị hủy, số lượt giữ mới).
+    """
+    now = now or datetime.utcnow()
+    stmt = update(Reservation).where(
+        Reservation.status == 'ready',
+        Reservation.expires_at < now
+    ).values(status='expired').execution_options(synchronize_session=False)
+
+    if db.session.get_bind().dialect.update_returning:
+        expired = [book_id for (book_id,) in db.session.execute(stmt.returning(Reservation.book_id))]
+    else:
+        rows = db.session.query(Reservation.id, Reservation.book_id).filter(
+            Reservation.status == 'ready',
+            Reservation.expires_at < now
+        ).with_for_update().all()
+        expired = [book_id for _, book_id in rows]
+        if rows:
+            db.session.execute(
+                update(Reservation).where(
+                    Reservation.id.in_([reservation_id for reservation_id, _ in rows])
+                ).values(status='expired').execution_options(synchronize_session=False)
+            )
+
+    if not expired:
+        db.session.rollback()
+        return 0, 0
+
+    counts = Counter(expired)
+    release_copies(dict(counts))
+    allocated = allocate_holds(counts, now=now)
+    db.session.commit()
+    invalidate_stats()
+    return len(expired), len(allocated)
@@ -0,0 +1,110 @@
+"""
+Gửi email hàng loạt qua SMTP (worker của hàng đợi email_outbox).
+
+Thư được chia thành các lô; mỗi lô dùng MỘT kết nối SMTP đã đăng nhập
+(`mail.connect()`, bắt tay TLS/đăng nhập một lần cho cả lô) và các lô được
+gửi song song trên một thread pool nhỏ `MAIL_WORKERS` luồng. Tổng tốc độ gửi
+bị giới hạn bởi `MAIL_RATE_LIMIT` thư/giây (giới hạn của nhà cung cấp SMTP).
+Mỗi lần chạy ghi log số thư đã gửi/lỗi, thời gian và thông lượng.
+"""
+import math
+import smtplib
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from ..extensions import mail
+
+
+class DeliveryStats(namedtuple('DeliveryStats', 'sent failures seconds connections')):
+    """Kết quả một lần gửi; `failures` là danh sách (nhãn, lỗi) của thư gửi lỗi"""
+
+    @property
+    def failed(self):
+        return len(self.failures)
+
+    @property
+    def rate(self):
+        return self.sent / self.seconds if self.seconds else 0.0
+
+
+class RateLimiter:
+    """Giãn đều các lần gửi (dùng chung giữa các luồng): tối đa `per_second` thư/giây"""
+
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second if per_second and per_second > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next_at)
+            self._next_at = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+def _batches(messages, workers, batch_size):
+    # Ít thư thì chia đều cho các luồng thay vì dồn vào một lô
+    size = max(1, min(batch_size, math.ceil(len(messages) / workers)))
+    return [messages[i:i + size] for i in range(0, len(messages), size)]
+
+
+def _send_batch(app, batch, limiter):
+    """Gửi một lô trên một kết nối; trả về (số đã gửi, [(nhãn, lỗi), ...])"""
+    sent = 0
+    failures = []
+    with app.app_context():
+        try:
+            with mail.connect() as connection:
+                for label, message in batch:
+                    limiter.wait()
+                    try:
+                        try:
+                            connection.send(message)
+                        except smtplib.SMTPServerDisconnected:
+                            # Máy chủ đóng kết nối giữa lô: mở lại một lần rồi gửi lại
+                            connection.host = connection.configure_host()
+                            connection.send(message)
+                        sent += 1
+                    except Exception as e:
+                        failures.append((label, str(e)))
+                        app.logger.error(f'Lỗi gửi email {label}: {str(e)}')
+        except Exception as e:
+            # Không mở/đóng được kết nối: các thư chưa gửi của lô coi là lỗi
+            done = sent + len(failures)
+            failures.extend((label, str(e)) for label, _ in batch[done:])
+            app.logger.error(f'Lỗi kết nối SMTP ({len(batch) - done} email chưa gửi): {str(e)}')
+    return sent, failures
+
+
+def deliver(messages, kind='email'):
+    """Gửi các cặp (nhãn, Message); nhãn dùng để ghi log và trả về thư gửi lỗi"""
+    messages = list(messages)
+    app = current_app._get_current_object()
+    workers = max(1, app.config.get('MAIL_WORKERS', 4))
+    limiter = RateLimiter(app.config.get('MAIL_RATE_LIMIT', 0))
+    batches = _batches(messages, workers, max(1, app.config.get('MAIL_BATCH_SIZE', 50)))
+
+    started = time.monotonic()
+    if workers == 1 or len(batches) <= 1:
+        results = [_send_batch(app, batch, limiter) for batch in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(batches)),
+                                thread_name_prefix='mail') as executor:
+            results = list(executor.map(lambda batch: _send_batch(app, batch, limiter), batches))
+    stats = DeliveryStats(
+        sent=sum(sent for sent, _ in results),
+        failures=[failure for _, failures in results for failure in failures],
+        seconds=time.monotonic() - started,
+        connections=len(batches),
+    )
+    app.logger.info(
+        f'Đã gửi {stats.sent}/{len(messages)} {kind} trong {stats.seconds:.1f}s '
+        f'({stats.rate:.1f} email/s, {stats.connections} kết nối, {stats.failed} lỗi)'
+    )
+    return stats
@@ -0,0 +1,127 @@
+"""
+Phân trang keyset (cursor) thay cho OFFSET.
+
+Trang tiếp theo được lấy bằng điều kiện "sau khóa cuối cùng" trên các cột sắp
+xếp, nên chi phí mỗi trang không phụ thuộc vào việc trang đó sâu đến đâu.
+Cursor là chuỗi base64 mờ (opaque) chứa giá trị khóa và chiều duyệt.
+
+Các cột khóa phải NOT NULL và tổ hợp khóa phải duy nhất (luôn kết thúc bằng id).
+"""
+import base64
+import json
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, List, Optional
+from sqlalchemy import and_, or_
+
+
+class InvalidCursor(ValueError):
+    """Cursor không giải mã được"""
+
+
+@dataclass
+class KeysetPage:
+    items: List[Any]
+    per_page: int
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+    total: Optional[int] = None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        if 'd' in value:
+            return date.fromisoformat(value['d'])
+        raise InvalidCursor('Giá trị cursor không hợp lệ')
+    return value
+
+
+def encode_cursor(values, direction='next'):
+    payload = {'k': [_encode_value(v) for v in values], 'd': direction}
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Trả về (values, direction)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        values = [_decode_value(v) for v in payload['k']]
+        direction = payload.get('d', 'next')
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor(str(e))
+    if direction not in ('next', 'prev'):
+        raise InvalidCursor('Chiều duyệt không hợp lệ')
+    return values, direction
+
+
+def _seek(keys, values, forward):
+    """(k1 > v1) OR (k1 = v1 AND k2 > v2) OR ... theo chiều của từng khóa"""
+    clauses = []
+    for i, (expr, descending) in enumerate(keys):
+        use_less = descending == forward
+        comparison = expr < values[i] if use_less else expr > values[i]
+        equals = [keys[j][0] == values[j] for j in range(i)]
+        clauses.append(and_(*equals, comparison))
+    return or_(*clauses)
+
+
+def paginate_keyset(query, keys, cursor=None, per_page=20, with_total=False):
+    """Phân trang `query` theo danh sách khóa `keys` = [(biểu thức, giảm_dần), ...].
+
+    `query` phải trả về một entity; giá trị khóa được lấy kèm trong cùng câu
+    lệnh nên có thể dùng cả biểu thức tính toán (ví dụ độ liên quan).
+    """
+    values, direction = decode_cursor(cursor) if cursor else (None, 'next')
+    if values is not None and len(values) != len(keys):
+        raise InvalidCursor('Số khóa của cursor không khớp')
+    forward = direction == 'next'
+
+    total = query.order_by(None).count() if with_total else None
+
+    page_query = query.order_by(None).add_columns(*[expr for expr, _ in keys])
+    if values is not None:
+        page_query = page_query.filter(_seek(keys, values, forward))
+    ordering = [
+        expr.desc() if descending == forward else expr.asc()
+        for expr, descending in keys
+    ]
+    rows = page_query.order_by(*ordering).limit(per_page + 1).all()
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if not forward:
+        rows.reverse()
+
+    items = [row[0] for row in rows]
+    key_values = [list(row[1:]) for row in rows]
+
+    # Đi tới: còn trang sau nếu lấy dư 1 dòng, có trang trước nếu đang ở sau cursor.
+    # Đi lùi: ngược lại.
+    next_cursor = prev_cursor = None
+    if rows:
+        if (has_more if forward else True):
+            next_cursor = encode_cursor(key_values[-1], 'next')
+        if (values is not None if forward else has_more):
+            prev_cursor = encode_cursor(key_values[0], 'prev')
+    return KeysetPage(items=items, per_page=per_page, next_cursor=next_cursor,
+                      prev_cursor=prev_cursor, total=total)
@@ -0,0 +1,308 @@
+"""
+Xuất báo cáo PDF dạng luồng cho các bảng lớn (phiếu mượn, danh sách sách).
+
+Dòng dữ liệu được đọc theo từng lô `REPORT_CHUNK_ROWS` bằng `yield_per`
+(server-side cursor trên PostgreSQL), chỉ lấy các cột cần in. Bảng được dựng
+thành chuỗi bảng con vừa đúng phần trang còn trống (lặp lại dòng tiêu đề),
+với chiều cao dòng và style tính sẵn một lần, nên ReportLab không phải đo lại
+hay tách bảng: thời gian dựng tăng tuyến tính theo số dòng và bộ nhớ chỉ giữ
+một trang. PDF được ghi thẳng ra file (xem report_jobs), không giữ trong BytesIO.
+Báo cáo thống kê chỉ có vài bảng nhỏ nên dựng trực tiếp.
+"""
+from datetime import datetime
+from itertools import islice
+from flask import current_app
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Flowable
+from . import read_models
+from .counters import get_counters
+from .popularity import top_books, top_readers, WINDOWS
+
+WINDOW_LABELS = {'all': 'toàn thời gian', '30d': '30 ngày gần nhất', '365d': '365 ngày gần nhất'}
+
+BORROW_HEADER = ['STT', 'Độc giả', 'Sách', 'Ngày mượn', 'Hạn trả', 'Ngày trả', 'Phí', 'Trạng thái']
+BORROW_COL_WIDTHS = [0.4*inch, 1.2*inch, 1.5*inch, 0.8*inch, 0.8*inch, 0.8*inch, 0.6*inch, 0.8*inch]
+
+BOOK_HEADER = ['STT', 'Tên sách', 'Tác giả', 'Thể loại', 'ISBN', 'Tổng số', 'Có sẵn']
+BOOK_COL_WIDTHS = [0.4*inch, 2*inch, 1.2*inch, 1*inch, 1*inch, 0.6*inch, 0.6*inch]
+
+TABLE_STYLE = [
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 9),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('FONTSIZE', (0, 1), (-1, -1), 8),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey]),
+]
+
+# Style dùng chung cho mọi báo cáo (dựng một lần khi import)
+STYLES = getSampleStyleSheet()
+TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=STYLES['Heading1'],
+    fontSize=18,
+    textColor=colors.HexColor('#1a1a1a'),
+    spaceAfter=30,
+    alignment=1  # Center
+)
+DATA_TABLE_STYLE = TableStyle(TABLE_STYLE)
+TOP_TABLE_STYLE = TableStyle(TABLE_STYLE[:-1])  # không tô xen kẽ dòng
+
+
+class _FlowableStream(list):
+    """Danh sách flowable được nạp dần từ một iterator.
+
+    `doc.build()` gọi len() trước mỗi flowable; khi danh sách đã hết mới lấy
+    bảng con kế tiếp (sau khi bảng trước đã vẽ), nên không phải dựng sẵn toàn
+    bộ bảng trong bộ nhớ.
+    """
+
+    def __init__(self, flowables, more):
+        super().__init__(flowables)
+        self._more = iter(more)
+
+    def __len__(self):
+        while self._more is not None and not list.__len__(self):
+            flowable = next(self._more, None)
+            if flowable is None:
+                self._more = None
+            else:
+                self.append(flowable)
+        return list.__len__(self)
+
+
+class _RowSource:
+    """Dòng chờ in của một bảng lớn, dùng chung cho các bảng con `_PageTable`"""
+
+    def __init__(self, header, col_widths, rows, size):
+        self.header = header
+        self.col_widths = col_widths
+        self._rows = iter(rows)
+        self._size = size
+        self._buffer = []
+        # Mọi ô là một dòng chữ: đo chiều cao dòng tiêu đề/dòng dữ liệu một lần
+        sample = Table([header, [''] * len(header)], colWidths=col_widths)
+        sample.setStyle(DATA_TABLE_STYLE)
+        sample.wrap(0, 0)
+        self.header_height, self.row_height = sample._rowHeights
+
+    def peek(self, count):
+        while len(self._buffer) < count:
+            more = list(islice(self._rows, self._size))
+            if not more:
+                break
+            self._buffer.extend(more)
+        return self._buffer[:count]
+
+    def consume(self, count):
+        del self._buffer[:count]
+
+    def exhausted(self):
+        return not self.peek(1)
+
+    def fitting(self, height):
+        """Số dòng dữ liệu vừa chiều cao `height` (kèm dòng tiêu đề)"""
+        return max(0, int((height - self.header_height) // self.row_height))
+
+
+class _PageTable(Flowable):
+    """Bảng con lấy đúng số dòng vừa phần trang còn trống khi được dàn trang.
+
+    Nếu không vừa nổi một dòng, trả chiều cao lớn hơn chỗ trống để ReportLab
+    sang trang mới rồi dàn lại; dòng chỉ bị lấy khỏi nguồn khi bảng được vẽ.
+    """
+
+    def __init__(self, source):
+        super().__init__()
+        self.source = source
+        self._table = None
+        self._count = 0
+
+    def wrap(self, availWidth, availHeight):
+        source = self.source
+        rows = source.peek(source.fitting(availHeight))
+        if not rows and not source.exhausted():
+            return availWidth, availHeight + source.row_height
+        # Báo cáo rỗng: chỉ in dòng tiêu đề
+        self._count = len(rows)
+        self._table = Table(
+            [source.header] + rows, colWidths=source.col_widths,
+            rowHeights=[source.header_height] + [source.row_height] * len(rows),
+        )
+        self._table.setStyle(DATA_TABLE_STYLE)
+        self.width, self.height = self._table.wrap(availWidth, availHeight)
+        return self.width, self.height
+
+    def split(self, availWidth, availHeight):
+        return []
+
+    def draw(self):
+        self.source.consume(self._count)
+        self._table.drawOn(self.canv, 0, 0)
+
+
+def chunk_rows():
+    return max(1, current_app.config.get('REPORT_CHUNK_ROWS', 500))
+
+
+def build_table_pdf(target, title, info_lines, header, col_widths, rows, size=None):
+    """Ghi PDF gồm tiêu đề, thông tin và bảng `rows` (iterator các list chuỗi).
+
+    Bảng được chia thành các bảng con vừa một trang, mỗi bảng lặp lại `header`;
+    `rows` được đọc từng lô `size` dòng.
+    """
+    source = _RowSource(header, col_widths, rows, size or chunk_rows())
+    doc = SimpleDocTemplate(target, pagesize=A4)
+
+    elements = [
+        Paragraph(title, TITLE_STYLE),
+        Spacer(1, 0.2*inch),
+        Paragraph('<br/>'.join(info_lines), STYLES['Normal']),
+        Spacer(1, 0.3*inch),
+    ]
+
+    def tables():
+        yield _PageTable(source)
+        while not source.exhausted():  # xét sau khi bảng trước đã vẽ
+            yield _PageTable(source)
+
+    doc.build(_FlowableStream(elements, tables()))
+
+
+def _date(value):
+    return value.strftime('%d/%m/%Y') if value else '-'
+
+
+def borrow_rows(status='all', size=None):
+    """Các dòng bảng báo cáo mượn/trả, đọc từng lô `size` dòng"""
+    size = size or chunk_rows()
+    query = read_models.loans_newest_first(
+        'user_name', 'user_email', 'book_title', 'borrowed_at', 'due_date',
+        'returned_at', 'fine_amount', 'status', status=status
+    ).execution_options(yield_per=size)
+
+    for idx, row in enumerate(query, 1):
+        status_text = 'Quá hạn' if row.status == 'overdue' else (
+            'Đã trả' if row.returned_at else 'Đang mượn'
+        )
+        yield [
+            str(idx),
+            row.user_name or row.user_email,
+            row.book_title,
+            _date(row.borrowed_at),
+            _date(row.due_date),
+            _date(row.returned_at),
+            f"{row.fine_amount:.0f}" if row.fine_amount and row.fine_amount > 0 else '-',
+            status_text
+        ]
+
+
+def book_rows(size=None):
+    """Các dòng bảng danh sách sách, đọc từng lô `size` dòng"""
+    size = size or chunk_rows()
+    query = read_models.books(
+        'title', 'author', 'category', 'isbn', 'total_copies', 'available_copies'
+    ).execution_options(yield_per=size)
+
+    for idx, book in enumerate(query, 1):
+        yield [
+            str(idx),
+            book.title,
+            book.author or '-',
+            book.category or '-',
+            book.isbn or '-',
+            str(book.total_copies),
+            str(book.available_copies)
+        ]
+
+
+def write_borrows_report(target, status='all'):
+    info = [
+        f"Ngày xuất: {datetime.now().strftime('%d/%m/%Y %H:%M')}",
+        f"Trạng thái: {status.upper()}",
+        f"Tổng số: {read_models.count_loans(status)} bản ghi",
+    ]
+    build_table_pdf(target, "BÁO CÁO MƯỢN/TRẢ SÁCH", info,
+                    BORROW_HEADER, BORROW_COL_WIDTHS, borrow_rows(status))
+
+
+def write_books_report(target):
+    info = [
+        f"Ngày xuất: {datetime.now().strftime('%d/%m/%Y %H:%M')}",
+        f"Tổng số sách: {read_models.count_books()}",
+    ]
+    build_table_pdf(target, "BÁO CÁO DANH SÁCH SÁCH", info,
+                    BOOK_HEADER, BOOK_COL_WIDTHS, book_rows())
+
+
+def write_statistics_report(target, window='all'):
+    """Báo cáo thống kê: bộ đếm tổng và top 10 sách/độc giả trong cửa sổ `window`"""
+    if window not in WINDOWS:
+        window = 'all'
+    totals = get_counters()
+    popular_books = top_books(10, window)
+    active_readers = top_readers(10, window)
+
+    doc = SimpleDocTemplate(target, pagesize=A4)
+    styles = STYLES
+    elements = [
+        Paragraph("BÁO CÁO THỐNG KÊ", TITLE_STYLE),
+        Spacer(1, 0.2*inch),
+        Paragraph(f"Ngày xuất: {datetime.now().strftime('%d/%m/%Y %H:%M')}<br/>"
+                  f"Lượt mượn tính trong: {WINDOW_LABELS[window]}", styles['Normal']),
+        Spacer(1, 0.3*inch),
+    ]
+
+    # Thống kê tổng quan
+    elements.append(Paragraph("<b>THỐNG KÊ TỔNG QUAN</b>", styles['Heading2']))
+    elements.append(Spacer(1, 0.1*inch))
+    summary_data = [
+        ['Chỉ số', 'Giá trị'],
+        ['Tổng số sách', str(totals['total_books'])],
+        ['Tổng số độc giả', str(totals['total_users'])],
+        ['Sách đang mượn', str(totals['active_loans'])],
+        ['Sách quá hạn', str(totals['overdue_loans'])]
+    ]
+    summary_table = Table(summary_data, colWidths=[2*inch, 2*inch])
+    summary_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ]))
+    elements.append(summary_table)
+    elements.append(Spacer(1, 0.3*inch))
+
+    # Sách mượn nhiều nhất
+    elements.append(Paragraph("<b>TOP 10 SÁCH MƯỢN NHIỀU NHẤT</b>", styles['Heading2']))
+    elements.append(Spacer(1, 0.1*inch))
+    popular_data = [['STT', 'Tên sách', 'Tác giả', 'Số lần mượn']]
+    for idx, (book, count) in enumerate(popular_books, 1):
+        popular_data.append([str(idx), book.title, book.author or '-', str(count)])
+    popular_table = Table(popular_data, colWidths=[0.5*inch, 2*inch, 1.5*inch, 1*inch])
+    popular_table.setStyle(TOP_TABLE_STYLE)
+    elements.append(popular_table)
+    elements.append(Spacer(1, 0.3*inch))
+
+    # Độc giả tích cực
+    elements.append(Paragraph("<b>TOP 10 ĐỘC GIẢ TÍCH CỰC</b>", styles['Heading2']))
+    elements.append(Spacer(1, 0.1*inch))
+    readers_data = [['STT', 'Tên độc giả', 'Email', 'Số lần mượn']]
+    for idx, (user, count) in enumerate(active_readers, 1):
+        readers_data.append([str(idx), user.name or '-', user.email, str(count)])
+    readers_table = Table(readers_data, colWidths=[0.5*inch, 1.5*inch, 2*inch, 1*inch])
+    readers_table.setStyle(TOP_TABLE_STYLE)
+    elements.append(readers_table)
+
+    doc.build(elements)
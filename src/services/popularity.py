@@ -0,0 +1,103 @@
+"""
+Bộ đếm lượt mượn phi chuẩn hóa trên Book và User (sách mượn nhiều, độc giả tích cực).
+
+- `borrow_count`: toàn thời gian, cộng khi mượn.
+- `borrow_count_30d` / `borrow_count_365d`: cửa sổ trượt, cộng khi mượn và được
+  tính lại hàng đêm (`refresh_windows`) để loại các lượt mượn đã ra khỏi cửa sổ.
+
+Top-N chỉ là ORDER BY cột đếm DESC LIMIT n trên chỉ mục (borrow_count, id),
+không còn JOIN + GROUP BY toàn bộ borrow_records.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import func, or_, select, update
+from ..extensions import db
+from ..models import Book, BorrowRecord, User
+
+# cửa sổ -> (số ngày, tên cột); None = toàn thời gian
+WINDOWS = {
+    'all': (None, 'borrow_count'),
+    '30d': (30, 'borrow_count_30d'),
+    '365d': (365, 'borrow_count_365d'),
+}
+
+
+def window_column(model, window):
+    if window not in WINDOWS:
+        raise ValueError(f'Cửa sổ không hợp lệ: {window}')
+    return getattr(model, WINDOWS[window][1])
+
+
+def _increment_values(model, n):
+    return {name: getattr(model, name) + n for _, name in WINDOWS.values()}
+
+
+def record_borrows(user_id, book_ids):
+    """Cộng lượt mượn cho độc giả và các sách vừa mượn (không commit)"""
+    if not book_ids:
+        return
+    db.session.execute(
+        update(Book).where(Book.id.in_(book_ids)).values(
+            **_increment_values(Book, 1)
+        ).execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        update(User).where(User.id == user_id).values(
+            **_increment_values(User, len(book_ids))
+        ).execution_options(synchronize_session=False)
+    )
+
+
+def top_books(limit=10, window='all'):
+    """[(Book, số lượt mượn)] nhiều nhất trong cửa sổ"""
+    column = window_column(Book, window)
+    books = Book.query.filter(column > 0).order_by(column.desc(), Book.id.desc()).limit(limit).all()
+    return [(book, getattr(book, column.key)) for book in books]
+
+
+def top_readers(limit=10, window='all'):
+    """[(User, số lượt mượn)] nhiều nhất trong cửa sổ"""
+    column = window_column(User, window)
+    users = User.query.filter(column > 0).order_by(column.desc(), User.id.desc()).limit(limit).all()
+    return [(user, getattr(user, column.key)) for user in users]
+
+
+def refresh_windows(now=None):
+    """Tính lại các cửa sổ trượt từ borrow_records trong khoảng 365 ngày gần nhất.
+
+    Mỗi cửa sổ là một truy vấn GROUP BY trên khoảng borrowed_at (dùng chỉ mục),
+    sau đó đặt lại về 0 và ghi giá trị mới theo khóa chính trong cùng transaction.
+    Trả về số dòng (sách + độc giả) có lượt mượn trong cửa sổ.
+    """
+    now = now or datetime.utcnow()
+    windowed = [(days, name) for days, name in WINDOWS.values() if days]
+    updated = 0
+    for model, key in ((Book, BorrowRecord.book_id), (User, BorrowRecord.user_id)):
+        values = {}
+        for days, name in windowed:
+            rows = db.session.query(key, func.count(BorrowRecord.id)).filter(
+                BorrowRecord.borrowed_at >= now - timedelta(days=days)
+            ).group_by(key)
+            for row_id, count in rows:
+                entry = values.setdefault(row_id, dict({'id': row_id}, **{n: 0 for _, n in windowed}))
+                entry[name] = count
+
+        db.session.execute(
+            update(model).where(or_(*[getattr(model, name) > 0 for _, name in windowed])).values(
+                **{name: 0 for _, name in windowed}
+            ).execution_options(synchronize_session=False)
+        )
+        if values:
+            db.session.execute(update(model), list(values.values()))
+        updated += len(values)
+    db.session.commit()
+    return updated
+
+
+def rebuild_borrow_counts(now=None):
+    """Tính lại toàn bộ bộ đếm từ lịch sử mượn (lệnh `flask rebuild-borrow-counts`)"""
+    for model, key in ((Book, BorrowRecord.book_id), (User, BorrowRecord.user_id)):
+        total = select(func.count(BorrowRecord.id)).where(key == model.id).scalar_subquery()
+        db.session.execute(
+            update(model).values(borrow_count=total).execution_options(synchronize_session=False)
+        )
+    return refresh_windows(now)
@@ -0,0 +1,147 @@
+"""
+Truy vấn đọc dùng chung cho báo cáo, xuất file và email nhắc nhở.
+
+Mỗi hàm trả về một Query chỉ lấy đúng các cột cần (đã JOIN độc giả và sách,
+đặt nhãn theo tên trong LOAN_COLUMNS / BOOK_COLUMNS), nên vòng lặp trên kết
+quả chỉ đọc thuộc tính của Row: cả danh sách là MỘT câu SQL, không có lazy
+load `record.user` / `record.book` cho từng dòng (N+1).
+
+    for row in loans('user_email', 'book_title', status='overdue'):
+        row.user_email, row.book_title
+"""
+import json
+from collections import namedtuple
+from datetime import date
+from sqlalchemy import func, or_
+from ..extensions import db
+from ..models import Book, BorrowRecord, User
+
+LOAN_COLUMNS = {
+    'id': BorrowRecord.id,
+    'user_id': BorrowRecord.user_id,
+    'user_email': User.email,
+    'user_name': User.name,
+    'book_id': BorrowRecord.book_id,
+    'book_title': Book.title,
+    'book_author': Book.author,
+    'book_isbn': Book.isbn,
+    'borrowed_at': BorrowRecord.borrowed_at,
+    'due_date': BorrowRecord.due_date,
+    'returned_at': BorrowRecord.returned_at,
+    'status': BorrowRecord.status,
+    'fine_amount': BorrowRecord.fine_amount,
+}
+
+BOOK_COLUMNS = {
+    'id': Book.id,
+    'title': Book.title,
+    'author': Book.author,
+    'category': Book.category,
+    'isbn': Book.isbn,
+    'total_copies': Book.total_copies,
+    'available_copies': Book.available_copies,
+    'created_at': Book.created_at,
+}
+
+LOAN_STATUSES = ('all', 'active', 'overdue', 'returned')
+
+PatronDigest = namedtuple('PatronDigest', 'user_id user_email user_name loan_count total_fine loans')
+
+
+def _project(columns, names):
+    unknown = [name for name in names if name not in columns]
+    if unknown:
+        raise ValueError(f'Cột không tồn tại: {", ".join(unknown)}')
+    return db.session.query(*[columns[name].label(name) for name in names or columns])
+
+
+def filter_loan_status(query, status):
+    """Lọc phiếu mượn theo trạng thái báo cáo: all, active, overdue, returned"""
+    if status == 'active':
+        return query.filter(BorrowRecord.returned_at.is_(None))
+    if status == 'overdue':
+        return query.filter(BorrowRecord.status == 'overdue')
+    if status == 'returned':
+        return query.filter(BorrowRecord.returned_at.isnot(None))
+    return query
+
+
+def loans(*names, status='all'):
+    """Phiếu mượn kèm cột độc giả/sách (mọi cột nếu không chỉ định)"""
+    query = _project(LOAN_COLUMNS, names).select_from(BorrowRecord).join(
+        User, User.id == BorrowRecord.user_id
+    ).join(Book, Book.id == BorrowRecord.book_id)
+    return filter_loan_status(query, status)
+
+
+def loans_newest_first(*names, status='all'):
+    return loans(*names, status=status).order_by(
+        BorrowRecord.borrowed_at.desc(), BorrowRecord.id.desc()
+    )
+
+
+def count_loans(status='all'):
+    return filter_loan_status(db.session.query(func.count(BorrowRecord.id)), status).scalar()
+
+
+def loans_due_on(day, *names):
+    """Phiếu chưa trả có hạn trả đúng ngày `day` (email nhắc sắp đến hạn)"""
+    return loans(*names, status='active').filter(
+        BorrowRecord.due_date == day
+    ).order_by(BorrowRecord.id)
+
+
+def overdue_loans(*names):
+    """Phiếu đã được đánh dấu quá hạn (email cảnh báo, dashboard)"""
+    return loans(*names, status='overdue').order_by(BorrowRecord.due_date, BorrowRecord.id)
+
+
+def _json_loans():
+    """Biểu thức gom các phiếu của một nhóm thành mảng JSON, theo dialect"""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return func.json_agg(func.json_build_object(
+            'title', Book.title, 'author', Book.author, 'due_date', BorrowRecord.due_date,
+            'fine', BorrowRecord.fine_amount, 'overdue', BorrowRecord.status == 'overdue'
+        ))
+    return func.json_group_array(func.json_object(
+        'title', Book.title, 'author', Book.author, 'due_date', BorrowRecord.due_date,
+        'fine', BorrowRecord.fine_amount, 'overdue', BorrowRecord.status == 'overdue'
+    ))
+
+
+def patron_digests(due_day, size=500):
+    """Mỗi độc giả một dòng: các phiếu chưa trả có hạn trả `due_day` hoặc đã quá hạn.
+
+    GROUP BY trong SQL (một câu truy vấn cho mọi độc giả, đọc từng lô `size`
+    dòng); `row.loans` là danh sách dict {title, author, due_date, fine,
+    overdue} theo hạn trả.
+    """
+    query = db.session.query(
+        User.id.label('user_id'), User.email.label('user_email'), User.name.label('user_name'),
+        func.count(BorrowRecord.id).label('loan_count'),
+        func.coalesce(func.sum(BorrowRecord.fine_amount), 0).label('total_fine'),
+        _json_loans().label('loans'),
+    ).select_from(BorrowRecord).join(
+        User, User.id == BorrowRecord.user_id
+    ).join(Book, Book.id == BorrowRecord.book_id).filter(
+        BorrowRecord.returned_at.is_(None),
+        or_(BorrowRecord.due_date == due_day, BorrowRecord.status == 'overdue')
+    ).group_by(User.id, User.email, User.name).order_by(User.id).execution_options(yield_per=size)
+
+    for row in query:
+        # psycopg2 trả về list, SQLite trả về chuỗi JSON
+        loans = json.loads(row.loans) if isinstance(row.loans, str) else row.loans
+        for loan in loans:
+            loan['due_date'] = date.fromisoformat(loan['due_date'][:10])
+            loan['overdue'] = bool(loan['overdue'])
+        loans.sort(key=lambda loan: (loan['due_date'], loan['title']))
+        yield PatronDigest(**dict(row._asdict(), loans=loans))
+
+
+def books(*names):
+    """Sách theo tên (mọi cột nếu không chỉ định)"""
+    return _project(BOOK_COLUMNS, names).order_by(Book.title, Book.id)
+
+
+def count_books():
+    return db.session.query(func.count(Book.id)).scalar()
@@ -0,0 +1,398 @@
+"""
+Tác vụ xuất báo cáo PDF chạy nền trong process pool, kèm cache theo nội dung.
+
+- Id của job là băm của (loại báo cáo, tham số, tem dữ liệu). Tem là bộ số
+  phiên bản của các bảng mà báo cáo đọc (xem data_versions), nên khi dữ liệu
+  chưa đổi, cùng yêu cầu luôn trỏ tới cùng một file PDF đã dựng: trả ngay từ
+  đĩa (ETag = id job) thay vì truy vấn và dàn trang lại.
+- Dữ liệu đổi -> tem đổi -> id mới -> dựng lại trong tiến trình con, không
+  chiếm worker gunicorn. Hai yêu cầu giống hệt nhau trong lúc đang dựng dùng
+  chung một job (file khóa tạo bằng O_EXCL).
+- Mỗi worker gunicorn có process pool riêng, nhưng tiến trình con phải giữ một
+  trong `REPORT_WORKERS` "suất dựng" (file `slot-<i>.sem` khóa bằng flock trong
+  `REPORT_DIR`) mới được dựng: dù có bao nhiêu worker, toàn máy chỉ dựng tối đa
+  `REPORT_WORKERS` báo cáo cùng lúc; job khác ở trạng thái 'queued' chờ suất.
+- Trạng thái job và PDF nằm trên đĩa (`REPORT_DIR`), mọi worker gunicorn đều
+  đọc được. Tổng dung lượng giới hạn bởi `REPORT_CACHE_MAX_MB` (xóa file ít
+  dùng nhất trước, theo mtime được cập nhật mỗi lần dùng); file không được
+  dùng quá `REPORT_RETENTION_HOURS` cũng bị xóa.
+
+`REPORT_WORKERS = 0` dựng PDF ngay trong request (môi trường phát triển).
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import re
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import Flask, current_app
+from ..extensions import db
+from .data_versions import get_versions
+from .scheduler_leader import FileLock
+
+# writer: tên hàm trong pdf_reports; filename: tiền tố tên file tải về;
+# tables: các bảng báo cáo đọc (thay đổi ở đó làm báo cáo cũ hết hiệu lực)
+ReportType = namedtuple('ReportType', 'writer filename tables')
+
+REPORT_TYPES = {
+    'borrows': ReportType('write_borrows_report', 'bao_cao_muon_tra',
+                          ('borrow_records', 'users', 'books')),
+    'books': ReportType('write_books_report', 'bao_cao_sach', ('books',)),
+    'statistics': ReportType('write_statistics_report', 'bao_cao_thong_ke',
+                             ('books', 'users', 'borrow_records', 'reservations')),
+}
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+_JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+# Chu kỳ thử lại khi chờ suất dựng (giây)
+SLOT_POLL_SECONDS = 0.5
+
+_executor = None
+_executor_lock = threading.Lock()
+_worker_app = None
+
+
+class ReportJobError(Exception):
+    pass
+
+
+# --- Lưu trạng thái trên đĩa -------------------------------------------------
+
+def report_dir():
+    path = current_app.config.get('REPORT_DIR')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _meta_path(directory, job_id):
+    return os.path.join(directory, f'{job_id}.json')
+
+
+def _pdf_path(directory, job_id):
+    return os.path.join(directory, f'{job_id}.pdf')
+
+
+def _lock_path(directory, job_id):
+    return os.path.join(directory, f'{job_id}.lock')
+
+
+def _write_meta(directory, job):
+    # Ghi file tạm rồi os.replace để người đọc không thấy JSON ghi dở
+    path = _meta_path(directory, job['id'])
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(job, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _read_meta(directory, job_id):
+    try:
+        with open(_meta_path(directory, job_id), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _touch(path):
+    """Đánh dấu vừa dùng (mtime) cho việc xóa theo LRU; False nếu file đã bị xóa"""
+    try:
+        os.utime(path)
+        return True
+    except OSError:
+        return False
+
+
+def job_key(report_type, params, stamp):
+    raw = json.dumps([report_type, params, stamp], sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def _is_stale(directory, job, now=None):
+    if job['status'] not in ACTIVE_STATUSES:
+        return False
+    now = now or time.time()
+    timeout = current_app.config.get('REPORT_JOB_TIMEOUT', 600)
+    if job['status'] == 'running':
+        return now - job.get('started_at', job['created_at']) > timeout
+    # Job đang chờ suất dựng chạm file khóa mỗi lần thử lại
+    try:
+        return now - os.path.getmtime(_lock_path(directory, job['id'])) > timeout
+    except OSError:
+        return True
+
+
+def get_job(job_id):
+    """Đọc trạng thái job; None nếu không tồn tại hoặc id không hợp lệ"""
+    if not _JOB_ID.match(job_id or ''):
+        return None
+    directory = report_dir()
+    job = _read_meta(directory, job_id)
+    if job and _is_stale(directory, job):
+        job.update(status='failed', error='Quá thời gian dựng báo cáo')
+    if job and job['status'] == 'done' and not os.path.exists(_pdf_path(directory, job_id)):
+        return None  # PDF vừa bị xóa khỏi cache
+    return job
+
+
+def open_job_file(job):
+    """Đường dẫn PDF của job đã xong (đánh dấu vừa dùng); None nếu vừa bị xóa"""
+    path = _pdf_path(report_dir(), job['id'])
+    return path if _touch(path) else None
+
+
+# --- Tiến trình con -----------------------------------------------------------
+
+def _picklable_config(app):
+    config = {}
+    for key, value in app.config.items():
+        if not key.isupper():
+            continue
+        try:
+            pickle.dumps(value)
+        except Exception:
+            continue
+        config[key] = value
+    return config
+
+
+def _init_worker(config):
+    """Tiến trình con chỉ cần kết nối database, không khởi động scheduler/blueprint"""
+    global _worker_app
+    app = Flask('report_worker')
+    app.config.update(config)
+    db.init_app(app)
+    _worker_app = app
+
+
+def _render(directory, job_id, report_type, params):
+    """Dựng PDF cho job (chạy trong tiến trình con hoặc ngay trong request)"""
+    from . import pdf_reports
+
+    job = _read_meta(directory, job_id)
+    job.update(status='running', started_at=time.time())
+    _write_meta(directory, job)
+
+    final = _pdf_path(directory, job_id)
+    partial = f'{final}.part'
+    try:
+        write = getattr(pdf_reports, REPORT_TYPES[report_type].writer)
+        with open(partial, 'wb') as f:
+            write(f, **params)
+        os.replace(partial, final)
+        job.update(status='done', size=os.path.getsize(final))
+    except Exception as e:
+        _remove(partial)
+        job.update(status='failed', error=str(e))
+    finally:
+        job['finished_at'] = time.time()
+        _write_meta(directory, job)
+        _remove(_lock_path(directory, job_id))
+    return job['status']
+
+
+def _acquire_slot(directory, job_id, slots):
+    """Chờ tới khi giữ được một trong `slots` suất dựng (dùng chung mọi tiến trình)"""
+    while True:
+        for index in range(slots):
+            lock = FileLock(os.path.join(directory, f'slot-{index}.sem'))
+            if lock.try_acquire():
+                return lock
+        _touch(_lock_path(directory, job_id))  # job vẫn sống, đang chờ
+        time.sleep(SLOT_POLL_SECONDS)
+
+
+def _run_in_worker(directory, job_id, report_type, params, max_bytes):
+    with _worker_app.app_context():
+        slot = _acquire_slot(directory, job_id, max(1, _worker_app.config.get('REPORT_WORKERS', 2)))
+        try:
+            return _render(directory, job_id, report_type, params)
+        finally:
+            slot.release()
+            db.session.remove()
+            evict_reports(directory, max_bytes)
+
+
+def _get_executor(app):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: không fork tiến trình đang có luồng scheduler/kết nối database
+            _executor = ProcessPoolExecutor(
+                max_workers=app.config['REPORT_WORKERS'],
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(_picklable_config(app),)
+            )
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _on_done(app, directory, job_id):
+    def callback(future):
+        # Tiến trình con chết giữa chừng (BrokenProcessPool...): ghi nhận lỗi
+        if future.cancelled():
+            error = 'Job bị hủy khi dựng lại process pool'
+        else:
+            error = future.exception()
+            if error is None:
+                return
+        job = _read_meta(directory, job_id) or {'id': job_id}
+        job.update(status='failed', error=str(error), finished_at=time.time())
+        _write_meta(directory, job)
+        _remove(_lock_path(directory, job_id))
+        app.logger.error(f'Lỗi dựng báo cáo {job_id}: {error}')
+    return callback
+
+
+# --- API cho route ------------------------------------------------------------
+
+def _max_bytes():
+    return current_app.config.get('REPORT_CACHE_MAX_MB', 200) * 1024 * 1024
+
+
+def submit_report(report_type, params, requested_by=None):
+    """Trả về job của báo cáo: có sẵn trong cache, đang dựng, hoặc vừa tạo."""
+    if report_type not in REPORT_TYPES:
+        raise ReportJobError(f'Loại báo cáo không hợp lệ: {report_type}')
+    app = current_app._get_current_object()
+    directory = report_dir()
+    stamp = get_versions(REPORT_TYPES[report_type].tables)
+    job_id = job_key(report_type, params, stamp)
+    lock = _lock_path(directory, job_id)
+    timeout = app.config.get('REPORT_JOB_TIMEOUT', 600)
+
+    for _ in range(50):
+        job = get_job(job_id)
+        if job and job['status'] == 'done' and _touch(_pdf_path(directory, job_id)):
+            return job  # trúng cache
+        if job and job['status'] in ACTIVE_STATUSES and os.path.exists(lock):
+            return job  # cùng báo cáo đang được dựng: dùng chung
+        try:
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock) > timeout:
+                    _remove(lock)  # khóa mồ côi của job đã chết
+                    continue
+            except OSError:
+                continue
+            time.sleep(0.02)  # tiến trình giữ khóa chưa kịp ghi trạng thái
+    else:
+        raise ReportJobError('Không tạo được job báo cáo, vui lòng thử lại')
+
+    now = time.time()
+    suffix = ''.join(f'_{value}' for _, value in sorted(params.items()))
+    job = {
+        'id': job_id,
+        'type': report_type,
+        'params': params,
+        'stamp': list(stamp),
+        'status': 'queued',
+        'created_at': now,
+        'requested_by': requested_by,
+        'filename': f'{REPORT_TYPES[report_type].filename}{suffix}_'
+                    f'{time.strftime("%Y%m%d", time.localtime(now))}.pdf',
+    }
+    _write_meta(directory, job)
+
+    if app.config.get('REPORT_WORKERS', 2) <= 0:
+        _render(directory, job_id, report_type, params)
+        evict_reports(directory, _max_bytes())
+        return _read_meta(directory, job_id)
+
+    args = (directory, job_id, report_type, params, _max_bytes())
+    try:
+        future = _get_executor(app).submit(_run_in_worker, *args)
+    except BrokenProcessPool:
+        # Một tiến trình con đã chết: dựng lại pool rồi gửi lại
+        _reset_executor()
+        future = _get_executor(app).submit(_run_in_worker, *args)
+    future.add_done_callback(_on_done(app, directory, job_id))
+    return job
+
+
+def _finished_jobs(directory):
+    """[(lần dùng cuối, dung lượng, id)] của các job đã xong/lỗi"""
+    jobs = []
+    for name in os.listdir(directory):
+        job_id, ext = os.path.splitext(name)
+        if ext != '.json' or not _JOB_ID.match(job_id):
+            continue
+        if os.path.exists(_lock_path(directory, job_id)):
+            continue  # đang dựng
+        try:
+            stat = os.stat(_pdf_path(directory, job_id))
+            jobs.append((stat.st_mtime, stat.st_size, job_id))
+        except OSError:
+            jobs.append((os.path.getmtime(_meta_path(directory, job_id)), 0, job_id))
+    return jobs
+
+
+def _delete_job(directory, job_id):
+    _remove(_pdf_path(directory, job_id))
+    _remove(_meta_path(directory, job_id))
+
+
+def evict_reports(directory, max_bytes):
+    """Xóa PDF ít được dùng nhất cho tới khi tổng dung lượng <= max_bytes
+    (luôn giữ lại file vừa dùng gần nhất)"""
+    jobs = sorted(_finished_jobs(directory))
+    total = sum(size for _, size, _ in jobs)
+    removed = 0
+    for _, size, job_id in jobs[:-1]:
+        if total <= max_bytes:
+            break
+        _delete_job(directory, job_id)
+        total -= size
+        removed += 1
+    return removed
+
+
+def purge_reports(now=None):
+    """Xóa báo cáo không được dùng quá thời gian lưu rồi áp giới hạn dung lượng.
+
+    Trả về số báo cáo đã xóa.
+    """
+    now = now or time.time()
+    directory = report_dir()
+    max_age = current_app.config.get('REPORT_RETENTION_HOURS', 24) * 3600
+    timeout = current_app.config.get('REPORT_JOB_TIMEOUT', 600)
+
+    # Khóa/file dở dang của tiến trình đã chết
+    for name in os.listdir(directory):
+        if name.endswith(('.lock', '.part', '.tmp')):
+            path = os.path.join(directory, name)
+            try:
+                if now - os.path.getmtime(path) > timeout:
+                    _remove(path)
+            except OSError:
+                pass
+
+    removed = 0
+    for last_used, _, job_id in _finished_jobs(directory):
+        if now - last_used >= max_age:
+            _delete_job(directory, job_id)
+            removed += 1
+    return removed + evict_reports(directory, _max_bytes())
@@ -0,0 +1,182 @@
+"""
+Chọn một tiến trình "leader" duy nhất chạy các job của scheduler.
+
+Mọi tiến trình (các worker gunicorn, hoặc các tiến trình `flask scheduler`) đều
+start APScheduler ở trạng thái tạm dừng và chạy một luồng bầu chọn: tiến trình
+giữ được khóa thì resume scheduler, các tiến trình khác thử lại mỗi
+`SCHEDULER_LEADER_POLL_SECONDS` giây. Khóa tự nhả khi tiến trình giữ khóa chết
+nên một tiến trình khác lên thay:
+
+- PostgreSQL: advisory lock mức session (`pg_try_advisory_lock`) trên một kết
+  nối riêng giữ suốt thời gian làm leader; mất kết nối là mất khóa.
+- SQLite (và database khác): khóa file `SCHEDULER_LOCK_FILE` (flock/msvcrt),
+  đủ cho SQLite vì mọi tiến trình dùng chung file database trên cùng máy.
+"""
+import os
+import threading
+import zlib
+from flask import current_app
+from sqlalchemy import text
+from ..extensions import db
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Khóa advisory cố định cho scheduler của ứng dụng
+ADVISORY_LOCK_KEY = zlib.crc32(b'library-scheduler-leader')
+
+
+class AdvisoryLock:
+    """Advisory lock của PostgreSQL giữ trên một kết nối riêng"""
+
+    def __init__(self, engine, key=ADVISORY_LOCK_KEY):
+        self.engine = engine
+        self.key = key
+        self._connection = None
+
+    def try_acquire(self):
+        connection = self.engine.connect()
+        try:
+            acquired = connection.execute(
+                text('SELECT pg_try_advisory_lock(:key)'), {'key': self.key}
+            ).scalar()
+            connection.commit()  # khóa mức session vẫn giữ sau commit
+        except Exception:
+            connection.close()
+            raise
+        if acquired:
+            self._connection = connection
+        else:
+            connection.close()
+        return bool(acquired)
+
+    def still_held(self):
+        # Kết nối còn sống thì khóa còn (PostgreSQL chỉ nhả khi session kết thúc)
+        self._connection.execute(text('SELECT 1'))
+        self._connection.commit()
+        return True
+
+    def release(self):
+        if self._connection is None:
+            return
+        try:
+            self._connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': self.key})
+            self._connection.commit()
+        finally:
+            # Kết nối có thể đã hỏng: bỏ hẳn thay vì trả về pool
+            self._connection.invalidate()
+            self._connection.close()
+            self._connection = None
+
+
+class FileLock:
+    """Khóa độc quyền trên một file (hệ điều hành nhả khóa khi tiến trình kết thúc)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def try_acquire(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        handle = open(self.path, 'a+')
+        try:
+            if fcntl:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            handle.close()
+            return False
+        handle.seek(0)
+        handle.truncate()
+        handle.write(str(os.getpid()))
+        handle.flush()
+        self._file = handle
+        return True
+
+    def still_held(self):
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        try:
+            if fcntl:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._file.close()
+            self._file = None
+
+
+def leader_lock(app):
+    """Khóa leader phù hợp với database đang dùng"""
+    if db.engine.dialect.name == 'postgresql':
+        return AdvisoryLock(db.engine)
+    return FileLock(app.config['SCHEDULER_LOCK_FILE'])
+
+
+class LeaderElector:
+    """Luồng nền giành/giữ khóa leader và gọi `on_elected` / `on_demoted` khi đổi vai"""
+
+    def __init__(self, app, on_elected, on_demoted):
+        self.app = app
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.is_leader = False
+        self._stop = threading.Event()
+        self._thread = None
+        with app.app_context():
+            self._lock = leader_lock(app)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='scheduler-leader', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        interval = self.app.config.get('SCHEDULER_LEADER_POLL_SECONDS', 15)
+        while not self._stop.is_set():
+            with self.app.app_context():
+                self.check()
+            self._stop.wait(interval)
+
+    def check(self):
+        """Một vòng bầu chọn: giữ khóa nếu đang là leader, nếu không thì thử giành"""
+        try:
+            if self.is_leader:
+                if not self._lock.still_held():
+                    self._demote('mất khóa')
+            elif self._lock.try_acquire():
+                self.is_leader = True
+                current_app.logger.info(f'Tiến trình {os.getpid()} là leader của scheduler')
+                self.on_elected()
+        except Exception as e:
+            current_app.logger.error(f'Lỗi bầu chọn leader scheduler: {str(e)}')
+            if self.is_leader:
+                self._demote(str(e))
+
+    def _demote(self, reason, log=None):
+        self.is_leader = False
+        (log or current_app.logger.warning)(f'Tiến trình {os.getpid()} thôi làm leader scheduler ({reason})')
+        try:
+            self.on_demoted()
+        finally:
+            try:
+                self._lock.release()
+            except Exception:
+                pass
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        with self.app.app_context():
+            if self.is_leader:
+                self._demote('dừng', current_app.logger.info)
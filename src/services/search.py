@@ -0,0 +1,174 @@
+"""
+Tìm kiếm toàn văn (full-text search) cho danh mục sách.
+
+- SQLite: bảng ảo FTS5 `books_fts` (external content trỏ vào `books`),
+  được đồng bộ bằng trigger khi thêm/sửa/xóa sách.
+- PostgreSQL: cột `search_vector` (tsvector, GENERATED ... STORED) + chỉ mục GIN.
+
+Database cũ chưa tạo chỉ mục (hoặc backend khác) sẽ quay về tìm kiếm ILIKE.
+"""
+import re
+from sqlalchemy import event, func, inspect, literal_column, table, column, text
+from ..extensions import db
+from ..models import Book
+
+# Trọng số bm25 theo thứ tự cột: title, author, category, isbn
+FTS_WEIGHTS = (10.0, 5.0, 2.0, 10.0)
+MAX_TERMS = 16
+
+SQLITE_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+        title, author, category, isbn,
+        content='books', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts(rowid, title, author, category, isbn)
+        VALUES (new.id, new.title, new.author, new.category, new.isbn);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author, category, isbn)
+        VALUES ('delete', old.id, old.title, old.author, old.category, old.isbn);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE OF title, author, category, isbn ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author, category, isbn)
+        VALUES ('delete', old.id, old.title, old.author, old.category, old.isbn);
+        INSERT INTO books_fts(rowid, title, author, category, isbn)
+        VALUES (new.id, new.title, new.author, new.category, new.isbn);
+    END
+    """,
+]
+
+POSTGRES_DDL = [
+    """
+    ALTER TABLE books ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(isbn, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(author, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(category, '')), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_books_search_vector ON books USING GIN (search_vector)",
+]
+
+books_fts = table('books_fts', column('rowid'))
+
+# Cache kết quả kiểm tra chỉ mục theo từng database URL
+_backend_cache = {}
+
+
+def _search_terms(q):
+    """Tách chuỗi tìm kiếm thành các từ (chỉ giữ ký tự chữ/số)"""
+    return re.findall(r'\w+', q or '', re.UNICODE)[:MAX_TERMS]
+
+
+def _install(connection):
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        statements = SQLITE_DDL
+    elif dialect == 'postgresql':
+        statements = POSTGRES_DDL
+    else:
+        return False
+    for statement in statements:
+        connection.execute(text(statement))
+    return True
+
+
+@event.listens_for(Book.__table__, 'after_create')
+def _create_search_index(target, connection, **kw):
+    """Tạo chỉ mục tìm kiếm ngay khi `db.create_all()` tạo bảng books"""
+    _install(connection)
+    _backend_cache.clear()
+
+
+def search_backend():
+    """Trả về 'sqlite' / 'postgresql' nếu chỉ mục toàn văn đã sẵn sàng, ngược lại None"""
+    engine = db.engine
+    key = str(engine.url)
+    if key not in _backend_cache:
+        dialect = engine.dialect.name
+        inspector = inspect(engine)
+        available = False
+        if dialect == 'sqlite':
+            available = inspector.has_table('books_fts')
+        elif dialect == 'postgresql':
+            available = 'search_vector' in {c['name'] for c in inspector.get_columns('books')}
+        _backend_cache[key] = dialect if available else None
+    return _backend_cache[key]
+
+
+def ensure_search_index():
+    """Tạo chỉ mục cho database đã tồn tại và nạp dữ liệu sách hiện có.
+
+    Trả về True nếu chỉ mục vừa được tạo mới.
+    """
+    _backend_cache.clear()
+    if search_backend():
+        return False
+    with db.engine.begin() as connection:
+        if not _install(connection):
+            return False
+        if connection.dialect.name == 'sqlite':
+            connection.execute(text("INSERT INTO books_fts(books_fts) VALUES ('rebuild')"))
+    _backend_cache.clear()
+    return True
+
+
+def rebuild_search_index():
+    """Dựng lại toàn bộ chỉ mục từ bảng books"""
+    ensure_search_index()
+    with db.engine.begin() as connection:
+        if connection.dialect.name == 'sqlite':
+            connection.execute(text("INSERT INTO books_fts(books_fts) VALUES ('rebuild')"))
+        elif connection.dialect.name == 'postgresql':
+            connection.execute(text("REINDEX INDEX ix_books_search_vector"))
+
+
+def _ilike_filter(query, q):
+    ilike = f"%{q}%"
+    return query.filter(
+        (Book.title.ilike(ilike)) |
+        (Book.author.ilike(ilike)) |
+        (Book.category.ilike(ilike)) |
+        (Book.isbn.ilike(ilike))
+    )
+
+
+def search_filter(query, q):
+    """Lọc `query` (trên Book) theo từ khóa `q`.
+
+    Trả về (query, rank) với `rank` là biểu thức độ liên quan (giá trị nhỏ
+    hơn = liên quan hơn), hoặc None khi đang dùng ILIKE.
+    """
+    terms = _search_terms(q)
+    backend = search_backend() if terms else None
+
+    if backend == 'sqlite':
+        fts = literal_column('books_fts')
+        match = ' '.join(f'"{term}"*' for term in terms)
+        query = query.join(books_fts, books_fts.c.rowid == Book.id).filter(fts.op('MATCH')(match))
+        return query, func.bm25(fts, *FTS_WEIGHTS)
+
+    if backend == 'postgresql':
+        vector = literal_column('books.search_vector')
+        tsquery = func.to_tsquery('simple', ' & '.join(f'{term}:*' for term in terms))
+        return query.filter(vector.op('@@')(tsquery)), -func.ts_rank(vector, tsquery)
+
+    return _ilike_filter(query, q), None
+
+
+def apply_search(query, q):
+    """Lọc `query` (trên Book) theo từ khóa `q`, sắp xếp theo độ liên quan"""
+    query, rank = search_filter(query, q)
+    if rank is None:
+        return query
+    return query.order_by(rank, Book.id)
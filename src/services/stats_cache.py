@@ -0,0 +1,145 @@
+"""
+Cache trong tiến trình cho số liệu dashboard/thống kê, kiểu stale-while-revalidate.
+
+- Còn hạn (`STATS_CACHE_TTL`) và dữ liệu chưa đổi: trả ngay giá trị đã cache.
+- Hết hạn hoặc dữ liệu đã đổi: vẫn trả giá trị cũ (tối đa thêm
+  `STATS_CACHE_MAX_STALE` giây) và chỉ MỘT luồng nền tính lại.
+- Chưa có giá trị: chỉ một luồng tính, các request cùng lúc chờ kết quả đó
+  thay vì cùng truy vấn database.
+
+"Dữ liệu đã đổi" dùng chung giữa các tiến trình: mỗi lần đọc so tem phiên bản
+dữ liệu (data_versions, một truy vấn trên vài dòng của bảng counters) với tem
+lúc tính, nên ghi ở worker gunicorn nào thì mọi worker cũng thấy giá trị cũ.
+Còn cache và việc "chỉ một luồng tính lại" là theo từng tiến trình: N worker
+có thể cùng tính lại một khóa (tối đa N lần, không phải mỗi request một lần).
+
+Giá trị cache phải là dữ liệu thuần (dict/list), không phải đối tượng ORM.
+"""
+import threading
+import time
+from flask import current_app
+from .data_versions import TRACKED_TABLES, get_versions
+
+
+class StatsCache:
+    def __init__(self):
+        self._entries = {}  # key -> (giá trị, thời điểm tính, (thế hệ, tem dữ liệu))
+        self._key_locks = {}
+        self._refreshing = set()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    def _is_fresh(self, entry, now, ttl, stamp):
+        _, computed_at, generation = entry
+        return generation == (self._generation, stamp) and now - computed_at < ttl
+
+    def _store(self, key, value, computed_at, generation):
+        with self._lock:
+            # Nếu bị invalidate trong lúc tính, giá trị vẫn dùng được nhưng bị coi là cũ
+            self._entries[key] = (value, computed_at, generation)
+
+    def _refresh_in_background(self, app, key, compute, stamp):
+        def run():
+            with app.app_context():
+                with self._lock:
+                    generation = (self._generation, stamp)
+                try:
+                    started = time.monotonic()
+                    value = compute()
+                    self._store(key, value, started, generation)
+                    with self._lock:
+                        self.refreshes += 1
+                except Exception as e:
+                    with self._lock:
+                        self.errors += 1
+                    app.logger.error(f'Lỗi làm mới cache thống kê "{key}": {e}')
+                finally:
+                    with self._lock:
+                        self._refreshing.discard(key)
+
+        threading.Thread(target=run, name=f'stats-cache-{key}', daemon=True).start()
+
+    def get(self, key, compute, ttl, max_stale, stamp=None):
+        """`stamp`: tem dữ liệu hiện tại; khác tem lúc tính thì giá trị bị coi là cũ"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._is_fresh(entry, now, ttl, stamp):
+                    self.hits += 1
+                    return entry[0]
+                if now - entry[1] < ttl + max_stale:
+                    self.stale_hits += 1
+                    start_refresh = key not in self._refreshing
+                    if start_refresh:
+                        self._refreshing.add(key)
+                    stale_value = entry[0]
+                else:
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        if entry is not None:
+            if start_refresh:
+                self._refresh_in_background(current_app._get_current_object(), key, compute, stamp)
+            return stale_value
+
+        with key_lock:
+            # Luồng khác có thể vừa tính xong trong lúc chờ khóa
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and self._is_fresh(entry, time.monotonic(), ttl, stamp):
+                    return entry[0]
+                generation = (self._generation, stamp)
+            started = time.monotonic()
+            value = compute()
+            self._store(key, value, started, generation)
+            return value
+
+    def invalidate(self):
+        """Đánh dấu mọi giá trị (của tiến trình này) là cũ; lần đọc sau sẽ kích hoạt tính lại"""
+        with self._lock:
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'refreshes': self.refreshes,
+                'errors': self.errors,
+                'hit_ratio': round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+                'keys': sorted(self._entries),
+                'refreshing': sorted(self._refreshing),
+            }
+
+
+_cache = StatsCache()
+
+
+def cached_stats(key, compute):
+    """Đọc số liệu `key` qua cache; `compute()` trả về dữ liệu thuần"""
+    ttl = current_app.config.get('STATS_CACHE_TTL', 30)
+    if ttl <= 0:
+        return compute()
+    max_stale = current_app.config.get('STATS_CACHE_MAX_STALE', 300)
+    return _cache.get(key, compute, ttl, max_stale, get_versions(TRACKED_TABLES))
+
+
+def invalidate_stats():
+    """Gọi sau khi commit thay đổi sách/mượn/trả/đặt trước/độc giả: tiến trình hiện tại
+    thấy ngay, các tiến trình khác thấy qua tem phiên bản dữ liệu"""
+    _cache.invalidate()
+
+
+def cache_stats():
+    """Số lượt hit/miss... để giám sát"""
+    return _cache.stats()
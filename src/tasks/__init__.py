@@ -1,2 +1,130 @@
 # Tasks package
+import os
+from ..extensions import scheduler
 
+# Bộ bầu chọn leader của tiến trình hiện tại (None nếu scheduler chưa start)
+elector = None
+
+
+def register_jobs(app):
+    """Đăng ký các job định kỳ vào scheduler"""
+    from .email_reminders import send_due_reminders, send_overdue_notifications
+    
+    # Gửi email nhắc nhở hàng ngày lúc 9:00 AM
+    try:
+        scheduler.add_job(
+            id='send_due_reminders',
+            func=send_due_reminders,
+            trigger='cron',
+            hour=9,
+            minute=0,
+            replace_existing=True
+        )
+    except Exception:
+        pass  # Job đã tồn tại
+    
+    # Gửi email cảnh báo quá hạn hàng ngày lúc 9:30 AM
+    try:
+        scheduler.add_job(
+            id='send_overdue_notifications',
+            func=send_overdue_notifications,
+            trigger='cron',
+            hour=9,
+            minute=30,
+            replace_existing=True
+        )
+    except Exception:
+        pass  # Job đã tồn tại
+    
+    # Gửi email trong hàng đợi (và thử lại thư lỗi) mỗi phút
+    from .email_reminders import deliver_outbox
+    try:
+        scheduler.add_job(
+            id='deliver_outbox',
+            func=deliver_outbox,
+            trigger='interval',
+            seconds=app.config.get('OUTBOX_DRAIN_INTERVAL_SECONDS', 60),
+            replace_existing=True
+        )
+    except Exception:
+        pass  # Job đã tồn tại
+    
+    # Đánh dấu quá hạn và cộng phí trễ hạn hàng đêm lúc 0:05
+    from .overdue import mark_overdue_loans
+    try:
+        scheduler.add_job(
+            id='mark_overdue_loans',
+            func=mark_overdue_loans,
+            trigger='cron',
+            hour=0,
+            minute=5,
+            replace_existing=True
+        )
+    except Exception:
+        pass  # Job đã tồn tại
+    
+    # Tính lại lượt mượn 30/365 ngày gần nhất hàng đêm lúc 0:15
+    from .popularity import refresh_borrow_windows
+    try:
+        scheduler.add_job(
+            id='refresh_borrow_windows',
+            func=refresh_borrow_windows,
+            trigger='cron',
+            hour=0,
+            minute=15,
+            replace_existing=True
+        )
+    except Exception:
+        pass  # Job đã tồn tại
+    
+    # Hủy giữ sách quá hạn nhận, chuyển cho người kế tiếp trong hàng đợi
+    from .holds import expire_pickup_holds
+    try:
+        scheduler.add_job(
+            id='expire_pickup_holds',
+            func=expire_pickup_holds,
+            trigger='interval',
+            minutes=app.config.get('HOLD_EXPIRY_INTERVAL_MINUTES', 60),
+            replace_existing=True
+        )
+    except Exception:
+        pass  # Job đã tồn tại
+    
+    # Xóa báo cáo PDF quá thời gian lưu mỗi giờ
+    from .reports import purge_old_reports
+    try:
+        scheduler.add_job(
+            id='purge_old_reports',
+            func=purge_old_reports,
+            trigger='interval',
+            hours=1,
+            replace_existing=True
+        )
+    except Exception:
+        pass  # Job đã tồn tại
+
+
+def start_scheduler(app):
+    """Start scheduler ở trạng thái tạm dừng; chỉ chạy job khi tiến trình này là leader"""
+    global elector
+    from ..services.scheduler_leader import LeaderElector
+
+    scheduler.start(paused=True)
+    if not scheduler.running:
+        return None  # Flask debug: tiến trình cha của reloader không chạy scheduler
+    register_jobs(app)
+
+    def on_elected():
+        scheduler.resume()
+
+    def on_demoted():
+        scheduler.pause()
+
+    elector = LeaderElector(app, on_elected, on_demoted)
+    # Bầu chọn ngay một lần để tiến trình đầu tiên chạy job không phải chờ
+    with app.app_context():
+        elector.check()
+    elector.start()
+    app.logger.info(f'Scheduler đã start (pid {os.getpid()}, '
+                    f'{"leader" if elector.is_leader else "dự phòng"})')
+    return elector
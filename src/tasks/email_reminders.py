@@ -1,36 +1,129 @@
 from datetime import date, timedelta
 from flask import current_app
-from flask_mail import Message
-from ..models import BorrowRecord
-from ..extensions import db, mail
+from ..extensions import scheduler
+from ..services.circulation import mark_overdue
+from ..services.email_outbox import OutboxWriter, outbox_key, drain_outbox, purge_outbox
+from ..services.read_models import loans_due_on, overdue_loans, patron_digests
+
+# Các cột email cần (một truy vấn JOIN, không lazy load record.user/record.book).
+# Dòng chỉ có cột (không phải đối tượng ORM) nên không vào identity map của session;
+# kết hợp yield_per (server-side cursor trên PostgreSQL) và ghi hàng đợi theo lô,
+# bộ nhớ của tác vụ không tăng theo số phiếu.
+REMINDER_COLUMNS = ('id', 'user_id', 'user_email', 'user_name', 'book_title', 'book_author',
+                    'due_date', 'fine_amount')
+
+
+def _outbox_row(record, kind, day, subject, body):
+    return {
+        'dedupe_key': outbox_key(kind, record.id, day),
+        'kind': kind,
+        'user_id': record.user_id,
+        'borrow_id': record.id,
+        'recipient': record.user_email,
+        'subject': subject,
+        'body': body,
+    }
+
+
+def _digest_body(digest, today, reminder_days):
+    overdue = [loan for loan in digest.loans if loan['overdue']]
+    due_soon = [loan for loan in digest.loans if not loan['overdue']]
+    if overdue:
+        subject = f'Cảnh báo: {len(overdue)} sách đã quá hạn trả'
+        if due_soon:
+            subject += f', {len(due_soon)} sách sắp đến hạn'
+    else:
+        subject = f'Nhắc nhở: {len(due_soon)} sách sắp đến hạn trả'
+
+    lines = [
+        f"Xin chào {digest.user_name or digest.user_email},",
+        "",
+        "Đây là email tổng hợp từ hệ thống quản lý thư viện.",
+    ]
+    if overdue:
+        lines += ["", "Sách đã quá hạn trả:"]
+        for loan in overdue:
+            lines.append(
+                f"  - \"{loan['title']}\" ({loan['author'] or 'N/A'}): hạn trả "
+                f"{loan['due_date'].strftime('%d/%m/%Y')}, quá hạn {(today - loan['due_date']).days} ngày, "
+                f"phí {loan['fine'] or 0:.0f} VNĐ"
+            )
+        lines += [
+            f"Tổng phí trễ hạn hiện tại: {digest.total_fine:.0f} VNĐ",
+            "Phí sẽ tiếp tục tăng mỗi ngày cho đến khi bạn trả sách.",
+        ]
+    if due_soon:
+        lines += ["", f"Sách sắp đến hạn trả (còn {reminder_days} ngày):"]
+        for loan in due_soon:
+            lines.append(
+                f"  - \"{loan['title']}\" ({loan['author'] or 'N/A'}): hạn trả "
+                f"{loan['due_date'].strftime('%d/%m/%Y')}"
+            )
+    lines += [
+        "",
+        "Vui lòng trả sách đúng hạn để tránh phí trễ hạn.",
+        "",
+        "Trân trọng,",
+        "Hệ thống quản lý thư viện",
+    ]
+    return subject, "\n".join(lines)
+
+
+def enqueue_digests(today):
+    """Chế độ digest: một thư mỗi độc giả mỗi ngày gồm sách sắp đến hạn và quá hạn"""
+    reminder_days = current_app.config.get('REMINDER_DAYS_BEFORE', 3)
+    # Đảm bảo trạng thái/phí quá hạn đã cập nhật (idempotent) trước khi gom
+    mark_overdue(today)
+    writer = OutboxWriter(chunk_rows())
+    for digest in patron_digests(today + timedelta(days=reminder_days), chunk_rows()):
+        subject, body = _digest_body(digest, today, reminder_days)
+        writer.add({
+            'dedupe_key': outbox_key('digest', digest.user_id, today),
+            'kind': 'digest',
+            'user_id': digest.user_id,
+            'borrow_id': None,
+            'recipient': digest.user_email,
+            'subject': subject,
+            'body': body,
+        })
+    # Hai tác vụ hằng ngày đều gọi tới đây: khóa theo (độc giả, ngày) nên chỉ một thư
+    added = writer.finish()
+    current_app.logger.info(f'Đã đưa {added}/{writer.total} email tổng hợp vào hàng đợi')
+    return added
+
+
+def chunk_rows():
+    return max(1, current_app.config.get('REMINDER_CHUNK_ROWS', 500))
+
+
+def digest_mode():
+    return current_app.config.get('REMINDER_MODE', 'per_loan') == 'digest'
 
 
 def send_due_reminders():
-    """Gửi email nhắc nhở trả sách trước 3 ngày"""
-    with current_app.app_context():
+    """Đưa email nhắc nhở trả sách trước 3 ngày vào hàng đợi (một thư mỗi phiếu mỗi hạn trả,
+    hoặc thư tổng hợp mỗi độc giả khi REMINDER_MODE = 'digest')"""
+    with scheduler.app.app_context():
+        if digest_mode():
+            return enqueue_digests(date.today())
+        
         reminder_days = current_app.config.get('REMINDER_DAYS_BEFORE', 3)
         target_date = date.today() + timedelta(days=reminder_days)
         
         # Tìm các bản ghi mượn sách có hạn trả = target_date và chưa trả
-        records = BorrowRecord.query.filter(
-            BorrowRecord.returned_at.is_(None),
-            BorrowRecord.due_date == target_date
-        ).all()
+        records = loans_due_on(target_date, *REMINDER_COLUMNS).execution_options(yield_per=chunk_rows())
         
-        sent_count = 0
+        writer = OutboxWriter(chunk_rows())
         for record in records:
             try:
-                user = record.user
-                book = record.book
-                
                 # Tạo nội dung email
-                subject = f'Nhắc nhở: Sách "{book.title}" sắp đến hạn trả'
+                subject = f'Nhắc nhở: Sách "{record.book_title}" sắp đến hạn trả'
                 body = f"""
-Xin chào {user.name or user.email},
+Xin chào {record.user_name or record.user_email},
 
 Đây là email nhắc nhở từ hệ thống quản lý thư viện.
 
-Bạn đã mượn sách "{book.title}" của tác giả {book.author or 'N/A'}.
+Bạn đã mượn sách "{record.book_title}" của tác giả {record.book_author or 'N/A'}.
 Hạn trả sách: {record.due_date.strftime('%d/%m/%Y')}
 Còn {reminder_days} ngày nữa là đến hạn trả.
 
@@ -40,49 +133,43 @@ Trân trọng,
 Hệ thống quản lý thư viện
                 """
                 
-                msg = Message(
-                    subject=subject,
-                    recipients=[user.email],
-                    body=body
-                )
-                
-                mail.send(msg)
-                sent_count += 1
+                writer.add(_outbox_row(record, 'due_reminder', record.due_date, subject, body))
                 
             except Exception as e:
-                current_app.logger.error(f'Lỗi gửi email cho user {record.user_id}: {str(e)}')
+                current_app.logger.error(f'Lỗi tạo email cho user {record.user_id}: {str(e)}')
                 continue
         
-        current_app.logger.info(f'Đã gửi {sent_count} email nhắc nhở')
-        return sent_count
+        # Khóa theo hạn trả: chạy lại/chạy muộn không gửi trùng, gia hạn thì nhắc lại
+        added = writer.finish()
+        current_app.logger.info(f'Đã đưa {added}/{writer.total} email nhắc nhở vào hàng đợi')
+        return added
 
 
 def send_overdue_notifications():
-    """Gửi email thông báo sách quá hạn"""
-    with current_app.app_context():
+    """Đưa email thông báo sách quá hạn vào hàng đợi (một thư mỗi phiếu mỗi ngày,
+    hoặc thư tổng hợp mỗi độc giả khi REMINDER_MODE = 'digest')"""
+    with scheduler.app.app_context():
         today = date.today()
+        if digest_mode():
+            return enqueue_digests(today)
         
-        # Tìm các bản ghi quá hạn
-        records = BorrowRecord.query.filter(
-            BorrowRecord.returned_at.is_(None),
-            BorrowRecord.due_date < today
-        ).all()
+        # Cập nhật trạng thái quá hạn và phí (một câu UPDATE) rồi đọc phí đã lưu
+        mark_overdue(today)
+        records = overdue_loans(*REMINDER_COLUMNS).execution_options(yield_per=chunk_rows())
         
-        sent_count = 0
+        writer = OutboxWriter(chunk_rows())
         for record in records:
             try:
-                user = record.user
-                book = record.book
                 days_overdue = (today - record.due_date).days
-                fine = record.calculate_fine()
+                fine = record.fine_amount or 0.0
                 
-                subject = f'Cảnh báo: Sách "{book.title}" đã quá hạn trả'
+                subject = f'Cảnh báo: Sách "{record.book_title}" đã quá hạn trả'
                 body = f"""
-Xin chào {user.name or user.email},
+Xin chào {record.user_name or record.user_email},
 
 Đây là email cảnh báo từ hệ thống quản lý thư viện.
 
-Bạn đã mượn sách "{book.title}" của tác giả {book.author or 'N/A'}.
+Bạn đã mượn sách "{record.book_title}" của tác giả {record.book_author or 'N/A'}.
 Hạn trả sách: {record.due_date.strftime('%d/%m/%Y')}
 Sách đã quá hạn {days_overdue} ngày.
 
@@ -95,19 +182,27 @@ Trân trọng,
 Hệ thống quản lý thư viện
                 """
                 
-                msg = Message(
-                    subject=subject,
-                    recipients=[user.email],
-                    body=body
-                )
-                
-                mail.send(msg)
-                sent_count += 1
+                writer.add(_outbox_row(record, 'overdue_notice', today, subject, body))
                 
             except Exception as e:
-                current_app.logger.error(f'Lỗi gửi email cho user {record.user_id}: {str(e)}')
+                current_app.logger.error(f'Lỗi tạo email cho user {record.user_id}: {str(e)}')
                 continue
         
-        current_app.logger.info(f'Đã gửi {sent_count} email cảnh báo quá hạn')
-        return sent_count
+        # Khóa theo ngày gửi: mỗi phiếu quá hạn nhận tối đa một thư mỗi ngày
+        added = writer.finish()
+        current_app.logger.info(f'Đã đưa {added}/{writer.total} email cảnh báo quá hạn vào hàng đợi')
+        return added
+
+
+def deliver_outbox():
+    """Gửi các email đến lượt trong hàng đợi (thử lại thư lỗi) và xóa thư cũ"""
+    with scheduler.app.app_context():
+        result = drain_outbox()
+        purge_outbox()
+        if result.batches:
+            current_app.logger.info(
+                f'Hàng đợi email: đã gửi {result.sent}, thử lại sau {result.retried}, '
+                f'bỏ cuộc {result.failed}'
+            )
+        return result
 
@@ -0,0 +1,14 @@
+from flask import current_app
+from ..extensions import scheduler
+from ..services.holds import expire_holds
+
+
+def expire_pickup_holds():
+    """Hủy các lượt giữ sách quá hạn nhận và chuyển sách cho người kế tiếp"""
+    with scheduler.app.app_context():
+        expired, allocated = expire_holds()
+        if expired:
+            current_app.logger.info(
+                f'Đã hủy {expired} lượt giữ sách quá hạn nhận, giữ tiếp cho {allocated} người'
+            )
+        return expired
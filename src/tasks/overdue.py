@@ -0,0 +1,11 @@
+from flask import current_app
+from ..extensions import scheduler
+from ..services.circulation import mark_overdue
+
+
+def mark_overdue_loans():
+    """Đánh dấu phiếu mượn quá hạn và cộng phí trễ hạn (chạy hàng đêm)"""
+    with scheduler.app.app_context():
+        updated = mark_overdue()
+        current_app.logger.info(f'Đã cập nhật trạng thái quá hạn và phí cho {updated} phiếu mượn')
+        return updated
@@ -0,0 +1,13 @@
+from flask import current_app
+from ..extensions import scheduler
+from ..services.popularity import refresh_windows
+from ..services.stats_cache import invalidate_stats
+
+
+def refresh_borrow_windows():
+    """Tính lại số lượt mượn 30/365 ngày gần nhất của sách và độc giả (chạy hàng đêm)"""
+    with scheduler.app.app_context():
+        updated = refresh_windows()
+        invalidate_stats()
+        current_app.logger.info(f'Đã tính lại lượt mượn theo cửa sổ cho {updated} sách/độc giả')
+        return updated
@@ -0,0 +1,12 @@
+from flask import current_app
+from ..extensions import scheduler
+from ..services.report_jobs import purge_reports
+
+
+def purge_old_reports():
+    """Xóa các báo cáo PDF đã quá thời gian lưu"""
+    with scheduler.app.app_context():
+        removed = purge_reports()
+        if removed:
+            current_app.logger.info(f'Đã xóa {removed} báo cáo PDF quá hạn lưu')
+        return removed
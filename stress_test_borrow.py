@@ -0,0 +1,105 @@
+"""
+Kiểm tra tải: nhiều độc giả mượn CÙNG MỘT đầu sách song song.
+Đảm bảo số bản có sẵn không bao giờ âm và số phiếu mượn = số bản đã trừ.
+
+Chạy: python stress_test_borrow.py [--threads 300] [--copies 25]
+Mặc định dùng một file SQLite tạm; đặt STRESS_DATABASE_URL để chạy trên PostgreSQL
+(database đó sẽ bị tạo bảng và thêm dữ liệu thử).
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=300)
+    parser.add_argument('--copies', type=int, default=25)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = os.environ.get(
+        'STRESS_DATABASE_URL', f"sqlite:///{os.path.join(tmpdir, 'stress.db')}"
+    )
+
+    from src.config import Config
+    # SQLite chỉ cho một writer: chờ khóa thay vì báo lỗi ngay
+    Config.SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 60}} \
+        if os.environ['DATABASE_URL'].startswith('sqlite') else {'pool_size': 20, 'max_overflow': 40}
+
+    from src.app import create_app
+    from src.extensions import db
+    from src.models import User, Book, BorrowRecord
+    from src.services.circulation import borrow_book, CirculationError
+    from src.services.counters import reconcile
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        book = Book(title='Stress test', total_copies=args.copies, available_copies=args.copies)
+        db.session.add(book)
+        users = [User(email=f'stress{i}@example.com', password_hash='-') for i in range(args.threads)]
+        db.session.add_all(users)
+        db.session.commit()
+        book_id = book.id
+        user_ids = [u.id for u in users]
+        reconcile()  # bộ đếm tổng như init_database.py
+
+    results = {'ok': 0, 'rejected': 0, 'errors': []}
+    lock = threading.Lock()
+    barrier = threading.Barrier(args.threads)
+
+    def worker(user_id):
+        with app.app_context():
+            barrier.wait()
+            try:
+                borrow_book(user_id, book_id)
+                key = 'ok'
+            except CirculationError:
+                key = 'rejected'
+            except Exception as e:  # lỗi hạ tầng (ví dụ khóa database)
+                db.session.rollback()
+                with lock:
+                    results['errors'].append(repr(e))
+                return
+            with lock:
+                results[key] += 1
+
+    threads = [threading.Thread(target=worker, args=(uid,)) for uid in user_ids]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    with app.app_context():
+        available = db.session.get(Book, book_id).available_copies
+        borrowed = BorrowRecord.query.filter_by(book_id=book_id).count()
+
+    print(f"Mượn thành công: {results['ok']}, bị từ chối: {results['rejected']}, "
+          f"lỗi: {len(results['errors'])}")
+    print(f"Còn lại: {available}, số phiếu mượn: {borrowed}")
+
+    failures = []
+    if results['errors']:
+        failures.append('lỗi hạ tầng (khóa database, hết kết nối...)')
+    if available < 0:
+        failures.append('available_copies bị âm')
+    if borrowed != results['ok'] or available != args.copies - borrowed:
+        failures.append('số phiếu mượn không khớp số bản đã trừ')
+    if results['ok'] > args.copies:
+        failures.append('cho mượn vượt quá số bản')
+    if not results['errors'] and args.threads >= args.copies and results['ok'] != args.copies:
+        failures.append('còn bản có sẵn nhưng lượt mượn bị từ chối')
+
+    if failures:
+        print('❌ ' + '; '.join(failures))
+        for error in results['errors'][:5]:
+            print('   ', error)
+        sys.exit(1)
+    print('✅ OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Kiểm tra tải: nhiều luồng cùng trả MỘT phiếu mượn (trộn batch_return và return_book).
+Đảm bảo chỉ một lượt trả thành công, số bản có sẵn không vượt tổng số bản
+và bộ đếm active_loans không bị trừ quá.
+
+Chạy: python stress_test_return.py [--threads 20] [--rounds 10]
+Mặc định dùng một file SQLite tạm; đặt STRESS_DATABASE_URL để chạy trên PostgreSQL
+(database đó sẽ bị tạo bảng và thêm dữ liệu thử).
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=20)
+    parser.add_argument('--rounds', type=int, default=10)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = os.environ.get(
+        'STRESS_DATABASE_URL', f"sqlite:///{os.path.join(tmpdir, 'stress.db')}"
+    )
+
+    from src.config import Config
+    # SQLite chỉ cho một writer: chờ khóa thay vì báo lỗi ngay
+    Config.SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 60}} \
+        if os.environ['DATABASE_URL'].startswith('sqlite') else {'pool_size': 20, 'max_overflow': 40}
+
+    from src.app import create_app
+    from src.extensions import db
+    from src.models import User, Book, BorrowRecord
+    from src.services.circulation import borrow_book, return_book, batch_return, CirculationError
+    from src.services.counters import get_counters
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        book = Book(title='Stress test', total_copies=1, available_copies=1)
+        user = User(email='stress-return@example.com', password_hash='-')
+        db.session.add_all([book, user])
+        db.session.commit()
+        book_id, user_id = book.id, user.id
+        get_counters()  # bộ đếm tổng như init_database.py
+
+    failures = []
+    errors = []
+    lock = threading.Lock()
+    for round_no in range(args.rounds):
+        with app.app_context():
+            borrow_id = borrow_book(user_id, book_id)[0].id
+
+        results = {'ok': 0, 'rejected': 0}
+        barrier = threading.Barrier(args.threads)
+
+        def worker(index):
+            with app.app_context():
+                barrier.wait()
+                try:
+                    if index % 2:
+                        ok = batch_return(borrow_ids=[borrow_id])[0]['ok']
+                    else:
+                        return_book(db.session.get(BorrowRecord, borrow_id))
+                        ok = True
+                except CirculationError:
+                    ok = False
+                except Exception as e:  # lỗi hạ tầng (ví dụ khóa database)
+                    db.session.rollback()
+                    with lock:
+                        errors.append(repr(e))
+                    return
+                with lock:
+                    results['ok' if ok else 'rejected'] += 1
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        with app.app_context():
+            available = db.session.get(Book, book_id).available_copies
+            active = get_counters()['active_loans']
+        if results['ok'] != 1 or available != 1 or active != 0:
+            failures.append(f"lượt {round_no}: {results['ok']} lượt trả thành công, "
+                            f"available_copies={available}, active_loans={active}")
+
+    print(f'{args.rounds} lượt x {args.threads} luồng, lỗi hạ tầng: {len(errors)}')
+    if failures or errors:
+        print('❌ ' + '\n   '.join(failures or ['lỗi hạ tầng']))
+        for error in errors[:5]:
+            print('   ', error)
+        sys.exit(1)
+    print('✅ OK')
+
+
+if __name__ == '__main__':
+    main()
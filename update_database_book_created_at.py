@@ -0,0 +1,59 @@
+"""
+Script để gán `created_at` cho các sách cũ còn NULL và đặt cột này NOT NULL
+(khóa sắp xếp "mới nhất" của phân trang keyset không được chứa NULL)
+Chạy: python update_database_book_created_at.py
+
+Dùng được cho cả SQLite và PostgreSQL; chạy lại nhiều lần cũng không sao.
+SQLite không đổi được ràng buộc của cột đã có: cột vẫn cho phép NULL nhưng
+không còn dòng NULL và ứng dụng luôn gán giá trị khi thêm sách.
+"""
+import os
+
+
+def update_database():
+    """Gán created_at còn thiếu (bằng thời điểm sớm nhất đã có) rồi đặt NOT NULL"""
+    print("=" * 50)
+    print("CẬP NHẬT DATABASE - NGÀY THÊM SÁCH")
+    print("=" * 50)
+
+    os.environ['FLASK_APP'] = 'src.app:create_app'
+
+    try:
+        from sqlalchemy import inspect, text
+        from src.app import create_app
+        from src.extensions import db
+
+        app = create_app()
+
+        with app.app_context():
+            if not inspect(db.engine).has_table('books'):
+                print("❌ Chưa có bảng books - chạy: python init_database.py trước")
+                return
+
+            with db.engine.begin() as connection:
+                # Sách cũ không rõ ngày thêm: xếp cùng sách cũ nhất (cuối danh sách "mới nhất")
+                result = connection.execute(text(
+                    "UPDATE books SET created_at = COALESCE("
+                    "(SELECT MIN(created_at) FROM books), CURRENT_TIMESTAMP) "
+                    "WHERE created_at IS NULL"
+                ))
+                print(f"✅ Đã gán created_at cho {result.rowcount} sách")
+
+                if db.engine.dialect.name == 'postgresql':
+                    connection.execute(text("ALTER TABLE books ALTER COLUMN created_at SET NOT NULL"))
+                    print("✅ Cột books.created_at đã là NOT NULL")
+
+        print("\n" + "=" * 50)
+        print("HOÀN TẤT!")
+        print("=" * 50)
+
+    except Exception as e:
+        print(f"\n❌ LỖI: {str(e)}")
+        print("\nHướng dẫn khắc phục:")
+        print("1. Đảm bảo DATABASE_URL trỏ đúng database")
+        print("2. Đảm bảo không có ứng dụng nào đang khóa database (SQLite)")
+        print("3. Thử chạy lại script")
+
+
+if __name__ == '__main__':
+    update_database()
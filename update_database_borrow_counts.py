@@ -0,0 +1,69 @@
+"""
+Script để thêm cột đếm lượt mượn (borrow_count, borrow_count_30d, borrow_count_365d)
+vào bảng books và users, rồi tính lại từ lịch sử mượn
+Chạy: python update_database_borrow_counts.py
+
+Dùng được cho cả SQLite và PostgreSQL; chạy lại nhiều lần cũng không sao.
+"""
+import os
+
+NEW_COLUMNS = ('borrow_count', 'borrow_count_30d', 'borrow_count_365d')
+
+
+def update_database():
+    """Thêm cột còn thiếu, tạo chỉ mục và tính lại số lượt mượn"""
+    print("=" * 50)
+    print("CẬP NHẬT DATABASE - SỐ LƯỢT MƯỢN")
+    print("=" * 50)
+
+    os.environ['FLASK_APP'] = 'src.app:create_app'
+
+    try:
+        from sqlalchemy import inspect, text
+        from src.app import create_app
+        from src.extensions import db
+        from src.models import Book, User
+        from src.services.popularity import rebuild_borrow_counts
+
+        app = create_app()
+
+        with app.app_context():
+            inspector = inspect(db.engine)
+            with db.engine.begin() as connection:
+                for table in ('books', 'users'):
+                    if not inspector.has_table(table):
+                        print(f"❌ Chưa có bảng {table} - chạy: python init_database.py trước")
+                        return
+                    columns = {column['name'] for column in inspector.get_columns(table)}
+                    for name in NEW_COLUMNS:
+                        if name in columns:
+                            print(f"✅ Cột {name} đã tồn tại trong bảng {table}")
+                            continue
+                        print(f"📝 Đang thêm cột {name} vào bảng {table}...")
+                        connection.execute(text(
+                            f"ALTER TABLE {table} ADD COLUMN {name} INTEGER NOT NULL DEFAULT 0"
+                        ))
+
+            for model in (Book, User):
+                for index in model.__table__.indexes:
+                    index.create(db.engine, checkfirst=True)
+            print("✅ Đã tạo chỉ mục cho top sách/độc giả")
+
+            updated = rebuild_borrow_counts()
+            print(f"✅ Đã tính lại số lượt mượn ({updated} sách/độc giả có lượt mượn trong 365 ngày)")
+
+        print("\n" + "=" * 50)
+        print("HOÀN TẤT!")
+        print("=" * 50)
+        print("\nCửa sổ 30/365 ngày được tính lại hàng đêm, hoặc chạy: flask rebuild-borrow-counts")
+
+    except Exception as e:
+        print(f"\n❌ LỖI: {str(e)}")
+        print("\nHướng dẫn khắc phục:")
+        print("1. Đảm bảo DATABASE_URL trỏ đúng database")
+        print("2. Đảm bảo không có ứng dụng nào đang khóa database (SQLite)")
+        print("3. Thử chạy lại script")
+
+
+if __name__ == '__main__':
+    update_database()
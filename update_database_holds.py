@@ -0,0 +1,86 @@
+"""
+Script để thêm các cột hàng đợi giữ sách (status, fulfilled_at, expires_at) vào bảng reservations
+Chạy: python update_database_holds.py
+
+Dùng được cho cả SQLite và PostgreSQL; chạy lại nhiều lần cũng không sao.
+"""
+import os
+
+NEW_COLUMNS = {
+    'status': "VARCHAR(20) DEFAULT 'waiting'",
+    'fulfilled_at': 'TIMESTAMP',
+    'expires_at': 'TIMESTAMP',
+}
+
+
+def update_database():
+    """Thêm cột còn thiếu, gán trạng thái cho đặt trước cũ và giữ sách cho hàng đợi hiện có"""
+    print("=" * 50)
+    print("CẬP NHẬT DATABASE - HÀNG ĐỢI GIỮ SÁCH")
+    print("=" * 50)
+
+    os.environ['FLASK_APP'] = 'src.app:create_app'
+
+    try:
+        from sqlalchemy import inspect, text
+        from src.app import create_app
+        from src.extensions import db
+        from src.models import Book, Reservation
+        from src.services.holds import allocate_holds
+
+        app = create_app()
+
+        with app.app_context():
+            inspector = inspect(db.engine)
+            if not inspector.has_table('reservations'):
+                print("❌ Chưa có bảng reservations - chạy: python init_database.py trước")
+                return
+
+            columns = {column['name'] for column in inspector.get_columns('reservations')}
+            with db.engine.begin() as connection:
+                for name, ddl in NEW_COLUMNS.items():
+                    if name in columns:
+                        print(f"✅ Cột {name} đã tồn tại trong bảng reservations")
+                        continue
+                    print(f"📝 Đang thêm cột {name} vào bảng reservations...")
+                    connection.execute(text(f"ALTER TABLE reservations ADD COLUMN {name} {ddl}"))
+
+                # Đặt trước cũ: đã thực hiện -> collected, còn lại -> waiting. Cột mới có
+                # DEFAULT 'waiting' nên các dòng cũ đã mang 'waiting' chứ không phải NULL:
+                # dựa vào `fulfilled` (đặt trước đã thực hiện không bao giờ là 'waiting')
+                connection.execute(text(
+                    "UPDATE reservations SET status = 'collected' "
+                    "WHERE fulfilled AND (status IS NULL OR status = 'waiting')"
+                ))
+                connection.execute(text(
+                    "UPDATE reservations SET status = 'waiting' WHERE status IS NULL"
+                ))
+
+            for index in Reservation.__table__.indexes:
+                index.create(db.engine, checkfirst=True)
+            print("✅ Đã tạo chỉ mục cho hàng đợi")
+
+            # Sách đang có sẵn mà vẫn có người chờ: giữ sách cho người đứng đầu hàng đợi
+            book_ids = [book_id for (book_id,) in db.session.query(Book.id).filter(
+                Book.available_copies > 0,
+                Book.reservations.any(Reservation.fulfilled.is_(False))
+            )]
+            allocated = allocate_holds(book_ids)
+            db.session.commit()
+            print(f"✅ Đã giữ sách cho {len(allocated)} lượt đặt trước đang chờ")
+
+        print("\n" + "=" * 50)
+        print("HOÀN TẤT!")
+        print("=" * 50)
+        print("\nLượt giữ quá hạn nhận được hủy tự động, hoặc chạy: flask expire-holds")
+
+    except Exception as e:
+        print(f"\n❌ LỖI: {str(e)}")
+        print("\nHướng dẫn khắc phục:")
+        print("1. Đảm bảo DATABASE_URL trỏ đúng database")
+        print("2. Đảm bảo không có ứng dụng nào đang khóa database (SQLite)")
+        print("3. Thử chạy lại script")
+
+
+if __name__ == '__main__':
+    update_database()
@@ -0,0 +1,61 @@
+"""
+Script để thêm các chỉ mục (index) còn thiếu vào database đã tồn tại
+(composite index cho borrow_records/reservations, chỉ mục một phần cho phiếu chưa trả, ...)
+Chạy: python update_database_indexes.py
+
+Dùng được cho cả SQLite và PostgreSQL; chạy lại nhiều lần cũng không sao.
+"""
+import os
+
+
+def update_database():
+    """Tạo các index khai báo trong src/models.py mà database chưa có"""
+    print("=" * 50)
+    print("CẬP NHẬT DATABASE - THÊM CHỈ MỤC")
+    print("=" * 50)
+
+    os.environ['FLASK_APP'] = 'src.app:create_app'
+
+    try:
+        from sqlalchemy import inspect
+        from src.app import create_app
+        from src.extensions import db
+        from src import models  # noqa: F401 - đăng ký các bảng vào metadata
+
+        app = create_app()
+
+        with app.app_context():
+            inspector = inspect(db.engine)
+            created = 0
+            for table in db.metadata.sorted_tables:
+                if not inspector.has_table(table.name):
+                    print(f"⚠️  Chưa có bảng {table.name} - chạy: python init_database.py")
+                    continue
+                existing = {index['name'] for index in inspector.get_indexes(table.name)}
+                for index in sorted(table.indexes, key=lambda i: i.name):
+                    if index.name in existing:
+                        print(f"✅ {index.name} đã tồn tại")
+                        continue
+                    print(f"📝 Đang tạo {index.name} trên {table.name}...")
+                    index.create(db.engine)
+                    created += 1
+
+            # Cập nhật thống kê để query planner chọn đúng chỉ mục mới
+            with db.engine.begin() as connection:
+                connection.exec_driver_sql('ANALYZE')
+
+        print("\n" + "=" * 50)
+        print(f"HOÀN TẤT! Đã tạo {created} chỉ mục mới.")
+        print("=" * 50)
+        print("\nKiểm tra kế hoạch truy vấn: python check_query_plans.py")
+
+    except Exception as e:
+        print(f"\n❌ LỖI: {str(e)}")
+        print("\nHướng dẫn khắc phục:")
+        print("1. Đảm bảo DATABASE_URL trỏ đúng database")
+        print("2. Đảm bảo không có ứng dụng nào đang khóa database (SQLite)")
+        print("3. Thử chạy lại script")
+
+
+if __name__ == '__main__':
+    update_database()